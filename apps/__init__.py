@@ -54,9 +54,37 @@ def create_app(config):
     from apps.commands import seed_jobs_command
     from apps.commands import seed_machines_command
     from apps.commands import seed_raw_materials_command
+    from apps.commands import gc_gridfs_command
+    from apps.commands import create_indexes_command
+    from apps.commands import refresh_maintenance_due_command
+    from apps.commands import snapshot_inventory_command
+    from apps.commands import import_bills_command
+    from apps.commands import sync_price_list_command
+    from apps.commands import import_records_command
+    from apps.commands import migrate_procurement_material_ids_command
+    from apps.commands import migrate_material_search_terms_command
+    from apps.commands import migrate_reservations_command
+    from apps.commands import forecast_stockouts_command
+    from apps.commands import generate_reorder_reminders_command
+    from apps.commands import reevaluate_suspended_operations_command
+    from apps.commands import recount_material_taxonomies_command
 
     app.cli.add_command(seed_jobs_command)
     app.cli.add_command(seed_machines_command)
     app.cli.add_command(seed_raw_materials_command)
+    app.cli.add_command(gc_gridfs_command)
+    app.cli.add_command(create_indexes_command)
+    app.cli.add_command(refresh_maintenance_due_command)
+    app.cli.add_command(snapshot_inventory_command)
+    app.cli.add_command(import_bills_command)
+    app.cli.add_command(sync_price_list_command)
+    app.cli.add_command(import_records_command)
+    app.cli.add_command(migrate_procurement_material_ids_command)
+    app.cli.add_command(migrate_material_search_terms_command)
+    app.cli.add_command(migrate_reservations_command)
+    app.cli.add_command(forecast_stockouts_command)
+    app.cli.add_command(generate_reorder_reminders_command)
+    app.cli.add_command(reevaluate_suspended_operations_command)
+    app.cli.add_command(recount_material_taxonomies_command)
 
     return app
@@ -2,13 +2,57 @@ import click
 import datetime
 import random
 import os
+import time
 from faker import Faker  # Import Faker
 import mimetypes  # NEW: Import mimetypes for content_type
+from flask import current_app
 from flask.cli import with_appcontext
-from collections import Counter
+from .pages.bulk_import import IMPORT_BATCH_SIZE, IMPORTERS, import_records
 from .pages.database import get_db
+from .pages.machines.maintenance import compute_maintenance_due
+from .pages.machines.meters import ensure_meter_collections
+from .pages.machines.status_log import ensure_status_log_indexes
+from .pages.inventory.bill_import import (
+    BILL_IMPORT_BATCH_SIZE,
+    ensure_bill_index,
+    import_bills,
+)
+from .pages.inventory.forecast import ensure_forecast_indexes, run_stockout_forecast
+from .pages.inventory.ledger import (
+    INVENTORY_LEDGER_COLLECTION,
+    INVENTORY_SNAPSHOTS_COLLECTION,
+    ensure_ledger_indexes,
+    record_stock_movements,
+    stock_movement,
+    take_inventory_snapshots,
+)
+from .pages.inventory.material_search import (
+    ensure_material_search_indexes,
+    material_search_terms,
+)
+from .pages.inventory.price_list import (
+    PRICE_LIST_BATCH_SIZE,
+    ensure_sku_index,
+    sync_price_list,
+)
+from .pages.inventory.reorder import ensure_reorder_indexes, generate_reorder_reminders
+from .pages.inventory.reservations import (
+    RESERVATIONS_COLLECTION,
+    ensure_reservation_indexes,
+)
+from .pages.inventory.taxonomy import (
+    TAXONOMIES,
+    ensure_taxonomy_indexes,
+    increment_counts,
+    recount,
+)
+from .pages.inventory.waitlist import (
+    ensure_material_wait_indexes,
+    reevaluate_waiting_operations,
+)
 from bson.objectid import ObjectId
 from gridfs import GridFS
+from pymongo import UpdateOne
 
 
 @click.command("seed-jobs")
@@ -195,10 +239,12 @@ def seed_machines_command(count, clear):
             "installation_date": installation_date,
             "warranty_expiry_date": warranty_expiry_date,
             "maintenance_schedule": maintenance_schedule,
+            "maintenance_due": compute_maintenance_due(maintenance_schedule),
             "operation_id": None,  # Placeholder
             "number_of_operations": 0,  # Placeholder
             "notes": notes,
             "file_metadata_ids": [],  # Placeholder - seeding files is more complex
+            "status_since": now,
             "created_at": fake.date_time_between(
                 start_date="-6m", end_date="now"
             ),  # Vary creation time slightly
@@ -235,6 +281,9 @@ def seed_raw_materials_command(count, clear):
         raw_materials_collection.delete_many({})
         categories_collection.delete_many({})
         suppliers_collection.delete_many({})
+        # The ledger and snapshots describe the cleared materials only
+        db[INVENTORY_LEDGER_COLLECTION].delete_many({})
+        db[INVENTORY_SNAPSHOTS_COLLECTION].delete_many({})
         # Also clear any previously seeded images from GridFS
         for grid_out in fs.find({"context": "seeded_raw_material_image"}):
             fs.delete(grid_out._id)
@@ -356,10 +405,13 @@ def seed_raw_materials_command(count, clear):
         material_data = {
             "material_name": material_name,
             "sku": sku,
+            "search_terms": material_search_terms(material_name, sku),
             "description": description,
             "uom": uom,
             "current_quantity": initial_quantity,
+            "reserved_quantity": 0,
             "reorder_level": reorder_level,
+            "below_reorder_level": initial_quantity <= reorder_level,
             "categories": categories,
             "suppliers": suppliers,
             "image_id": image_id,  # Use the randomly assigned image_id
@@ -371,25 +423,702 @@ def seed_raw_materials_command(count, clear):
 
     # Insert all materials
     if materials_to_create:
-        raw_materials_collection.insert_many(materials_to_create)
+        result = raw_materials_collection.insert_many(materials_to_create)
         click.echo(
             f"Successfully inserted {len(materials_to_create)} test raw materials."
         )
 
-        # Update category counts
-        category_counts = Counter(all_categories)
-        for name, num in category_counts.items():
-            categories_collection.update_one(  # This was already correct, no change needed here.
-                {"name": name}, {"$inc": {"count": num}}, upsert=True
-            )
-        click.echo(f"Updated counts for {len(category_counts)} categories.")
+        # Opening stock of every seeded material goes into the ledger
+        record_stock_movements(
+            db,
+            [
+                stock_movement(material_id, material["current_quantity"], "initial_stock")
+                for material_id, material in zip(
+                    result.inserted_ids, materials_to_create
+                )
+            ],
+        )
 
-        # Update supplier counts
-        supplier_counts = Counter(all_suppliers)
-        for name, num in supplier_counts.items():
-            suppliers_collection.update_one(  # This was already correct, no change needed here.
-                {"name": name}, {"$inc": {"count": num}}, upsert=True
-            )
-        click.echo(f"Updated counts for {len(supplier_counts)} suppliers.")
+        # Update category and supplier counts, one bulk_write each
+        increment_counts(db, "categories", all_categories)
+        click.echo(f"Updated counts for {len(set(all_categories))} categories.")
+        increment_counts(db, "suppliers", all_suppliers)
+        click.echo(f"Updated counts for {len(set(all_suppliers))} suppliers.")
     else:
         click.echo("No raw materials were created.")
+
+
+# --- GridFS garbage collection ---
+
+GC_STATE_ID = "gridfs_gc"
+
+# Every place a GridFS file id can be referenced from, as (collection, field).
+GRIDFS_REFERENCES = [
+    ("job_files_metadata", "gridfs_id"),
+    ("machine_files_metadata", "gridfs_id"),
+    ("raw_materials", "image_id"),
+    ("procurement_records", "bill_file_id"),
+]
+
+# File metadata collections and the collection their owner lives in.
+FILE_METADATA_OWNERS = [
+    ("job_files_metadata", "job_id", "jobs"),
+    ("machine_files_metadata", "machine_id", "machines"),
+]
+
+
+def _gc_batches(collection, query, state, phase, batch_size, projection=None):
+    """
+    Yields batches of documents from `collection` in _id order, starting after
+    the checkpoint saved for `phase`, so an interrupted run picks up where it
+    stopped.
+    """
+    last_id = state.get(phase)
+    while True:
+        batch_query = dict(query)
+        if last_id is not None:
+            batch_query["_id"] = {**batch_query.get("_id", {}), "$gt": last_id}
+        batch = list(
+            collection.find(batch_query, projection).sort("_id", 1).limit(batch_size)
+        )
+        if not batch:
+            return
+        yield batch
+        last_id = batch[-1]["_id"]
+
+
+def _gc_checkpoint(db, phase, last_id):
+    db.maintenance_state.update_one(
+        {"_id": GC_STATE_ID},
+        {"$set": {phase: last_id, "updated_at": datetime.datetime.now()}},
+        upsert=True,
+    )
+
+
+@click.command("gc-gridfs")
+@click.option("--batch-size", default=500, help="Documents examined per batch.")
+@click.option(
+    "--pause", default=0.2, help="Seconds to sleep between batches (throttling)."
+)
+@click.option(
+    "--min-age-hours",
+    default=24,
+    help="Ignore files and metadata newer than this, so in-flight uploads are safe.",
+)
+@click.option("--dry-run", is_flag=True, help="Report orphans without deleting them.")
+@click.option(
+    "--restart", is_flag=True, help="Discard the saved checkpoint and scan from the start."
+)
+@with_appcontext
+def gc_gridfs_command(batch_size, pause, min_age_hours, dry_run, restart):
+    """Deletes orphaned file metadata and GridFS blobs in resumable batches."""
+    db = get_db()
+    state_collection = db.maintenance_state
+
+    # The reference checks below are $in lookups on these fields.
+    for collection_name, field in GRIDFS_REFERENCES:
+        db[collection_name].create_index(field)
+
+    if restart:
+        state_collection.delete_one({"_id": GC_STATE_ID})
+    state = state_collection.find_one({"_id": GC_STATE_ID}) or {}
+    if state and not dry_run:
+        click.echo("Resuming from saved checkpoint.")
+
+    # ObjectIds embed their creation time, so the age cut-off is an _id bound.
+    cutoff_id = ObjectId.from_datetime(
+        datetime.datetime.utcnow() - datetime.timedelta(hours=min_age_hours)
+    )
+
+    metadata_removed = 0
+
+    # 1. Metadata whose owner or blob no longer exists. Removing it first lets
+    #    the blob pass below collect the blob in the same run.
+    for metadata_name, owner_field, owner_name in FILE_METADATA_OWNERS:
+        phase = f"metadata:{metadata_name}"
+        metadata_collection = db[metadata_name]
+        for batch in _gc_batches(
+            metadata_collection,
+            {"_id": {"$lt": cutoff_id}},
+            state,
+            phase,
+            batch_size,
+            {owner_field: 1, "gridfs_id": 1},
+        ):
+            owner_ids = [doc[owner_field] for doc in batch if doc.get(owner_field)]
+            blob_ids = [doc["gridfs_id"] for doc in batch if doc.get("gridfs_id")]
+            live_owners = {
+                doc["_id"]
+                for doc in db[owner_name].find({"_id": {"$in": owner_ids}}, {"_id": 1})
+            }
+            live_blobs = {
+                doc["_id"] for doc in db.fs.files.find({"_id": {"$in": blob_ids}}, {"_id": 1})
+            }
+            orphan_ids = [
+                doc["_id"]
+                for doc in batch
+                if doc.get(owner_field) not in live_owners
+                or doc.get("gridfs_id") not in live_blobs
+            ]
+
+            if orphan_ids and not dry_run:
+                metadata_collection.delete_many({"_id": {"$in": orphan_ids}})
+                db[owner_name].update_many(
+                    {"file_metadata_ids": {"$in": orphan_ids}},
+                    {"$pull": {"file_metadata_ids": {"$in": orphan_ids}}},
+                )
+            metadata_removed += len(orphan_ids)
+
+            if not dry_run:
+                _gc_checkpoint(db, phase, batch[-1]["_id"])
+            time.sleep(pause)
+
+    # 2. GridFS files nothing references any more.
+    files_removed = 0
+    bytes_reclaimed = 0
+    for batch in _gc_batches(
+        db.fs.files,
+        {"_id": {"$lt": cutoff_id}},
+        state,
+        "files",
+        batch_size,
+        {"length": 1},
+    ):
+        batch_ids = [doc["_id"] for doc in batch]
+        referenced = set()
+        for collection_name, field in GRIDFS_REFERENCES:
+            referenced.update(
+                doc[field]
+                for doc in db[collection_name].find(
+                    {field: {"$in": batch_ids}}, {field: 1}
+                )
+            )
+        orphans = [doc for doc in batch if doc["_id"] not in referenced]
+        orphan_ids = [doc["_id"] for doc in orphans]
+
+        if orphan_ids and not dry_run:
+            # Chunks go first: if we stop in between, the file document is
+            # still there and the next run finds it again.
+            db.fs.chunks.delete_many({"files_id": {"$in": orphan_ids}})
+            db.fs.files.delete_many({"_id": {"$in": orphan_ids}})
+        files_removed += len(orphan_ids)
+        bytes_reclaimed += sum(doc.get("length", 0) for doc in orphans)
+
+        if not dry_run:
+            _gc_checkpoint(db, "files", batch[-1]["_id"])
+        time.sleep(pause)
+
+    # A full pass is complete, so the next run starts from the beginning.
+    if not dry_run:
+        state_collection.delete_one({"_id": GC_STATE_ID})
+
+    verb = "Found" if dry_run else "Removed"
+    click.echo(f"{verb} {metadata_removed} orphaned file metadata documents.")
+    click.echo(
+        f"{verb} {files_removed} orphaned GridFS files "
+        f"({bytes_reclaimed / (1024 * 1024):.2f} MB)."
+    )
+
+
+@click.command("create-indexes")
+@with_appcontext
+def create_indexes_command():
+    """Creates the indexes the application's queries rely on."""
+    db = get_db()
+
+    # Machines table: filters, search and sortable columns
+    machines_collection = db["machines"]
+    machines_collection.create_index([("created_at", -1)])
+    machines_collection.create_index("machine_name")
+    machines_collection.create_index("asset_id")
+    machines_collection.create_index([("current_status", 1), ("created_at", -1)])
+    machines_collection.create_index([("criticality", 1), ("created_at", -1)])
+    machines_collection.create_index([("manufacturer", 1), ("created_at", -1)])
+    machines_collection.create_index("tags")
+    # Fleet-wide preventive maintenance due queries
+    machines_collection.create_index("maintenance_due.date", sparse=True)
+    machines_collection.create_index("maintenance_due.remaining_ratio", sparse=True)
+
+    # Raw materials table: filters, search and sortable columns
+    raw_materials_collection = db.raw_materials
+    raw_materials_collection.create_index([("last_stocked_on", -1)])
+    raw_materials_collection.create_index("material_name")
+    # Unique: supplier price list syncs upsert by SKU
+    duplicate_skus = ensure_sku_index(db)
+    if duplicate_skus:
+        click.echo(
+            f"{len(duplicate_skus)} SKUs are used by more than one material; SKUs "
+            "are not made unique until they are fixed:"
+        )
+        for sku in duplicate_skus:
+            click.echo(f"  {sku}")
+    raw_materials_collection.create_index("uom")
+    raw_materials_collection.create_index("categories")
+    raw_materials_collection.create_index("suppliers")
+    raw_materials_collection.create_index("current_quantity")
+    # Typeahead lookups by name and SKU words
+    ensure_material_search_indexes(db)
+    # Category and supplier counters: autocomplete and recount $merge
+    ensure_taxonomy_indexes(db)
+
+    # Procurement history: newest bills first, optionally per supplier
+    procurement_collection = db.procurement_records
+    # A bill is identified by its supplier and bill number (bill imports rely on it)
+    duplicate_bills = ensure_bill_index(db)
+    if duplicate_bills:
+        click.echo(
+            f"{len(duplicate_bills)} bills are stored more than once; bill numbers "
+            "are not made unique until they are removed:"
+        )
+        for supplier_name, bill_number in duplicate_bills:
+            click.echo(f"  {supplier_name}: {bill_number}")
+    procurement_collection.create_index([("bill_date", -1), ("_id", -1)])
+    procurement_collection.create_index(
+        [("supplier_name", 1), ("bill_date", -1), ("_id", -1)]
+    )
+    # Procurement history of a single material (multikey)
+    procurement_collection.create_index(
+        [("procurement_items.material_id", 1), ("bill_date", -1)]
+    )
+
+    # Operation history per machine
+    db["operations"].create_index([("assigned_machine", 1), ("created_at", -1)])
+    # Usage history per raw material (multikey)
+    db["operations"].create_index(
+        [("materials_required.material_id", 1), ("created_at", -1)]
+    )
+
+    # Meter readings time-series collection and its hourly/daily rollups
+    ensure_meter_collections(db)
+
+    # Machine status event log and daily time-in-state buckets
+    ensure_status_log_indexes(db)
+
+    # Inventory ledger and per-material stock snapshots
+    ensure_ledger_indexes(db)
+
+    # Material reservations held by operations
+    ensure_reservation_indexes(db)
+
+    # Stored stockout forecasts
+    ensure_forecast_indexes(db)
+
+    # Below-reorder-level flag and one pending reminder per material
+    ensure_reorder_indexes(db)
+
+    # Suspended operations waiting on materials
+    ensure_material_wait_indexes(db)
+
+    click.echo("Indexes created.")
+
+
+@click.command("refresh-maintenance-due")
+@click.option("--batch-size", default=1000, help="Machines updated per bulk write.")
+@with_appcontext
+def refresh_maintenance_due_command(batch_size):
+    """Recomputes the materialized maintenance_due field on every machine."""
+    db = get_db()
+    machines_collection = db["machines"]
+
+    updated = 0
+    operations = []
+    for machine in machines_collection.find({}, {"maintenance_schedule": 1}):
+        operations.append(
+            UpdateOne(
+                {"_id": machine["_id"]},
+                {
+                    "$set": {
+                        "maintenance_due": compute_maintenance_due(
+                            machine.get("maintenance_schedule")
+                        )
+                    }
+                },
+            )
+        )
+        if len(operations) >= batch_size:
+            updated += machines_collection.bulk_write(
+                operations, ordered=False
+            ).modified_count
+            operations = []
+
+    if operations:
+        updated += machines_collection.bulk_write(operations, ordered=False).modified_count
+
+    click.echo(f"Refreshed maintenance due dates on {updated} machines.")
+
+
+@click.command("snapshot-inventory")
+@with_appcontext
+def snapshot_inventory_command():
+    """
+    Writes a stock snapshot for every raw material from the previous snapshot
+    and the inventory ledger. Meant to run periodically (e.g. nightly) so
+    point-in-time stock reads only replay movements since the last snapshot.
+    """
+    db = get_db()
+    written, drifted = take_inventory_snapshots(db)
+    click.echo(f"Wrote {written} inventory snapshots.")
+    if drifted:
+        click.echo(
+            f"{len(drifted)} materials differ from their ledger balance: "
+            + ", ".join(str(material_id) for material_id in drifted)
+        )
+
+
+@click.command("import-bills")
+@click.argument("path", type=click.Path(exists=True, dir_okay=False))
+@click.option(
+    "--format",
+    "file_format",
+    type=click.Choice(["csv", "jsonl"]),
+    help="File format; defaults to the file extension.",
+)
+@click.option(
+    "--batch-size",
+    default=BILL_IMPORT_BATCH_SIZE,
+    help="Bills inserted per batch.",
+)
+@with_appcontext
+def import_bills_command(path, file_format, batch_size):
+    """
+    Imports procurement bills from a CSV or JSONL file. Bills already stored
+    for the same supplier and bill number are skipped, so the command can be
+    re-run after a failure.
+    """
+    db = get_db()
+    file_format = file_format or os.path.splitext(path)[1].lstrip(".").lower()
+    if file_format not in ("csv", "jsonl"):
+        raise click.BadParameter("Use a .csv or .jsonl file or pass --format.")
+
+    with open(path, newline="", encoding="utf-8-sig") as stream:
+        report = import_bills(db, stream, file_format, batch_size=batch_size)
+
+    click.echo(
+        f"Imported {report['inserted']} bills, skipped {report['duplicates']} "
+        f"already imported, updated stock of {report['materials_updated']} materials."
+    )
+    for error in report["errors"]:
+        click.echo(f"Line {error['line']}: {error['error']}", err=True)
+
+    resumed = reevaluate_waiting_operations(db, list(report["restocked_material_ids"]))
+    if resumed:
+        click.echo(f"Resumed {len(resumed)} suspended operations.")
+
+
+@click.command("import-records")
+@click.argument("entity", type=click.Choice(list(IMPORTERS)))
+@click.argument("path", type=click.Path(exists=True, dir_okay=False))
+@click.option(
+    "--format",
+    "file_format",
+    type=click.Choice(["csv", "jsonl"]),
+    help="File format; defaults to the file extension.",
+)
+@click.option(
+    "--batch-size",
+    default=IMPORT_BATCH_SIZE,
+    help="Rows inserted per batch.",
+)
+@with_appcontext
+def import_records_command(entity, path, file_format, batch_size):
+    """
+    Imports jobs, machines or raw materials from a CSV or JSONL file, with
+    the same validation as the create forms. Division and user names are
+    resolved per batch; rows that fail are listed with their line number.
+    """
+    db = get_db()
+    file_format = file_format or os.path.splitext(path)[1].lstrip(".").lower()
+    if file_format not in ("csv", "jsonl"):
+        raise click.BadParameter("Use a .csv or .jsonl file or pass --format.")
+
+    with open(path, newline="", encoding="utf-8-sig") as stream:
+        report = import_records(db, entity, stream, file_format, batch_size=batch_size)
+
+    click.echo(f"Imported {report['inserted']} {entity}, {report['failed']} rows failed.")
+    for error in report["errors"]:
+        click.echo(f"Line {error['line']}: {error['error']}", err=True)
+    if report["errors_truncated"]:
+        click.echo("Only the first errors are listed.", err=True)
+
+
+@click.command("sync-price-list")
+@click.argument("path", type=click.Path(exists=True, dir_okay=False))
+@click.option("--supplier", help="Supplier added to every material in the list.")
+@click.option(
+    "--format",
+    "file_format",
+    type=click.Choice(["csv", "jsonl"]),
+    help="File format; defaults to the file extension.",
+)
+@click.option(
+    "--batch-size",
+    default=PRICE_LIST_BATCH_SIZE,
+    help="Rows compared and written per batch.",
+)
+@with_appcontext
+def sync_price_list_command(path, supplier, file_format, batch_size):
+    """
+    Syncs raw materials with a supplier price list (CSV or JSONL with sku,
+    material_name, uom, description, list_price). Only new and changed SKUs
+    are written, so the command can run nightly on the full catalogue.
+    """
+    db = get_db()
+    file_format = file_format or os.path.splitext(path)[1].lstrip(".").lower()
+    if file_format not in ("csv", "jsonl"):
+        raise click.BadParameter("Use a .csv or .jsonl file or pass --format.")
+    duplicate_skus = ensure_sku_index(db)
+    if duplicate_skus:
+        skus = ", ".join(str(sku) for sku in duplicate_skus)
+        raise click.ClickException(
+            f"SKUs used by more than one material: {skus}. "
+            "Fix them before syncing a price list."
+        )
+
+    with open(path, newline="", encoding="utf-8-sig") as stream:
+        report = sync_price_list(
+            db, stream, file_format, supplier_name=supplier, batch_size=batch_size
+        )
+
+    click.echo(
+        f"Inserted {report['inserted']} materials, updated {report['updated']}, "
+        f"{report['unchanged']} unchanged."
+    )
+    for error in report["errors"]:
+        click.echo(f"Line {error['line']}: {error['error']}", err=True)
+
+
+@click.command("migrate-procurement-material-ids")
+@click.option("--batch-size", default=1000, help="Records updated per bulk write.")
+@with_appcontext
+def migrate_procurement_material_ids_command(batch_size):
+    """
+    Converts string procurement_items.material_id values to ObjectIds so
+    material history queries can use the multikey index. Safe to re-run.
+    """
+    db = get_db()
+    procurement_collection = db.procurement_records
+
+    updated = 0
+    skipped = 0
+    operations = []
+    for record in procurement_collection.find(
+        {"procurement_items.material_id": {"$type": "string"}},
+        {"procurement_items": 1},
+    ):
+        items = record["procurement_items"]
+        if not all(
+            ObjectId.is_valid(item.get("material_id") or "") for item in items
+        ):
+            skipped += 1
+            click.echo(f"Skipping {record['_id']}: invalid material id", err=True)
+            continue
+        for item in items:
+            item["material_id"] = ObjectId(item["material_id"])
+        operations.append(
+            UpdateOne({"_id": record["_id"]}, {"$set": {"procurement_items": items}})
+        )
+        if len(operations) >= batch_size:
+            updated += procurement_collection.bulk_write(
+                operations, ordered=False
+            ).modified_count
+            operations = []
+
+    if operations:
+        updated += procurement_collection.bulk_write(
+            operations, ordered=False
+        ).modified_count
+
+    procurement_collection.create_index(
+        [("procurement_items.material_id", 1), ("bill_date", -1)]
+    )
+    click.echo(f"Converted material ids on {updated} procurement records.")
+    if skipped:
+        click.echo(f"Skipped {skipped} records with invalid material ids.")
+
+
+@click.command("migrate-material-search-terms")
+@click.option("--batch-size", default=1000, help="Materials updated per bulk write.")
+@with_appcontext
+def migrate_material_search_terms_command(batch_size):
+    """
+    Stores the search_terms used by the material typeahead on every raw
+    material, recomputed from its current name and SKU. Safe to re-run.
+    """
+    db = get_db()
+    raw_materials_collection = db.raw_materials
+    ensure_material_search_indexes(db)
+
+    updated = 0
+    operations = []
+    for material in raw_materials_collection.find(
+        {}, {"material_name": 1, "sku": 1, "search_terms": 1}
+    ):
+        terms = material_search_terms(material.get("material_name"), material.get("sku"))
+        if terms == material.get("search_terms"):
+            continue
+        operations.append(
+            UpdateOne({"_id": material["_id"]}, {"$set": {"search_terms": terms}})
+        )
+        if len(operations) >= batch_size:
+            updated += raw_materials_collection.bulk_write(
+                operations, ordered=False
+            ).modified_count
+            operations = []
+
+    if operations:
+        updated += raw_materials_collection.bulk_write(
+            operations, ordered=False
+        ).modified_count
+    click.echo(f"Updated search terms on {updated} raw materials.")
+
+
+@click.command("migrate-reservations")
+@click.option("--batch-size", default=500, help="Materials migrated per batch.")
+@with_appcontext
+def migrate_reservations_command(batch_size):
+    """
+    Moves the in_use_quantity arrays of raw materials into the reservations
+    collection and sets each material's reserved_quantity total.
+    Safe to re-run: reservations are upserted per material and operation.
+    """
+    db = get_db()
+    raw_materials_collection = db.raw_materials
+    reservations_collection = db[RESERVATIONS_COLLECTION]
+    ensure_reservation_indexes(db)
+
+    def flush(materials):
+        reservation_upserts = []
+        for material in materials:
+            for entry in material.get("in_use_quantity") or []:
+                reservation_upserts.append(
+                    UpdateOne(
+                        {
+                            "material_id": material["_id"],
+                            "operation_id": entry.get("operation_id"),
+                        },
+                        {
+                            "$setOnInsert": {
+                                "job_id": entry.get("job_id"),
+                                "quantity": entry.get("required_quantity", 0),
+                                "created_at": now,
+                            }
+                        },
+                        upsert=True,
+                    )
+                )
+        if reservation_upserts:
+            reservations_collection.bulk_write(reservation_upserts, ordered=False)
+
+        # reserved_quantity is recomputed from the collection, not incremented,
+        # so a re-run after a partial failure does not double count
+        material_ids = [material["_id"] for material in materials]
+        reserved = {
+            row["_id"]: row["quantity"]
+            for row in reservations_collection.aggregate(
+                [
+                    {"$match": {"material_id": {"$in": material_ids}}},
+                    {"$group": {"_id": "$material_id", "quantity": {"$sum": "$quantity"}}},
+                ]
+            )
+        }
+        raw_materials_collection.bulk_write(
+            [
+                UpdateOne(
+                    {"_id": material_id},
+                    {
+                        "$set": {"reserved_quantity": reserved.get(material_id, 0)},
+                        "$unset": {"in_use_quantity": ""},
+                    },
+                )
+                for material_id in material_ids
+            ],
+            ordered=False,
+        )
+
+    now = datetime.datetime.now()
+    migrated = 0
+    batch = []
+    for material in raw_materials_collection.find(
+        {"in_use_quantity": {"$exists": True}}, {"in_use_quantity": 1}
+    ):
+        batch.append(material)
+        if len(batch) >= batch_size:
+            flush(batch)
+            migrated += len(batch)
+            batch = []
+    if batch:
+        flush(batch)
+        migrated += len(batch)
+
+    click.echo(f"Migrated reservations of {migrated} raw materials.")
+
+
+@click.command("forecast-stockouts")
+@click.option("--window-days", type=int, help="Days of consumption history to use.")
+@with_appcontext
+def forecast_stockouts_command(window_days):
+    """
+    Forecasts consumption rates and stockout dates for every raw material and
+    stores them for the inventory pages. Meant to run periodically.
+    """
+    db = get_db()
+    started = time.monotonic()
+    count = run_stockout_forecast(
+        db,
+        window_days=window_days or current_app.config["FORECAST_WINDOW_DAYS"],
+        default_lead_time_days=current_app.config["FORECAST_DEFAULT_LEAD_TIME_DAYS"],
+    )
+    click.echo(
+        f"Forecast {count} raw materials in {time.monotonic() - started:.1f}s."
+    )
+
+
+@click.command("generate-reorder-reminders")
+@click.option(
+    "--lead-time-days",
+    type=int,
+    help="Days of consumption a generated reminder should cover.",
+)
+@with_appcontext
+def generate_reorder_reminders_command(lead_time_days):
+    """
+    Creates pending reminders for raw materials that fell to their reorder
+    level since the previous run, and completes automatic reminders of the
+    ones restocked above it. Meant to run on a schedule (e.g. hourly).
+    """
+    db = get_db()
+    checked, created, completed = generate_reorder_reminders(
+        db,
+        lead_time_days or current_app.config["FORECAST_DEFAULT_LEAD_TIME_DAYS"],
+    )
+    click.echo(
+        f"Checked {checked} changed materials: {created} reminders created, "
+        f"{completed} completed."
+    )
+
+
+@click.command("reevaluate-suspended-operations")
+@with_appcontext
+def reevaluate_suspended_operations_command():
+    """
+    Re-checks every operation waiting on materials and resumes the ones that
+    can now be served, in schedule order. Restocks trigger this per material
+    in the background; the command catches up after restarts or imports.
+    """
+    db = get_db()
+    resumed = reevaluate_waiting_operations(db)
+    click.echo(f"Resumed {len(resumed)} suspended operations.")
+
+
+@click.command("recount-material-taxonomies")
+@with_appcontext
+def recount_material_taxonomies_command():
+    """
+    Rebuilds the usage counts of raw material categories and suppliers from
+    the raw materials, one aggregation with $merge per counter collection.
+    """
+    db = get_db()
+    ensure_taxonomy_indexes(db)
+    for kind in TAXONOMIES:
+        in_use = recount(db, kind)
+        click.echo(f"Recounted {kind}: {in_use} in use.")
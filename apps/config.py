@@ -40,6 +40,14 @@ class Config(object):
     MONGO_DBNAME = os.getenv("MONGO_DBNAME", None)
     MONGO_URI = os.getenv("MONGO_URI", None)
 
+    # Seconds facet vocabularies (tags, manufacturers, categories, ...) stay cached
+    VOCABULARY_CACHE_TTL = int(os.getenv("VOCABULARY_CACHE_TTL", 300))
+
+    # Stockout forecast: days of consumption history, and the lead time used
+    # for materials without enough procurement history
+    FORECAST_WINDOW_DAYS = int(os.getenv("FORECAST_WINDOW_DAYS", 90))
+    FORECAST_DEFAULT_LEAD_TIME_DAYS = int(os.getenv("FORECAST_DEFAULT_LEAD_TIME_DAYS", 14))
+
     USE_SQLITE = True
 
     # try to set up a Relational DBMS
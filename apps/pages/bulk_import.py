@@ -0,0 +1,453 @@
+import csv
+import datetime
+import io
+import json
+import math
+
+from bson.objectid import ObjectId
+from pymongo.errors import BulkWriteError
+
+from apps.pages.choices import (
+    MACHINE_CRITICALITIES,
+    MACHINE_STATUSES,
+    MATERIAL_UOMS,
+    METER_UNITS,
+    SCHEDULE_TYPES,
+    TIME_GAP_UNITS,
+)
+from apps.pages.inventory.ledger import record_stock_movements, stock_movement
+from apps.pages.inventory.material_search import material_search_terms
+from apps.pages.inventory.taxonomy import increment_counts
+from apps.pages.machines.maintenance import compute_maintenance_due
+from apps.pages.machines.status_log import log_status_changes
+from apps.pages.vocabulary import invalidate_vocabulary
+
+IMPORT_BATCH_SIZE = 1000
+# Only the first errors are kept, so a bad million-row file stays bounded
+MAX_REPORTED_ERRORS = 1000
+
+JOB_DATE_FORMAT = "%m/%d/%Y %I:%M %p"
+MACHINE_DATE_FORMAT = "%m/%d/%Y"
+
+
+def iter_import_rows(stream, file_format):
+    """
+    Yields (line_number, raw_row) from a CSV or JSONL text stream without
+    reading it into memory. Unparseable lines yield an `error` key.
+    """
+    if file_format == "jsonl":
+        for line_number, line in enumerate(stream, start=1):
+            if not line.strip():
+                continue
+            try:
+                row = json.loads(line)
+            except json.JSONDecodeError as e:
+                row = {"error": f"Invalid JSON: {e}"}
+            if not isinstance(row, dict):
+                row = {"error": "Each line must be a JSON object"}
+            yield line_number, row
+        return
+
+    if file_format != "csv":
+        raise ValueError(f"Unsupported format: {file_format}")
+
+    for line_number, row in enumerate(csv.DictReader(stream), start=2):
+        yield line_number, row
+
+
+# --- Field parsing ---
+
+
+def _text(raw_row, field):
+    value = raw_row.get(field)
+    return str(value).strip() if value is not None else ""
+
+
+def _list(raw_row, field):
+    """A list field: a JSON array, or values separated by '|' in CSV."""
+    value = raw_row.get(field)
+    if isinstance(value, list):
+        values = value
+    else:
+        values = str(value or "").split("|")
+    return [str(v).strip() for v in values if str(v).strip()]
+
+
+def _number(raw_row, field, cast=float, default=None):
+    value = _text(raw_row, field)
+    if not value:
+        return default
+    try:
+        number = cast(value)
+    except ValueError:
+        raise ValueError(f"Invalid {field} '{value}'")
+    # float() accepts "nan" and "inf"
+    if not math.isfinite(number):
+        raise ValueError(f"Invalid {field} '{value}'")
+    return number
+
+
+def _date(raw_row, field, form_format):
+    """Parses a date in the create form's format, or ISO 8601."""
+    value = _text(raw_row, field)
+    if not value:
+        return None
+    try:
+        return datetime.datetime.strptime(value, form_format)
+    except ValueError:
+        pass
+    try:
+        return datetime.datetime.fromisoformat(value)
+    except ValueError:
+        raise ValueError(f"Invalid {field} '{value}'")
+
+
+def _choice(raw_row, field, choices, required=True):
+    value = _text(raw_row, field)
+    if not value and not required:
+        return None
+    if value not in choices:
+        raise ValueError(f"{field} must be one of {', '.join(choices)}")
+    return value
+
+
+# --- Jobs ---
+
+
+def validate_job_row(raw_row):
+    """Same rules as the manage_jobs form; names are resolved per batch."""
+    job_name = _text(raw_row, "job_name")
+    completion_time = _date(raw_row, "completion_time", JOB_DATE_FORMAT)
+    if not job_name or not completion_time:
+        raise ValueError("Job Name and Completion Time are required.")
+
+    now = datetime.datetime.now()
+    return {
+        "job_name": job_name,
+        "job_color": _text(raw_row, "job_color") or "#E91E63",
+        "divisions": _list(raw_row, "divisions"),
+        "coordinators": _list(raw_row, "coordinators"),
+        "description": _text(raw_row, "description"),
+        "tags": _list(raw_row, "tags"),
+        "status": "pending",
+        "start_time": now,
+        "completion_time": completion_time,
+        "schedule_type": _choice(raw_row, "schedule_type", SCHEDULE_TYPES),
+        "schedule_position": None,
+        "document_ids": [],
+        "created_at": now,
+        "updated_at": now,
+    }
+
+
+def _resolve_names(collection, names):
+    """Maps names (or id strings) to ids with one $in read."""
+    ids = [ObjectId(n) for n in names if ObjectId.is_valid(n)]
+    resolved = {}
+    for doc in collection.find(
+        {"$or": [{"name": {"$in": list(names)}}, {"_id": {"$in": ids}}]},
+        {"name": 1},
+    ):
+        resolved[doc.get("name")] = doc["_id"]
+        resolved[str(doc["_id"])] = doc["_id"]
+    return resolved
+
+
+def prepare_jobs(db, rows, state, user_id):
+    """
+    Resolves division and coordinator names of a batch with one lookup each
+    and appends the jobs to the end of their schedule, in file order.
+    """
+    divisions = _resolve_names(
+        db.divisions, {name for _, job in rows for name in job["divisions"]}
+    )
+    users = _resolve_names(
+        db.users, {name for _, job in rows for name in job["coordinators"]}
+    )
+
+    prepared = []
+    for line_number, job in rows:
+        unknown = [n for n in job["divisions"] if n not in divisions]
+        unknown += [n for n in job["coordinators"] if n not in users]
+        if unknown:
+            error = ValueError(f"Unknown division or user: {', '.join(unknown)}")
+            prepared.append((line_number, error))
+            continue
+        job["divisions"] = [divisions[n] for n in job["divisions"]]
+        # Coordinators are stored as id strings, like the form submits them
+        job["coordinators"] = [str(users[n]) for n in job["coordinators"]]
+
+        schedule_type = job["schedule_type"]
+        if schedule_type not in state:
+            last = db.jobs.find_one(
+                {"schedule_type": schedule_type},
+                {"schedule_position": 1},
+                sort=[("schedule_position", -1)],
+            )
+            state[schedule_type] = (last or {}).get("schedule_position") or 0
+        state[schedule_type] += 1
+        job["schedule_position"] = state[schedule_type]
+        prepared.append((line_number, job))
+    return prepared
+
+
+# --- Machines ---
+
+
+def validate_machine_row(raw_row):
+    """Same rules as the create_machines form (attachments are not imported)."""
+    machine_name = _text(raw_row, "machine_name")
+    if not machine_name:
+        raise ValueError("Machine Name is required.")
+
+    maintenance_trigger = _text(raw_row, "maintenance_trigger") or None
+    maintenance_schedule = {"trigger": maintenance_trigger}
+    if maintenance_trigger == "time_based":
+        maintenance_schedule["time_gap"] = _number(raw_row, "time_gap", int)
+        maintenance_schedule["time_gap_unit"] = _choice(
+            raw_row, "time_gap_unit", TIME_GAP_UNITS
+        )
+        maintenance_schedule["next_maintenance_date"] = _date(
+            raw_row, "next_maintenance_date", MACHINE_DATE_FORMAT
+        )
+    elif maintenance_trigger == "usage_based":
+        maintenance_schedule["usage_gap"] = _number(raw_row, "usage_gap", int)
+        maintenance_schedule["meter_unit"] = _choice(raw_row, "meter_unit", METER_UNITS)
+        maintenance_schedule["current_meter_reading"] = _number(
+            raw_row, "current_meter_reading"
+        )
+    elif maintenance_trigger:
+        raise ValueError("maintenance_trigger must be time_based or usage_based")
+
+    now = datetime.datetime.now()
+    return {
+        "machine_name": machine_name,
+        "asset_id": _text(raw_row, "asset_id"),
+        "current_status": _choice(raw_row, "current_status", MACHINE_STATUSES),
+        "criticality": _choice(
+            raw_row, "criticality", MACHINE_CRITICALITIES, required=False
+        ),
+        "tags": _list(raw_row, "tags"),
+        "manufacturer": _text(raw_row, "manufacturer"),
+        "model_number": _text(raw_row, "model_number"),
+        "installation_date": _date(raw_row, "installation_date", MACHINE_DATE_FORMAT),
+        "warranty_expiry_date": _date(
+            raw_row, "warranty_expiry_date", MACHINE_DATE_FORMAT
+        ),
+        "maintenance_schedule": maintenance_schedule,
+        "maintenance_due": compute_maintenance_due(maintenance_schedule),
+        "operation_id": None,
+        "number_of_operations": 0,
+        "notes": _text(raw_row, "notes"),
+        "file_metadata_ids": [],
+        "status_since": now,
+        "created_at": now,
+        "updated_at": now,
+    }
+
+
+def after_machines_inserted(db, documents, user_id):
+    log_status_changes(
+        db,
+        [
+            {
+                "machine_id": machine["_id"],
+                "from_status": None,
+                "to_status": machine["current_status"],
+                "status_since": None,
+                "changed_at": machine["status_since"],
+                "changed_by": ObjectId(user_id) if user_id else None,
+            }
+            for machine in documents
+        ],
+    )
+    invalidate_vocabulary("machine_tags", "machine_manufacturers")
+
+
+# --- Raw materials ---
+
+
+def validate_material_row(raw_row):
+    """Same rules as the create_raw_material form (images are not imported)."""
+    material_name = _text(raw_row, "material_name")
+    sku = _text(raw_row, "sku")
+    uom = _text(raw_row, "uom")
+    if not all([material_name, sku, uom]):
+        raise ValueError("Material Name, SKU, and Unit of Measure are required.")
+    if uom not in MATERIAL_UOMS:
+        raise ValueError(f"uom must be one of {', '.join(MATERIAL_UOMS)}")
+    initial_quantity = _number(raw_row, "initial_quantity", default=0.0)
+    reorder_level = _number(raw_row, "reorder_level", default=0.0)
+    if initial_quantity < 0 or reorder_level < 0:
+        raise ValueError("initial_quantity and reorder_level cannot be negative")
+
+    now = datetime.datetime.now()
+    return {
+        "material_name": material_name,
+        "sku": sku,
+        "search_terms": material_search_terms(material_name, sku),
+        "description": _text(raw_row, "description"),
+        "uom": uom,
+        "current_quantity": initial_quantity,
+        "reserved_quantity": 0,
+        "reorder_level": reorder_level,
+        "below_reorder_level": reorder_level > 0 and initial_quantity <= reorder_level,
+        "categories": _list(raw_row, "categories"),
+        "suppliers": _list(raw_row, "suppliers"),
+        "image_id": None,
+        "created_at": now,
+        "updated_at": now,
+        "last_stocked_on": now,
+    }
+
+
+def prepare_materials(db, rows, state, user_id):
+    """Rejects SKUs already stored or repeated in the batch (one $in read)."""
+    existing = set(
+        db.raw_materials.distinct(
+            "sku", {"sku": {"$in": [material["sku"] for _, material in rows]}}
+        )
+    )
+    prepared = []
+    for line_number, material in rows:
+        if material["sku"] in existing:
+            prepared.append(
+                (line_number, ValueError(f"SKU '{material['sku']}' already exists."))
+            )
+            continue
+        existing.add(material["sku"])
+        prepared.append((line_number, material))
+    return prepared
+
+
+def after_materials_inserted(db, documents, user_id):
+    # Opening stock goes into the inventory ledger like any other movement
+    record_stock_movements(
+        db,
+        [
+            stock_movement(m["_id"], m["current_quantity"], "initial_stock")
+            for m in documents
+        ],
+        user_id=user_id,
+    )
+    increment_counts(db, "categories", [c for m in documents for c in m["categories"]])
+    increment_counts(db, "suppliers", [s for m in documents for s in m["suppliers"]])
+    invalidate_vocabulary("material_categories", "material_suppliers", "material_uoms")
+
+
+# Entity -> collection, row validator, batch preparation, post-insert hook
+IMPORTERS = {
+    "jobs": {
+        "collection": "jobs",
+        "validate": validate_job_row,
+        "prepare": prepare_jobs,
+        "after_insert": None,
+    },
+    "machines": {
+        "collection": "machines",
+        "validate": validate_machine_row,
+        "prepare": None,
+        "after_insert": after_machines_inserted,
+    },
+    "raw_materials": {
+        "collection": "raw_materials",
+        "validate": validate_material_row,
+        "prepare": prepare_materials,
+        "after_insert": after_materials_inserted,
+    },
+}
+
+
+def _add_error(report, line_number, error):
+    report["failed"] += 1
+    if len(report["errors"]) < MAX_REPORTED_ERRORS:
+        report["errors"].append({"line": line_number, "error": str(error)})
+    else:
+        report["errors_truncated"] = True
+
+
+def _import_batch(db, importer, batch, state, report, user_id):
+    """
+    Prepares one batch of (line_number, document) and stores it with a single
+    unordered insert_many; rows rejected by the database are reported by line.
+    """
+    if importer["prepare"]:
+        batch = importer["prepare"](db, batch, state, user_id)
+
+    documents = []
+    lines = []
+    for line_number, document in batch:
+        if isinstance(document, Exception):
+            _add_error(report, line_number, document)
+            continue
+        documents.append(document)
+        lines.append(line_number)
+    if not documents:
+        return
+
+    failed_indexes = set()
+    try:
+        db[importer["collection"]].insert_many(documents, ordered=False)
+    except BulkWriteError as e:
+        for error in e.details.get("writeErrors", []):
+            failed_indexes.add(error["index"])
+            _add_error(report, lines[error["index"]], error["errmsg"])
+
+    inserted = [d for i, d in enumerate(documents) if i not in failed_indexes]
+    report["inserted"] += len(inserted)
+    if inserted and importer["after_insert"]:
+        importer["after_insert"](db, inserted, user_id)
+
+
+def import_records(
+    db, entity, stream, file_format, batch_size=IMPORT_BATCH_SIZE, user_id=None
+):
+    """
+    Streams jobs, machines or raw materials from a CSV or JSONL text stream.
+
+    Rows are validated with the create forms' rules, then stored in batches
+    of `batch_size`: one lookup per batch for names and duplicates, one
+    insert_many. Memory stays bounded by the batch size, whatever the file
+    size. Returns {entity, inserted, failed, errors, errors_truncated}.
+    """
+    importer = IMPORTERS[entity]
+    report = {
+        "entity": entity,
+        "inserted": 0,
+        "failed": 0,
+        "errors": [],
+        "errors_truncated": False,
+    }
+    state = {}
+
+    batch = []
+    for line_number, raw_row in iter_import_rows(stream, file_format):
+        try:
+            if raw_row.get("error"):
+                raise ValueError(raw_row["error"])
+            batch.append((line_number, importer["validate"](raw_row)))
+        except ValueError as e:
+            _add_error(report, line_number, e)
+            continue
+        if len(batch) >= batch_size:
+            _import_batch(db, importer, batch, state, report, user_id)
+            batch = []
+
+    if batch:
+        _import_batch(db, importer, batch, state, report, user_id)
+    return report
+
+
+def import_upload(db, entity, upload, file_format=None, user_id=None):
+    """
+    Runs `import_records` on an uploaded file (werkzeug FileStorage), read as
+    a text stream. The format defaults to the file extension. Raises
+    ValueError for a missing file or an unsupported format.
+    """
+    if not upload or not upload.filename:
+        raise ValueError("No file uploaded")
+    file_format = (file_format or upload.filename.rsplit(".", 1)[-1]).lower()
+    if file_format not in ("csv", "jsonl"):
+        raise ValueError("Upload a .csv or .jsonl file")
+    stream = io.TextIOWrapper(upload.stream, encoding="utf-8-sig", newline="")
+    return import_records(db, entity, stream, file_format, user_id=user_id)
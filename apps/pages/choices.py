@@ -0,0 +1,39 @@
+# Choices offered by the create and edit forms. Form handlers, filters and the
+# bulk imports validate against the same values.
+
+SCHEDULE_TYPES = ("general_schedule", "priority_schedule")
+
+MACHINE_STATUS_CHOICES = [
+    {"value": "operating", "name": "Operating"},
+    {"value": "idle", "name": "Idle"},
+    {"value": "under_maintenance", "name": "Under Maintenance"},
+    {"value": "out_of_service", "name": "Out of Service"},
+]
+MACHINE_CRITICALITY_CHOICES = [
+    {"value": "high", "name": "High"},
+    {"value": "medium", "name": "Medium"},
+    {"value": "low", "name": "Low"},
+]
+METER_UNIT_CHOICES = [
+    {"value": "hours", "name": "Hours"},
+    {"value": "cycles", "name": "Cycles"},
+    {"value": "units", "name": "Units Produced"},
+]
+
+# Valid values for a machine's current_status, criticality and meter unit
+MACHINE_STATUSES = tuple(choice["value"] for choice in MACHINE_STATUS_CHOICES)
+MACHINE_CRITICALITIES = tuple(choice["value"] for choice in MACHINE_CRITICALITY_CHOICES)
+METER_UNITS = tuple(choice["value"] for choice in METER_UNIT_CHOICES)
+TIME_GAP_UNITS = ("days", "weeks", "months")
+
+MATERIAL_UOMS = (
+    "kg",
+    "grams",
+    "meters",
+    "mm",
+    "liters",
+    "units",
+    "pairs",
+    "sheets",
+    "spools",
+)
@@ -0,0 +1,113 @@
+import csv
+import datetime
+import io
+import tempfile
+
+from bson.objectid import ObjectId
+from flask import Response, stream_with_context
+from openpyxl import Workbook
+from openpyxl.cell.cell import ILLEGAL_CHARACTERS_RE
+
+EXPORT_BATCH_SIZE = 1000
+EXPORT_FORMATS = ("csv", "xlsx")
+# Bytes read per chunk when streaming a finished XLSX file
+XLSX_CHUNK_SIZE = 64 * 1024
+# Leading characters that make a spreadsheet treat text as a formula
+FORMULA_PREFIXES = ("=", "+", "-", "@", "\t", "\r")
+
+
+def export_cursor(collection, query, projection, sort):
+    """A projected cursor fetching EXPORT_BATCH_SIZE documents per round trip."""
+    return collection.find(query, projection).sort(sort).batch_size(EXPORT_BATCH_SIZE)
+
+
+def _text_value(value):
+    if value is None:
+        return ""
+    if isinstance(value, datetime.datetime):
+        return value.isoformat(sep=" ", timespec="seconds")
+    if isinstance(value, (list, tuple)):
+        # Same list separator as the CSV imports
+        return "|".join(_text_value(v) for v in value)
+    return str(value)
+
+
+def _formula_safe(text):
+    """
+    Prefixes user-entered text that a spreadsheet would run as a formula
+    (starting with =, +, -, @, tab or CR) with a quote.
+    """
+    return "'" + text if text.startswith(FORMULA_PREFIXES) else text
+
+
+def _csv_value(value):
+    if isinstance(value, (str, list, tuple)):
+        return _formula_safe(_text_value(value))
+    return _text_value(value)
+
+
+def _xlsx_value(value):
+    if isinstance(value, (str, list, tuple)):
+        # openpyxl refuses control characters in cell text
+        return _formula_safe(ILLEGAL_CHARACTERS_RE.sub("", _text_value(value)))
+    if isinstance(value, ObjectId):
+        return str(value)
+    return value
+
+
+def _csv_chunks(headers, rows):
+    """Yields CSV text as rows arrive, one chunk per EXPORT_BATCH_SIZE rows."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(headers)
+    for count, row in enumerate(rows, start=1):
+        writer.writerow([_csv_value(v) for v in row])
+        if count % EXPORT_BATCH_SIZE == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+
+def _xlsx_chunks(headers, rows, sheet_title):
+    """
+    Writes rows to a write-only workbook (rows go straight to a temporary
+    file, not into memory), then streams the finished file in chunks.
+    """
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet(title=sheet_title)
+    sheet.append(headers)
+    for row in rows:
+        sheet.append([_xlsx_value(v) for v in row])
+
+    with tempfile.TemporaryFile() as output:
+        workbook.save(output)
+        output.seek(0)
+        while True:
+            chunk = output.read(XLSX_CHUNK_SIZE)
+            if not chunk:
+                break
+            yield chunk
+
+
+def export_response(file_format, filename, headers, rows):
+    """
+    Streams `rows` (an iterable of value lists, usually a generator over an
+    export cursor) as a CSV or XLSX download named `filename`.<format>.
+    CSV is sent as the rows are read; XLSX once the workbook is complete.
+    """
+    if file_format == "xlsx":
+        body = _xlsx_chunks(headers, rows, filename[:31])
+        mimetype = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+    else:
+        body = _csv_chunks(headers, rows)
+        mimetype = "text/csv"
+
+    stamp = datetime.datetime.now().strftime("%Y%m%d-%H%M")
+    return Response(
+        stream_with_context(body),
+        mimetype=mimetype,
+        headers={
+            "Content-Disposition": f'attachment; filename="{filename}-{stamp}.{file_format}"'
+        },
+    )
@@ -0,0 +1,354 @@
+import csv
+import datetime
+import json
+import math
+from collections import defaultdict
+
+from bson.objectid import ObjectId
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError, PyMongoError
+
+from apps.pages.inventory.ledger import record_stock_movements, stock_movement
+
+BILL_IMPORT_BATCH_SIZE = 500
+
+# CSV: one line item per row; consecutive rows with the same supplier and
+# bill number form one bill, so a bill's rows must be contiguous. `material`
+# may be a material id or a SKU.
+BILL_CSV_COLUMNS = (
+    "supplier_name",
+    "bill_number",
+    "bill_date",
+    "material",
+    "quantity",
+    "unit_price",
+    "notes",
+)
+
+
+def ensure_bill_index(db):
+    """
+    Makes supplier + bill number unique in `procurement_records` (bill
+    imports rely on it). Bills stored twice before the index existed would
+    make it fail, so they are looked up first: while any remain, a plain
+    index is kept instead. Returns the duplicated (supplier, bill number)
+    pairs.
+    """
+    procurement_collection = db.procurement_records
+    duplicates = [
+        (row["_id"]["supplier_name"], row["_id"]["bill_number"])
+        for row in procurement_collection.aggregate(
+            [
+                {
+                    "$group": {
+                        "_id": {
+                            "supplier_name": "$supplier_name",
+                            "bill_number": "$bill_number",
+                        },
+                        "count": {"$sum": 1},
+                    }
+                },
+                {"$match": {"count": {"$gt": 1}}},
+            ],
+            allowDiskUse=True,
+        )
+    ]
+
+    keys = [("bill_number", 1), ("supplier_name", 1)]
+    index_name = "bill_number_1_supplier_name_1"
+    existing = procurement_collection.index_information().get(index_name)
+    if duplicates:
+        if not existing:
+            procurement_collection.create_index(keys)
+        return duplicates
+    if existing and not existing.get("unique"):
+        procurement_collection.drop_index(index_name)
+    procurement_collection.create_index(keys, unique=True)
+    return duplicates
+
+
+def iter_bill_rows(stream, file_format):
+    """
+    Yields (line_number, raw_bill) from a CSV or JSONL text stream without
+    reading it into memory. JSONL lines are whole bills with an `items` list;
+    CSV rows are grouped into bills. Unparseable lines, and CSV rows of a bill
+    that already ended a few rows earlier, yield an `error` key.
+    """
+    if file_format == "jsonl":
+        for line_number, line in enumerate(stream, start=1):
+            if not line.strip():
+                continue
+            try:
+                raw_bill = json.loads(line)
+            except json.JSONDecodeError as e:
+                raw_bill = {"error": f"Invalid JSON: {e}"}
+            if not isinstance(raw_bill, dict):
+                raw_bill = {"error": "Each line must be a JSON object"}
+            yield line_number, raw_bill
+        return
+
+    if file_format != "csv":
+        raise ValueError(f"Unsupported format: {file_format}")
+
+    reader = csv.DictReader(stream)
+    missing_columns = [
+        column
+        for column in BILL_CSV_COLUMNS
+        if column != "notes" and column not in (reader.fieldnames or [])
+    ]
+    if missing_columns:
+        raise ValueError(f"Missing CSV columns: {', '.join(missing_columns)}")
+
+    bill = None
+    bill_line = None
+    seen_keys = set()
+    for line_number, row in enumerate(reader, start=2):
+        key = (row.get("supplier_name"), row.get("bill_number"))
+        if bill is None or key != (bill["supplier_name"], bill["bill_number"]):
+            if bill is not None:
+                yield bill_line, bill
+            bill = {
+                "supplier_name": key[0],
+                "bill_number": key[1],
+                "bill_date": row.get("bill_date"),
+                "notes": row.get("notes"),
+                "items": [],
+            }
+            if key in seen_keys:
+                # Its earlier rows were already yielded as a complete bill
+                bill["error"] = (
+                    f"Bill '{key[1]}' of '{key[0]}': bill rows must be contiguous"
+                )
+            seen_keys.add(key)
+            bill_line = line_number
+        bill["items"].append(
+            {
+                "material": row.get("material"),
+                "quantity": row.get("quantity"),
+                "unit_price": row.get("unit_price"),
+            }
+        )
+    if bill is not None:
+        yield bill_line, bill
+
+
+def validate_bill(raw_bill):
+    """
+    Checks one raw bill with the same rules as the restock form. Returns the
+    normalized bill; items still reference materials by id or SKU.
+    Raises ValueError with a readable message.
+    """
+    if raw_bill.get("error"):
+        raise ValueError(raw_bill["error"])
+
+    supplier_name = str(raw_bill.get("supplier_name") or "").strip()
+    bill_number = str(raw_bill.get("bill_number") or "").strip()
+    bill_date_str = str(raw_bill.get("bill_date") or "").strip()
+    items = raw_bill.get("items") or []
+    if not all([supplier_name, bill_number, bill_date_str, items]):
+        raise ValueError(
+            "Supplier, Bill Number, Bill Date, and at least one item are required."
+        )
+    if not isinstance(items, list) or not all(isinstance(i, dict) for i in items):
+        raise ValueError("items must be a list of objects")
+
+    try:
+        bill_date = datetime.datetime.strptime(bill_date_str, "%Y-%m-%d")
+    except ValueError:
+        raise ValueError(f"Invalid bill date '{bill_date_str}', expected YYYY-MM-DD")
+
+    normalized_items = []
+    for item in items:
+        material = str(item.get("material") or item.get("material_id") or "").strip()
+        if not material:
+            raise ValueError("Every item needs a material id or SKU")
+        try:
+            quantity = float(item.get("quantity"))
+            unit_price = float(item.get("unit_price") or 0)
+        except (TypeError, ValueError):
+            raise ValueError(f"Invalid quantity or unit price for '{material}'")
+        if not (0 < quantity < math.inf and 0 <= unit_price < math.inf):
+            raise ValueError(f"Invalid quantity or unit price for '{material}'")
+        normalized_items.append(
+            {"material": material, "quantity": quantity, "unit_price": unit_price}
+        )
+
+    return {
+        "supplier_name": supplier_name,
+        "bill_number": bill_number,
+        "bill_date": bill_date,
+        "notes": raw_bill.get("notes") or "",
+        "items": normalized_items,
+    }
+
+
+def _resolve_batch_materials(db, bills):
+    """Maps every material reference of a batch (id or SKU) to its ObjectId."""
+    references = {item["material"] for bill in bills for item in bill["items"]}
+    ids = [ObjectId(ref) for ref in references if ObjectId.is_valid(ref)]
+    resolved = {}
+    for material in db.raw_materials.find(
+        {"$or": [{"_id": {"$in": ids}}, {"sku": {"$in": list(references)}}]},
+        {"sku": 1},
+    ):
+        resolved[str(material["_id"])] = material["_id"]
+        resolved[material.get("sku")] = material["_id"]
+    return resolved
+
+
+def _import_batch(db, batch, report, user_id):
+    """
+    Imports one batch of (line_number, bill): drops bills that already exist
+    (supplier + bill number), then inserts the rest and applies the summed
+    stock increments of the ones stored. There is no transaction: a failure
+    between the two leaves those bills stored without their stock increments.
+    """
+    bills = [bill for _, bill in batch]
+    resolved = _resolve_batch_materials(db, bills)
+
+    existing = {
+        (r["supplier_name"], r["bill_number"])
+        for r in db.procurement_records.find(
+            {"bill_number": {"$in": list({b["bill_number"] for b in bills})}},
+            {"supplier_name": 1, "bill_number": 1},
+        )
+    }
+
+    now = datetime.datetime.now()
+    documents = []
+    document_lines = []
+    for line_number, bill in batch:
+        key = (bill["supplier_name"], bill["bill_number"])
+        if key in existing:
+            report["duplicates"] += 1
+            continue
+        missing = [i["material"] for i in bill["items"] if i["material"] not in resolved]
+        if missing:
+            report["errors"].append(
+                {"line": line_number, "error": f"Unknown material: {', '.join(missing)}"}
+            )
+            continue
+        existing.add(key)  # The same bill twice in one file
+        document_lines.append(line_number)
+        documents.append(
+            {
+                "supplier_name": bill["supplier_name"],
+                "bill_number": bill["bill_number"],
+                "bill_date": bill["bill_date"],
+                "bill_file_id": None,
+                "procurement_items": [
+                    {
+                        "material_id": resolved[item["material"]],
+                        "quantity": item["quantity"],
+                        "unit_price": item["unit_price"],
+                    }
+                    for item in bill["items"]
+                ],
+                "notes": bill["notes"],
+                "created_at": now,
+            }
+        )
+
+    if not documents:
+        return
+
+    # The unique (bill_number, supplier_name) index rejects bills stored since
+    # the lookup above; the rest of the batch is still inserted
+    try:
+        db.procurement_records.insert_many(documents, ordered=False)
+        inserted = documents
+    except BulkWriteError as e:
+        failed = {error["index"]: error for error in e.details.get("writeErrors", [])}
+        inserted = []
+        for index, (line_number, document) in enumerate(zip(document_lines, documents)):
+            error = failed.get(index)
+            if error is None:
+                inserted.append(document)
+            elif error.get("code") == 11000:
+                report["duplicates"] += 1
+            else:
+                report["errors"].append({"line": line_number, "error": error["errmsg"]})
+    except PyMongoError as e:
+        for line_number in document_lines:
+            report["errors"].append(
+                {"line": line_number, "error": f"Batch not imported: {e}"}
+            )
+        return
+
+    if not inserted:
+        return
+
+    # Stock increments of the stored bills, summed per material
+    increments = defaultdict(float)
+    for document in inserted:
+        for item in document["procurement_items"]:
+            increments[item["material_id"]] += item["quantity"]
+
+    db.raw_materials.bulk_write(
+        [
+            UpdateOne(
+                {"_id": material_id},
+                {
+                    "$inc": {"current_quantity": quantity},
+                    "$set": {"last_stocked_on": now},
+                },
+            )
+            for material_id, quantity in increments.items()
+        ],
+        ordered=False,
+    )
+    record_stock_movements(
+        db,
+        [
+            stock_movement(
+                item["material_id"],
+                item["quantity"],
+                "restock",
+                "procurement_record",
+                document["_id"],
+            )
+            for document in inserted
+            for item in document["procurement_items"]
+        ],
+        user_id=user_id,
+    )
+
+    report["inserted"] += len(inserted)
+    report["materials_updated"] += len(increments)
+    report["restocked_material_ids"].update(increments)
+
+
+def import_bills(db, stream, file_format, batch_size=BILL_IMPORT_BATCH_SIZE, user_id=None):
+    """
+    Streams bills from a CSV or JSONL text stream into `procurement_records`.
+
+    Bills are keyed by supplier + bill number, so re-running an import after a
+    failure skips what was already stored instead of double counting stock.
+    Each batch is one unordered insert_many plus one bulk_write of the stock
+    increments of the bills it stored (no transaction, so it also runs on a
+    standalone server).
+    Returns {inserted, duplicates, materials_updated, restocked_material_ids,
+    errors}.
+    """
+    report = {
+        "inserted": 0,
+        "duplicates": 0,
+        "materials_updated": 0,
+        "restocked_material_ids": set(),
+        "errors": [],
+    }
+
+    batch = []
+    for line_number, raw_bill in iter_bill_rows(stream, file_format):
+        try:
+            batch.append((line_number, validate_bill(raw_bill)))
+        except ValueError as e:
+            report["errors"].append({"line": line_number, "error": str(e)})
+            continue
+        if len(batch) >= batch_size:
+            _import_batch(db, batch, report, user_id)
+            batch = []
+
+    if batch:
+        _import_batch(db, batch, report, user_id)
+    return report
@@ -0,0 +1,206 @@
+import datetime
+
+import numpy as np
+from pymongo import UpdateOne
+
+FORECASTS_COLLECTION = "material_forecasts"
+FORECAST_WRITE_BATCH_SIZE = 1000
+# Stockouts further out than this get no date (a near-zero usage rate would
+# put them past datetime.max)
+FORECAST_HORIZON_DAYS = 3650
+
+# Risk levels, from most to least urgent
+FORECAST_RISKS = ("out_of_stock", "critical", "warning", "ok", "no_usage")
+
+
+def ensure_forecast_indexes(db):
+    forecasts = db[FORECASTS_COLLECTION]
+    forecasts.create_index([("risk", 1), ("days_to_stockout", 1)])
+    forecasts.create_index([("days_to_stockout", 1)])
+
+
+def load_daily_consumption(db, material_index, start, window_days):
+    """
+    Builds a (materials x days) array of the quantities required by
+    operations created in [start, start + window_days), summed per day with
+    one aggregation.
+    """
+    usage = np.zeros((len(material_index), window_days))
+    pipeline = [
+        {"$match": {"created_at": {"$gte": start}}},
+        {"$unwind": "$materials_required"},
+        {
+            "$group": {
+                "_id": {
+                    "material_id": "$materials_required.material_id",
+                    "day": {"$dateToString": {"format": "%Y-%m-%d", "date": "$created_at"}},
+                },
+                "quantity": {"$sum": "$materials_required.quantity"},
+            }
+        },
+    ]
+
+    rows, days, quantities = [], [], []
+    for row in db.operations.aggregate(pipeline):
+        position = material_index.get(row["_id"]["material_id"])
+        if position is None:
+            continue
+        day = (datetime.datetime.strptime(row["_id"]["day"], "%Y-%m-%d") - start).days
+        if 0 <= day < window_days:
+            rows.append(position)
+            days.append(day)
+            quantities.append(row["quantity"] or 0)
+
+    if rows:
+        np.add.at(usage, (np.array(rows), np.array(days)), np.array(quantities, dtype=float))
+    return usage
+
+
+def load_lead_times(db, material_index, since, default_days):
+    """
+    Estimates a replenishment lead time per material as the median number of
+    days between its consecutive bills since `since`. Procurement records
+    carry no order date, so this is the observed restock cycle; materials
+    with fewer than two bills get `default_days`.
+    """
+    lead_times = np.full(len(material_index), float(default_days))
+    pipeline = [
+        {"$match": {"bill_date": {"$gte": since}}},
+        {"$unwind": "$procurement_items"},
+        {
+            "$group": {
+                "_id": {"$toObjectId": "$procurement_items.material_id"},
+                "bill_dates": {"$addToSet": "$bill_date"},
+            }
+        },
+        {"$match": {"bill_dates.1": {"$exists": True}}},
+    ]
+    for row in db.procurement_records.aggregate(pipeline):
+        position = material_index.get(row["_id"])
+        if position is None:
+            continue
+        dates = np.array(sorted(row["bill_dates"]), dtype="datetime64[D]")
+        gaps = np.diff(dates).astype(float)
+        gaps = gaps[gaps > 0]
+        if gaps.size:
+            lead_times[position] = float(np.median(gaps))
+    return lead_times
+
+
+def forecast_stockouts(quantity, reorder_level, usage, lead_times, half_life_days=14):
+    """
+    Vectorized stockout forecast for a whole catalogue.
+
+    `usage` is (materials x days) daily consumption, oldest day first. The
+    consumption rate is an exponentially weighted daily mean, so recent
+    demand counts more. Returns a dict of per-material arrays: daily rates,
+    days until stock and until the reorder level run out (inf without
+    usage), and the risk level.
+    """
+    window_days = usage.shape[1]
+    age = np.arange(window_days)[::-1]
+    weights = 0.5 ** (age / half_life_days)
+    rate = usage @ weights / weights.sum()
+    average_rate = usage.mean(axis=1)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        days_to_stockout = np.where(
+            rate > 0, np.maximum(quantity, 0) / rate, np.inf
+        )
+        days_to_reorder_level = np.where(
+            rate > 0, np.maximum(quantity - reorder_level, 0) / rate, np.inf
+        )
+
+    risk = np.select(
+        [
+            quantity <= 0,
+            rate <= 0,
+            days_to_stockout <= lead_times,
+            days_to_stockout <= 2 * lead_times,
+        ],
+        ["out_of_stock", "no_usage", "critical", "warning"],
+        default="ok",
+    )
+    days_to_stockout = np.where(quantity <= 0, 0, days_to_stockout)
+
+    return {
+        "rate": rate,
+        "average_rate": average_rate,
+        "days_to_stockout": days_to_stockout,
+        "days_to_reorder_level": days_to_reorder_level,
+        "risk": risk,
+    }
+
+
+def _finite_or_none(value):
+    return None if not np.isfinite(value) else round(float(value), 2)
+
+
+def run_stockout_forecast(db, window_days=90, default_lead_time_days=14):
+    """
+    Forecasts stockouts for every raw material and stores one document per
+    material in `material_forecasts` (_id = material id). Returns the number
+    of materials forecast.
+    """
+    now = datetime.datetime.now()
+    today = now.replace(hour=0, minute=0, second=0, microsecond=0)
+    start = today - datetime.timedelta(days=window_days - 1)
+
+    materials = list(
+        db.raw_materials.find({}, {"current_quantity": 1, "reorder_level": 1})
+    )
+    material_index = {m["_id"]: i for i, m in enumerate(materials)}
+    quantity = np.array([m.get("current_quantity") or 0 for m in materials], dtype=float)
+    reorder_level = np.array([m.get("reorder_level") or 0 for m in materials], dtype=float)
+
+    usage = load_daily_consumption(db, material_index, start, window_days)
+    lead_times = load_lead_times(
+        db, material_index, today - datetime.timedelta(days=365), default_lead_time_days
+    )
+    result = forecast_stockouts(quantity, reorder_level, usage, lead_times)
+
+    forecasts_collection = db[FORECASTS_COLLECTION]
+    operations = []
+    for i, material in enumerate(materials):
+        days_to_stockout = _finite_or_none(result["days_to_stockout"][i])
+        stockout_date = (
+            now + datetime.timedelta(days=days_to_stockout)
+            if days_to_stockout is not None
+            and days_to_stockout <= FORECAST_HORIZON_DAYS
+            else None
+        )
+        operations.append(
+            UpdateOne(
+                {"_id": material["_id"]},
+                {
+                    "$set": {
+                        "daily_rate": round(float(result["rate"][i]), 4),
+                        "average_daily_rate": round(float(result["average_rate"][i]), 4),
+                        "days_to_stockout": days_to_stockout,
+                        "stockout_date": stockout_date,
+                        "days_to_reorder_level": _finite_or_none(
+                            result["days_to_reorder_level"][i]
+                        ),
+                        "lead_time_days": round(float(lead_times[i]), 1),
+                        "order_by": (
+                            stockout_date - datetime.timedelta(days=float(lead_times[i]))
+                            if stockout_date
+                            else None
+                        ),
+                        "risk": str(result["risk"][i]),
+                        "window_days": window_days,
+                        "computed_at": now,
+                    }
+                },
+                upsert=True,
+            )
+        )
+        if len(operations) >= FORECAST_WRITE_BATCH_SIZE:
+            forecasts_collection.bulk_write(operations, ordered=False)
+            operations = []
+    if operations:
+        forecasts_collection.bulk_write(operations, ordered=False)
+
+    # Forecasts of materials deleted since the previous run
+    forecasts_collection.delete_many({"computed_at": {"$lt": now}})
+    return len(materials)
@@ -0,0 +1,184 @@
+import datetime
+from collections import defaultdict
+
+from bson.objectid import ObjectId
+
+from apps.pages.inventory.stock_levels import refresh_reorder_flags
+
+INVENTORY_LEDGER_COLLECTION = "inventory_ledger"
+INVENTORY_SNAPSHOTS_COLLECTION = "inventory_snapshots"
+
+# Why stock moved. `change` is signed: positive adds stock, negative removes it.
+LEDGER_REASONS = (
+    "initial_stock",  # Opening quantity of a new material
+    "restock",  # Procurement record logged
+    "procurement_edit",  # Quantities corrected on an existing procurement record
+    "operation_consume",  # Stock taken by an operation
+    "operation_release",  # Stock returned when an operation is deleted
+)
+
+
+def ensure_ledger_indexes(db):
+    ledger = db[INVENTORY_LEDGER_COLLECTION]
+    ledger.create_index([("material_id", 1), ("occurred_at", -1)])
+    ledger.create_index([("source.type", 1), ("source.id", 1)])
+    ledger.create_index([("occurred_at", -1)])
+    db[INVENTORY_SNAPSHOTS_COLLECTION].create_index(
+        [("material_id", 1), ("taken_at", -1)], unique=True
+    )
+
+
+def stock_movement(material_id, change, reason, source_type=None, source_id=None):
+    """Builds one movement for `record_stock_movements`."""
+    return {
+        "material_id": material_id,
+        "change": float(change),
+        "reason": reason,
+        "source": {"type": source_type, "id": source_id},
+    }
+
+
+def record_stock_movements(db, movements, user_id=None, session=None):
+    """
+    Appends stock movements to the ledger with one insert_many. Called next to
+    every `$inc` on `raw_materials.current_quantity`; entries are never updated
+    or deleted, corrections are recorded as new movements. Also refreshes the
+    `below_reorder_level` flag of the materials that moved.
+    """
+    movements = [m for m in movements if m["change"]]
+    if not movements:
+        return
+
+    # Callers pass the session's user id string; users are referenced by ObjectId
+    if isinstance(user_id, str) and ObjectId.is_valid(user_id):
+        user_id = ObjectId(user_id)
+    now = datetime.datetime.now()
+    db[INVENTORY_LEDGER_COLLECTION].insert_many(
+        [dict(m, occurred_at=now, recorded_by=user_id) for m in movements],
+        ordered=False,
+        session=session,
+    )
+    refresh_reorder_flags(db, {m["material_id"] for m in movements}, session=session)
+
+
+def _ledger_totals(db, ranges):
+    """
+    Sums ledger changes per material. `ranges` is a list of
+    (material_ids, after, until) windows; `after` may be None for "since the
+    beginning". Returns {material_id: total_change}.
+    """
+    clauses = []
+    for material_ids, after, until in ranges:
+        occurred_at = {"$lte": until}
+        if after is not None:
+            occurred_at["$gt"] = after
+        clauses.append({"material_id": {"$in": material_ids}, "occurred_at": occurred_at})
+    if not clauses:
+        return {}
+
+    pipeline = [
+        {"$match": {"$or": clauses}},
+        {"$group": {"_id": "$material_id", "change": {"$sum": "$change"}}},
+    ]
+    return {
+        row["_id"]: row["change"]
+        for row in db[INVENTORY_LEDGER_COLLECTION].aggregate(pipeline)
+    }
+
+
+def latest_snapshots(db, before=None, material_ids=None):
+    """
+    Returns {material_id: snapshot} with the newest snapshot of each material,
+    optionally taken at or before `before`.
+    """
+    match = {}
+    if before is not None:
+        match["taken_at"] = {"$lte": before}
+    if material_ids is not None:
+        match["material_id"] = {"$in": material_ids}
+
+    # $sort + $group/$first on the (material_id, taken_at) index runs as a
+    # distinct scan: one index entry per material, not the whole history.
+    pipeline = [
+        {"$match": match},
+        {"$sort": {"material_id": 1, "taken_at": -1}},
+        {
+            "$group": {
+                "_id": "$material_id",
+                "taken_at": {"$first": "$taken_at"},
+                "quantity": {"$first": "$quantity"},
+            }
+        },
+    ]
+    return {
+        row["_id"]: row for row in db[INVENTORY_SNAPSHOTS_COLLECTION].aggregate(pipeline)
+    }
+
+
+def quantity_at(db, material_id, at):
+    """
+    Stock of a material at a point in time: the newest snapshot at or before
+    `at` plus the ledger movements between the snapshot and `at`. Without a
+    snapshot the whole ledger is summed, which is exact for materials created
+    after the ledger was introduced.
+    """
+    snapshot = db[INVENTORY_SNAPSHOTS_COLLECTION].find_one(
+        {"material_id": material_id, "taken_at": {"$lte": at}},
+        sort=[("taken_at", -1)],
+    )
+    base = snapshot["quantity"] if snapshot else 0
+    after = snapshot["taken_at"] if snapshot else None
+    return base + _ledger_totals(db, [([material_id], after, at)]).get(material_id, 0)
+
+
+def take_inventory_snapshots(db, taken_at=None):
+    """
+    Writes one snapshot per material: the previous snapshot plus the ledger
+    movements since, compared against the live `current_quantity`.
+
+    A material's first snapshot is its live quantity, which gives materials
+    that predate the ledger an opening balance. Any difference between the
+    ledger and the live quantity is stored as `drift`.
+    Returns (snapshots_written, drifted_material_ids).
+    """
+    taken_at = taken_at or datetime.datetime.now()
+
+    materials = list(db.raw_materials.find({}, {"current_quantity": 1}))
+    previous = latest_snapshots(db, before=taken_at)
+
+    # Materials are usually snapshotted together, so this is one or two
+    # windows regardless of how many materials there are.
+    windows = defaultdict(list)
+    for material in materials:
+        snapshot = previous.get(material["_id"])
+        if snapshot:
+            windows[snapshot["taken_at"]].append(material["_id"])
+    totals = _ledger_totals(
+        db, [(ids, after, taken_at) for after, ids in windows.items()]
+    )
+
+    snapshots = []
+    drifted = []
+    for material in materials:
+        live_quantity = material.get("current_quantity", 0)
+        snapshot = previous.get(material["_id"])
+        if snapshot:
+            quantity = snapshot["quantity"] + totals.get(material["_id"], 0)
+        else:
+            quantity = live_quantity
+        drift = live_quantity - quantity
+        if drift:
+            drifted.append(material["_id"])
+        snapshots.append(
+            {
+                "material_id": material["_id"],
+                "taken_at": taken_at,
+                "quantity": quantity,
+                "live_quantity": live_quantity,
+                "drift": drift,
+            }
+        )
+
+    if snapshots:
+        db[INVENTORY_SNAPSHOTS_COLLECTION].insert_many(snapshots, ordered=False)
+    return len(snapshots), drifted
@@ -0,0 +1,46 @@
+import re
+
+MATERIAL_SEARCH_LIMIT = 20
+MATERIAL_SEARCH_MAX_LIMIT = 50
+
+_WORD = re.compile(r"\w+")
+
+
+def ensure_material_search_indexes(db):
+    # Multikey: one entry per lowercase word of the name and SKU
+    db.raw_materials.create_index("search_terms")
+
+
+def material_search_terms(material_name, sku):
+    """
+    Lowercase words of a material's name and SKU, plus the whole SKU, stored
+    on the material as `search_terms` so typeahead lookups are index prefix
+    scans.
+    """
+    terms = set(_WORD.findall(f"{material_name or ''} {sku or ''}".lower()))
+    if sku:
+        terms.add(sku.strip().lower())
+    return sorted(terms)
+
+
+def search_materials(db, text, limit=MATERIAL_SEARCH_LIMIT):
+    """
+    Materials whose name or SKU has a word starting with each word of `text`
+    ("ste rod" finds "Steel Rod 12mm"), sorted by name. Returns at most
+    `limit` projected documents; an empty search returns nothing.
+    """
+    words = _WORD.findall((text or "").lower())
+    if not words:
+        return []
+
+    # Anchored, case-sensitive prefixes on lowercase terms stay on the index
+    prefixes = [re.compile("^" + re.escape(word)) for word in words]
+    cursor = (
+        db.raw_materials.find(
+            {"search_terms": {"$all": prefixes}},
+            {"material_name": 1, "sku": 1, "uom": 1, "current_quantity": 1},
+        )
+        .sort("material_name", 1)
+        .limit(min(max(limit, 1), MATERIAL_SEARCH_MAX_LIMIT))
+    )
+    return list(cursor)
@@ -0,0 +1,239 @@
+import csv
+import datetime
+import hashlib
+import json
+import math
+
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+
+from apps.pages.inventory.material_search import material_search_terms
+from apps.pages.inventory.taxonomy import increment_counts
+
+PRICE_LIST_BATCH_SIZE = 1000
+
+# Price list fields copied onto raw materials; a row is written only when
+# their hash differs from the hash of the stored values.
+PRICE_LIST_FIELDS = ("material_name", "uom", "description", "list_price")
+PRICE_LIST_CSV_COLUMNS = ("sku",) + PRICE_LIST_FIELDS
+
+
+def ensure_sku_index(db):
+    """
+    Makes the raw materials SKU index unique (price list upserts are keyed on
+    it), replacing the plain index created by earlier versions. SKUs stored
+    twice would make that fail after the plain index is dropped, so they are
+    looked up first: while any remain, the plain index is kept. Returns the
+    duplicated SKUs.
+    """
+    raw_materials_collection = db.raw_materials
+    duplicates = [
+        row["_id"]
+        for row in raw_materials_collection.aggregate(
+            [
+                {"$group": {"_id": "$sku", "count": {"$sum": 1}}},
+                {"$match": {"count": {"$gt": 1}}},
+            ],
+            allowDiskUse=True,
+        )
+    ]
+
+    existing = raw_materials_collection.index_information().get("sku_1")
+    if duplicates:
+        if not existing:
+            raw_materials_collection.create_index("sku")
+        return duplicates
+    if existing and not existing.get("unique"):
+        raw_materials_collection.drop_index("sku_1")
+    raw_materials_collection.create_index("sku", unique=True)
+    return duplicates
+
+
+def iter_price_list_rows(stream, file_format):
+    """
+    Yields (line_number, raw_row) from a CSV or JSONL text stream without
+    reading it into memory. Unparseable lines yield an `error` key.
+    """
+    if file_format == "jsonl":
+        for line_number, line in enumerate(stream, start=1):
+            if not line.strip():
+                continue
+            try:
+                row = json.loads(line)
+            except json.JSONDecodeError as e:
+                row = {"error": f"Invalid JSON: {e}"}
+            if not isinstance(row, dict):
+                row = {"error": "Each line must be a JSON object"}
+            yield line_number, row
+        return
+
+    if file_format != "csv":
+        raise ValueError(f"Unsupported format: {file_format}")
+
+    reader = csv.DictReader(stream)
+    if "sku" not in (reader.fieldnames or []):
+        raise ValueError("Missing CSV column: sku")
+    for line_number, row in enumerate(reader, start=2):
+        yield line_number, row
+
+
+def validate_price_list_row(raw_row):
+    """
+    Normalizes one price list row. Only `sku` is required; fields left out
+    keep their stored value. Raises ValueError with a readable message.
+    """
+    if raw_row.get("error"):
+        raise ValueError(raw_row["error"])
+
+    sku = str(raw_row.get("sku") or "").strip()
+    if not sku:
+        raise ValueError("SKU is required.")
+
+    row = {"sku": sku}
+    for field in ("material_name", "uom", "description"):
+        value = raw_row.get(field)
+        if value is not None and str(value).strip():
+            row[field] = str(value).strip()
+
+    list_price = raw_row.get("list_price")
+    if list_price is not None and str(list_price).strip():
+        try:
+            row["list_price"] = round(float(list_price), 4)
+        except (TypeError, ValueError):
+            raise ValueError(f"Invalid list price '{list_price}' for '{sku}'")
+        if not 0 <= row["list_price"] < math.inf:
+            raise ValueError(f"Invalid list price '{list_price}' for '{sku}'")
+    return row
+
+
+def _fields_hash(fields):
+    """Stable hash of the price list fields of a row or stored material."""
+    values = {field: fields.get(field) for field in PRICE_LIST_FIELDS}
+    if values["list_price"] is not None:
+        values["list_price"] = float(values["list_price"])
+    payload = json.dumps(values, sort_keys=True, default=str)
+    return hashlib.sha1(payload.encode("utf-8")).hexdigest()
+
+
+def _sync_batch(db, batch, supplier_name, report):
+    """
+    Compares one batch of (line_number, row) with the stored materials (one
+    $in read on the SKU index) and upserts only new and changed ones with a
+    single bulk_write.
+    """
+    stored = {
+        m["sku"]: m
+        for m in db.raw_materials.find(
+            {"sku": {"$in": [row["sku"] for _, row in batch]}},
+            {field: 1 for field in PRICE_LIST_FIELDS + ("sku", "suppliers")},
+        )
+    }
+
+    now = datetime.datetime.now()
+    operations = []
+    operation_lines = []
+    new_supplier_uses = 0
+    for line_number, row in batch:
+        material = stored.get(row["sku"])
+        if material is None:
+            if not row.get("material_name") or not row.get("uom"):
+                report["errors"].append(
+                    {
+                        "line": line_number,
+                        "error": f"New material '{row['sku']}' needs a name and UoM",
+                    }
+                )
+                continue
+            merged = row
+        else:
+            # Fields left out of the row keep their stored value
+            merged = {**{f: material.get(f) for f in PRICE_LIST_FIELDS}, **row}
+            has_supplier = not supplier_name or supplier_name in (
+                material.get("suppliers") or []
+            )
+            if _fields_hash(merged) == _fields_hash(material) and has_supplier:
+                report["unchanged"] += 1
+                continue
+
+        update = {
+            "$set": {
+                **{f: merged.get(f) for f in PRICE_LIST_FIELDS},
+                "search_terms": material_search_terms(
+                    merged.get("material_name"), row["sku"]
+                ),
+                "price_list_synced_at": now,
+                "updated_at": now,
+            },
+            "$setOnInsert": {
+                "current_quantity": 0,
+                "reserved_quantity": 0,
+                "reorder_level": 0,
+                "below_reorder_level": False,
+                "categories": [],
+                "image_id": None,
+                "created_at": now,
+                "last_stocked_on": None,
+            },
+        }
+        if supplier_name:
+            update["$addToSet"] = {"suppliers": supplier_name}
+            if material is None or supplier_name not in (material.get("suppliers") or []):
+                new_supplier_uses += 1
+        else:
+            update["$setOnInsert"]["suppliers"] = []
+        # The same SKU twice in one batch is compared with the earlier row
+        suppliers = list((material or {}).get("suppliers") or [])
+        if supplier_name and supplier_name not in suppliers:
+            suppliers.append(supplier_name)
+        stored[row["sku"]] = {**merged, "suppliers": suppliers}
+
+        operations.append(UpdateOne({"sku": row["sku"]}, update, upsert=True))
+        operation_lines.append(line_number)
+
+    if not operations:
+        return
+
+    try:
+        result = db.raw_materials.bulk_write(operations, ordered=False)
+    except BulkWriteError as e:
+        result = e.details
+        for error in result.get("writeErrors", []):
+            report["errors"].append(
+                {"line": operation_lines[error["index"]], "error": error["errmsg"]}
+            )
+        report["inserted"] += result.get("nUpserted", 0)
+        report["updated"] += result.get("nModified", 0)
+    else:
+        report["inserted"] += result.upserted_count
+        report["updated"] += result.modified_count
+
+    if new_supplier_uses:
+        increment_counts(db, "suppliers", [supplier_name] * new_supplier_uses)
+
+
+def sync_price_list(
+    db, stream, file_format, supplier_name=None, batch_size=PRICE_LIST_BATCH_SIZE
+):
+    """
+    Streams a supplier price list (CSV or JSONL) into `raw_materials`, keyed
+    on SKU. Each row is hashed against the stored values of the same fields
+    and only new or changed materials are written, so re-running a sync with
+    the same file writes nothing. New materials start with no stock.
+    Returns {inserted, updated, unchanged, errors}.
+    """
+    report = {"inserted": 0, "updated": 0, "unchanged": 0, "errors": []}
+
+    batch = []
+    for line_number, raw_row in iter_price_list_rows(stream, file_format):
+        try:
+            batch.append((line_number, validate_price_list_row(raw_row)))
+        except ValueError as e:
+            report["errors"].append({"line": line_number, "error": str(e)})
+            continue
+        if len(batch) >= batch_size:
+            _sync_batch(db, batch, supplier_name, report)
+            batch = []
+
+    if batch:
+        _sync_batch(db, batch, supplier_name, report)
+    return report
@@ -0,0 +1,187 @@
+import datetime
+
+from pymongo import UpdateOne
+
+from apps.pages.inventory.ledger import INVENTORY_LEDGER_COLLECTION
+from apps.pages.inventory.stock_levels import refresh_reorder_flags
+
+REORDER_STATE_ID = "reorder_reminders"
+REORDER_CONSUMPTION_DAYS = 30
+REORDER_BATCH_SIZE = 1000
+
+
+def ensure_reorder_indexes(db):
+    # Only materials at or below their reorder level are indexed
+    db.raw_materials.create_index(
+        "below_reorder_level",
+        partialFilterExpression={"below_reorder_level": True},
+    )
+    db.raw_materials.create_index("updated_at")
+    # At most one pending reminder per material
+    db.inventory_reminders.create_index(
+        "material_id",
+        unique=True,
+        partialFilterExpression={"status": "pending"},
+    )
+
+
+def _changed_material_ids(db, since):
+    """
+    Materials whose stock or settings may have changed since `since`: the
+    ones with ledger movements, plus created or edited ones. Both are index
+    range reads. Returns None (= every material) on the first run.
+    """
+    if since is None:
+        return None
+    changed = set(
+        db[INVENTORY_LEDGER_COLLECTION].distinct(
+            "material_id", {"occurred_at": {"$gt": since}}
+        )
+    )
+    changed.update(db.raw_materials.distinct("_id", {"updated_at": {"$gt": since}}))
+    return list(changed)
+
+
+def _daily_consumption(db, material_ids, since):
+    """Average daily quantity consumed by operations since `since`, per material."""
+    days = max((datetime.datetime.now() - since).days, 1)
+    pipeline = [
+        {
+            "$match": {
+                "material_id": {"$in": material_ids},
+                "occurred_at": {"$gte": since},
+                "reason": {"$in": ["operation_consume", "operation_release"]},
+            }
+        },
+        {"$group": {"_id": "$material_id", "consumed": {"$sum": "$change"}}},
+    ]
+    return {
+        row["_id"]: max(-row["consumed"], 0) / days
+        for row in db[INVENTORY_LEDGER_COLLECTION].aggregate(pipeline)
+    }
+
+
+def _reminder_for(material, daily_rate, lead_time_days, today):
+    """
+    Pending reminder for a material that fell to its reorder level: order
+    enough to get back to the reorder level and cover consumption during the
+    lead time, before the remaining stock runs out.
+    """
+    quantity = material.get("current_quantity") or 0
+    reorder_level = material.get("reorder_level") or 0
+    quantity_to_order = max(reorder_level - quantity, 0) + daily_rate * lead_time_days
+    quantity_to_order = round(max(quantity_to_order, reorder_level, 1), 2)
+
+    days_left = quantity / daily_rate if daily_rate > 0 else lead_time_days
+    deadline = today + datetime.timedelta(
+        days=int(min(max(days_left - lead_time_days, 0), lead_time_days))
+    )
+    return {
+        "material_name": material.get("material_name"),
+        "quantity_to_order": quantity_to_order,
+        "uom": material.get("uom"),
+        "deadline": deadline,
+        "notes": (
+            f"Generated automatically: stock {quantity:g} {material.get('uom') or ''} "
+            f"is at or below the reorder level of {reorder_level:g}."
+        ),
+        "status": "pending",
+        "source": "auto",
+        "created_at": datetime.datetime.now(),
+        "created_by": None,
+    }
+
+
+def generate_reorder_reminders(db, lead_time_days):
+    """
+    Keeps reminders in step with the maintained `below_reorder_level` flag:
+
+    - flagged materials changed since the previous run get a pending reminder
+      (never replacing one that already exists, e.g. set by hand); they are
+      read through the flag's partial index,
+    - materials no longer flagged have their automatic reminders completed.
+
+    Reminders are written with one bulk_write per batch. The first run sets
+    the flag on every material.
+    Returns (materials_checked, reminders_created, reminders_completed).
+    """
+    state = db.maintenance_state.find_one({"_id": REORDER_STATE_ID}) or {}
+    run_started = datetime.datetime.now()
+    today = run_started.replace(hour=0, minute=0, second=0, microsecond=0)
+
+    changed_ids = _changed_material_ids(db, state.get("last_run_at"))
+    query = {"below_reorder_level": True}
+    if changed_ids is None:
+        # Materials stored before the flag was maintained
+        refresh_reorder_flags(db)
+    else:
+        query["_id"] = {"$in": changed_ids}
+    projection = {
+        "material_name": 1,
+        "uom": 1,
+        "current_quantity": 1,
+        "reorder_level": 1,
+    }
+
+    checked = created = 0
+    batch = []
+
+    def flush(materials):
+        nonlocal created
+        rates = _daily_consumption(
+            db,
+            [m["_id"] for m in materials],
+            today - datetime.timedelta(days=REORDER_CONSUMPTION_DAYS),
+        )
+        # A no-op for materials that already have a pending reminder
+        result = db.inventory_reminders.bulk_write(
+            [
+                UpdateOne(
+                    {"material_id": m["_id"], "status": "pending"},
+                    {
+                        "$setOnInsert": _reminder_for(
+                            m, rates.get(m["_id"], 0), lead_time_days, today
+                        )
+                    },
+                    upsert=True,
+                )
+                for m in materials
+            ],
+            ordered=False,
+        )
+        created += result.upserted_count
+
+    for material in db.raw_materials.find(query, projection):
+        batch.append(material)
+        checked += 1
+        if len(batch) >= REORDER_BATCH_SIZE:
+            flush(batch)
+            batch = []
+    if batch:
+        flush(batch)
+
+    # Automatic reminders of materials restocked above their reorder level
+    pending_ids = db.inventory_reminders.distinct(
+        "material_id", {"status": "pending", "source": "auto"}
+    )
+    still_below = set(
+        db.raw_materials.distinct(
+            "_id", {"_id": {"$in": pending_ids}, "below_reorder_level": True}
+        )
+    )
+    completed = db.inventory_reminders.update_many(
+        {
+            "material_id": {"$in": [i for i in pending_ids if i not in still_below]},
+            "status": "pending",
+            "source": "auto",
+        },
+        {"$set": {"status": "completed", "completed_at": run_started}},
+    ).modified_count
+
+    # Movements recorded while this run was going are picked up next time
+    db.maintenance_state.update_one(
+        {"_id": REORDER_STATE_ID},
+        {"$set": {"last_run_at": run_started, "updated_at": datetime.datetime.now()}},
+        upsert=True,
+    )
+    return checked, created, completed
@@ -0,0 +1,213 @@
+import datetime
+from collections import defaultdict
+
+from pymongo import UpdateOne
+
+from apps.pages.inventory.ledger import record_stock_movements, stock_movement
+
+RESERVATIONS_COLLECTION = "material_reservations"
+
+
+def ensure_reservation_indexes(db):
+    reservations = db[RESERVATIONS_COLLECTION]
+    reservations.create_index([("material_id", 1), ("operation_id", 1)], unique=True)
+    reservations.create_index("operation_id")
+    reservations.create_index("job_id")
+
+
+def _per_material(items, quantity_field):
+    """Sums the quantity of each material over a list of items."""
+    totals = defaultdict(float)
+    for item in items:
+        totals[item["material_id"]] += item[quantity_field]
+    return totals
+
+
+def reserve_materials(db, job_id, operation_id, materials_required, user_id=None):
+    """
+    Reserves an operation's required materials: one reservation per material
+    and operation, taken out of `current_quantity` and added to the
+    material's `reserved_quantity` total with a single bulk_write.
+    """
+    reserve_for_operations(
+        db, [(job_id, operation_id, materials_required)], user_id=user_id
+    )
+
+
+def reserve_for_operations(db, operations, user_id=None, session=None):
+    """
+    Batch form of `reserve_materials` for a list of
+    (job_id, operation_id, materials_required): one insert_many of
+    reservations and one bulk_write of stock changes summed per material.
+    """
+    now = datetime.datetime.now()
+    reservations = []
+    for job_id, operation_id, materials_required in operations:
+        for material_id, quantity in _per_material(materials_required, "quantity").items():
+            reservations.append(
+                {
+                    "material_id": material_id,
+                    "job_id": job_id,
+                    "operation_id": operation_id,
+                    "quantity": quantity,
+                    "created_at": now,
+                }
+            )
+    if not reservations:
+        return
+
+    totals = _per_material(reservations, "quantity")
+    db[RESERVATIONS_COLLECTION].insert_many(
+        reservations, ordered=False, session=session
+    )
+    db.raw_materials.bulk_write(
+        [
+            UpdateOne(
+                {"_id": material_id},
+                {"$inc": {"current_quantity": -quantity, "reserved_quantity": quantity}},
+            )
+            for material_id, quantity in totals.items()
+        ],
+        ordered=False,
+        session=session,
+    )
+    record_stock_movements(
+        db,
+        [
+            stock_movement(
+                r["material_id"],
+                -r["quantity"],
+                "operation_consume",
+                "operation",
+                r["operation_id"],
+            )
+            for r in reservations
+        ],
+        user_id=user_id,
+        session=session,
+    )
+
+
+def reserve_if_available(db, job_id, operation_id, materials_required, user_id=None):
+    """
+    Reserves an operation's required materials only if all of them are in
+    stock. Each material is taken with an update guarded by
+    `current_quantity >= quantity`, so concurrent callers never take the same
+    stock twice; if one is short, the ones already taken are put back.
+    Works without a transaction. Returns True if the materials were reserved.
+    """
+    totals = _per_material(materials_required, "quantity")
+    taken = []
+    for material_id, quantity in totals.items():
+        result = db.raw_materials.update_one(
+            {"_id": material_id, "current_quantity": {"$gte": quantity}},
+            {"$inc": {"current_quantity": -quantity, "reserved_quantity": quantity}},
+        )
+        if not result.modified_count:
+            # Short on this one: put back what was taken so far
+            for taken_id, taken_quantity in taken:
+                db.raw_materials.update_one(
+                    {"_id": taken_id},
+                    {
+                        "$inc": {
+                            "current_quantity": taken_quantity,
+                            "reserved_quantity": -taken_quantity,
+                        }
+                    },
+                )
+            return False
+        taken.append((material_id, quantity))
+
+    now = datetime.datetime.now()
+    if totals:
+        db[RESERVATIONS_COLLECTION].insert_many(
+            [
+                {
+                    "material_id": material_id,
+                    "job_id": job_id,
+                    "operation_id": operation_id,
+                    "quantity": quantity,
+                    "created_at": now,
+                }
+                for material_id, quantity in totals.items()
+            ],
+            ordered=False,
+        )
+    record_stock_movements(
+        db,
+        [
+            stock_movement(
+                material_id, -quantity, "operation_consume", "operation", operation_id
+            )
+            for material_id, quantity in totals.items()
+        ],
+        user_id=user_id,
+    )
+    return True
+
+
+def _legacy_reservations(db, operation_id):
+    """
+    Reservations of an operation still held in the `in_use_quantity` arrays
+    of materials not yet moved by `flask migrate-reservations`.
+    """
+    reservations = []
+    for material in db.raw_materials.find(
+        {"in_use_quantity.operation_id": operation_id}, {"in_use_quantity": 1}
+    ):
+        for entry in material["in_use_quantity"]:
+            if entry.get("operation_id") == operation_id:
+                reservations.append(
+                    {
+                        "material_id": material["_id"],
+                        "quantity": entry.get("required_quantity", 0),
+                    }
+                )
+    return reservations
+
+
+def release_reservations(db, operation_id, user_id=None):
+    """
+    Releases every reservation of an operation and returns the quantities to
+    `current_quantity`. Returns the released reservations.
+    """
+    reservations = list(
+        db[RESERVATIONS_COLLECTION].find(
+            {"operation_id": operation_id}, {"material_id": 1, "quantity": 1}
+        )
+    )
+    legacy = not reservations
+    if legacy:
+        # Not migrated yet: the reservation is an in_use_quantity entry and
+        # the material has no reserved_quantity total to decrement
+        reservations = _legacy_reservations(db, operation_id)
+        if not reservations:
+            return []
+    else:
+        db[RESERVATIONS_COLLECTION].delete_many({"operation_id": operation_id})
+
+    totals = _per_material(reservations, "quantity")
+    updates = []
+    for material_id, quantity in totals.items():
+        if legacy:
+            update = {
+                "$inc": {"current_quantity": quantity},
+                "$pull": {"in_use_quantity": {"operation_id": operation_id}},
+            }
+        else:
+            update = {
+                "$inc": {"current_quantity": quantity, "reserved_quantity": -quantity}
+            }
+        updates.append(UpdateOne({"_id": material_id}, update))
+    db.raw_materials.bulk_write(updates, ordered=False)
+    record_stock_movements(
+        db,
+        [
+            stock_movement(
+                material_id, quantity, "operation_release", "operation", operation_id
+            )
+            for material_id, quantity in totals.items()
+        ],
+        user_id=user_id,
+    )
+    return reservations
@@ -9,13 +9,48 @@ from flask import (
     flash,
     Response,
 )
+from apps.pages.bulk_import import import_upload
+from apps.pages.choices import MATERIAL_UOMS
 from apps.pages.database import get_db
+from apps.pages.exports import (
+    EXPORT_BATCH_SIZE,
+    EXPORT_FORMATS,
+    export_cursor,
+    export_response,
+)
+from apps.pages.vocabulary import get_vocabulary, invalidate_vocabulary
+from apps.pages.inventory.bill_import import import_bills
+from apps.pages.inventory.forecast import FORECAST_RISKS, FORECASTS_COLLECTION
+from apps.pages.inventory.material_search import (
+    MATERIAL_SEARCH_LIMIT,
+    material_search_terms,
+    search_materials,
+)
+from apps.pages.inventory.taxonomy import (
+    AUTOCOMPLETE_LIMIT,
+    autocomplete,
+    increment_counts,
+)
+from apps.pages.inventory.waitlist import schedule_reevaluation
+from apps.pages.inventory.ledger import (
+    INVENTORY_LEDGER_COLLECTION,
+    quantity_at,
+    record_stock_movements,
+    stock_movement,
+)
 from apps.pages.authentication.routes import login_required
+from bson import json_util
+from bson.errors import InvalidId
 from bson.objectid import ObjectId
 import datetime
+import io
 import json
+import math
+import re
+from collections import defaultdict
 from gridfs import GridFS
 from gridfs.errors import NoFile  # NEW: Import NoFile for specific error handling
+from pymongo import UpdateOne
 from werkzeug.utils import secure_filename
 
 blueprint = Blueprint("inventory", __name__, url_prefix="/inventory")
@@ -28,8 +63,6 @@ def create_raw_material():
 
     # --- Centralized Database Collection Variables ---
     raw_materials_collection = db.raw_materials
-    categories_collection = db.raw_material_categories
-    suppliers_collection = db.raw_material_suppliers
     # -------------------------------------------------
 
     if request.method == "POST":
@@ -81,29 +114,24 @@ def create_raw_material():
             flash(f"SKU '{sku}' already exists. Please use a unique SKU.", "error")
             return redirect(url_for("inventory.create_raw_material"))
 
-        # Add new categories/suppliers to their respective collections
-        if categories:
-            for category_name in categories:
-                # Increment count for the category, or create it with a count of 1 if it's new
-                categories_collection.update_one(
-                    {"name": category_name}, {"$inc": {"count": 1}}, upsert=True
-                )
-        if suppliers:
-            for supplier_name in suppliers:
-                # Increment count for the supplier, or create it with a count of 1 if it's new
-                suppliers_collection.update_one(
-                    {"name": supplier_name}, {"$inc": {"count": 1}}, upsert=True
-                )
+        # Add new categories/suppliers to their respective collections, or
+        # increment their counts, with one bulk_write each
+        increment_counts(db, "categories", categories)
+        increment_counts(db, "suppliers", suppliers)
 
         # Insert the new raw material
         now = datetime.datetime.now()
         material_doc = {
             "material_name": material_name,
             "sku": sku,
+            "search_terms": material_search_terms(material_name, sku),
             "description": description,
             "uom": uom,
             "current_quantity": initial_quantity,
+            "reserved_quantity": 0,
             "reorder_level": reorder_level,
+            "below_reorder_level": reorder_level > 0
+            and initial_quantity <= reorder_level,
             "categories": categories,
             "suppliers": suppliers,
             "image_id": image_id,  # Store the GridFS file ID
@@ -111,9 +139,17 @@ def create_raw_material():
             "updated_at": now,
             "last_stocked_on": now,  # Set initial stock date
         }
-        raw_materials_collection.insert_one(material_doc)
+        material_id = raw_materials_collection.insert_one(material_doc).inserted_id
+        invalidate_vocabulary(
+            "material_categories", "material_suppliers", "material_uoms"
+        )
 
-        # TODO: If initial_quantity > 0, create an entry in an 'inventory_log' collection.
+        # Opening stock goes into the inventory ledger like any other movement
+        record_stock_movements(
+            db,
+            [stock_movement(material_id, initial_quantity, "initial_stock")],
+            user_id=session.get("user_id"),
+        )
 
         flash(f"Successfully created raw material: {material_name}", "success")
         return redirect(
@@ -121,30 +157,54 @@ def create_raw_material():
         )  # Or redirect to a manage page
 
     # --- Prepare data for GET request ---
-    uom_list = [
-        "kg",
-        "grams",
-        "meters",
-        "mm",
-        "liters",
-        "units",
-        "pairs",
-        "sheets",
-        "spools",
-    ]
-    categories_list = [
-        doc["name"] for doc in categories_collection.find({}, {"name": 1})
-    ]
-    suppliers_list = [doc["name"] for doc in suppliers_collection.find({}, {"name": 1})]
-
+    uom_list = list(MATERIAL_UOMS)
+    # Categories and suppliers are suggested through /api/<kind>/autocomplete
     return render_template(
         "pages/inventory/create-raw-material.html",
         uom_list=uom_list,
-        categories_whitelist=json.dumps(categories_list),
-        suppliers_whitelist=json.dumps(suppliers_list),
     )
 
 
+@blueprint.route("/api/<any(categories, suppliers):kind>/autocomplete", methods=["GET"])
+@login_required
+def taxonomy_autocomplete(kind):
+    """
+    JSON list of category or supplier names starting with `q`, for the tag
+    inputs of the raw material form. Without `q`, the most used names.
+    """
+    db = get_db()
+    try:
+        limit = min(max(request.args.get("limit", AUTOCOMPLETE_LIMIT, type=int), 1), 50)
+        return jsonify(autocomplete(db, kind, request.args.get("q", ""), limit))
+    except Exception as e:
+        print(f"Error autocompleting {kind}: {e}")
+        return jsonify({"error": str(e)}), 500
+
+
+@blueprint.route("/raw-materials/import", methods=["POST"])
+@login_required
+def import_raw_materials():
+    """
+    Imports raw materials from an uploaded CSV or JSONL file (`records_file`),
+    streaming it in batches. Returns the number inserted and per-row errors.
+    """
+    db = get_db()
+    try:
+        report = import_upload(
+            db,
+            "raw_materials",
+            request.files.get("records_file"),
+            request.form.get("format"),
+            user_id=session.get("user_id"),
+        )
+        return jsonify(report)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        print(f"Error importing raw materials: {e}")
+        return jsonify({"error": str(e)}), 500
+
+
 @blueprint.route("/image/<image_id>")
 def get_raw_material_image(image_id):
     """Serves a raw material image from GridFS."""
@@ -175,81 +235,512 @@ def get_raw_material_image(image_id):
         )  # NEW: More generic error for other exceptions
 
 
+# Columns the raw materials table may be sorted on (query value -> document field)
+MATERIAL_SORT_FIELDS = {
+    "material_name": "material_name",
+    "sku": "sku",
+    "uom": "uom",
+    "current_quantity": "current_quantity",
+    "reorder_level": "reorder_level",
+    "last_stocked_on": "last_stocked_on",
+}
+
+# Stock level filter values -> condition on the material document
+STOCK_LEVEL_FILTERS = {
+    "out_of_stock": {"current_quantity": {"$lte": 0}},
+    "below_reorder": {"$expr": {"$lte": ["$current_quantity", "$reorder_level"]}},
+    "above_reorder": {"$expr": {"$gt": ["$current_quantity", "$reorder_level"]}},
+}
+
+
+def build_materials_filter(args):
+    """
+    Builds the MongoDB filter for the raw materials table from request args
+    (q, category, supplier, uom, stock_level). "All" or empty means no filter.
+    """
+    query = {}
+
+    search_query = args.get("q", "").strip()
+    if search_query:
+        pattern = {"$regex": re.escape(search_query), "$options": "i"}
+        query["$or"] = [{"material_name": pattern}, {"sku": pattern}]
+
+    for arg_name, field in (
+        ("category", "categories"),
+        ("supplier", "suppliers"),
+        ("uom", "uom"),
+    ):
+        value = args.get(arg_name, "")
+        if value and value != "All":
+            query[field] = value
+
+    stock_level = args.get("stock_level", "")
+    if stock_level in STOCK_LEVEL_FILTERS:
+        query.update(STOCK_LEVEL_FILTERS[stock_level])
+
+    return query
+
+
+def fetch_materials_page(db, args):
+    """
+    Returns one projected page of raw materials plus the stock stats for the
+    filtered set, in a single aggregation.
+    """
+    page = max(args.get("page", 1, type=int), 1)
+    per_page = min(max(args.get("per_page", 10, type=int), 1), 100)
+
+    sort_field = MATERIAL_SORT_FIELDS.get(args.get("sort"), "last_stocked_on")
+    sort_order = 1 if args.get("order") == "asc" else -1
+
+    pipeline = [
+        {"$match": build_materials_filter(args)},
+        # Sorting before $facet lets the sort use an index
+        {"$sort": {sort_field: sort_order, "_id": sort_order}},
+        {
+            "$facet": {
+                "rows": [
+                    {"$skip": (page - 1) * per_page},
+                    {"$limit": per_page},
+                    {
+                        "$lookup": {
+                            "from": FORECASTS_COLLECTION,
+                            "localField": "_id",
+                            "foreignField": "_id",
+                            "pipeline": [
+                                {
+                                    "$project": {
+                                        "days_to_stockout": 1,
+                                        "stockout_date": 1,
+                                        "risk": 1,
+                                    }
+                                }
+                            ],
+                            "as": "forecast",
+                        }
+                    },
+                    {
+                        "$project": {
+                            "material_name": 1,
+                            "sku": 1,
+                            "uom": 1,
+                            "current_quantity": 1,
+                            "reorder_level": 1,
+                            "categories": 1,
+                            "suppliers": 1,
+                            "image_id": 1,
+                            "last_stocked_on": 1,
+                            "in_use_total": {"$ifNull": ["$reserved_quantity", 0]},
+                            "forecast": {"$first": "$forecast"},
+                        }
+                    },
+                ],
+                "stats": [
+                    {
+                        "$group": {
+                            "_id": None,
+                            "total": {"$sum": 1},
+                            "in_stock": {
+                                "$sum": {
+                                    "$cond": [{"$gt": ["$current_quantity", 0]}, 1, 0]
+                                }
+                            },
+                            "out_of_stock": {
+                                "$sum": {
+                                    "$cond": [{"$gt": ["$current_quantity", 0]}, 0, 1]
+                                }
+                            },
+                            "below_reorder_level": {
+                                "$sum": {
+                                    "$cond": [
+                                        {
+                                            "$lte": [
+                                                "$current_quantity",
+                                                "$reorder_level",
+                                            ]
+                                        },
+                                        1,
+                                        0,
+                                    ]
+                                }
+                            },
+                        }
+                    },
+                    {"$project": {"_id": 0}},
+                ],
+            }
+        },
+    ]
+
+    result = next(db.raw_materials.aggregate(pipeline), {})
+
+    stats = (result.get("stats") or [None])[0] or {
+        "total": 0,
+        "in_stock": 0,
+        "out_of_stock": 0,
+        "below_reorder_level": 0,
+    }
+    stats["above_reorder_level"] = stats["total"] - stats["below_reorder_level"]
+
+    return {
+        "materials": result.get("rows", []),
+        "stats": stats,
+        "pagination": {
+            "page": page,
+            "per_page": per_page,
+            "total": stats["total"],
+            "total_pages": math.ceil(stats["total"] / per_page),
+        },
+    }
+
+
 @blueprint.route("/manage-raw-materials", methods=["GET"])
 @login_required
 def manage_raw_materials():
     """
-    Renders the page to display and manage all raw materials in a sortable,
-    filterable table.
+    Renders the page to display and manage all raw materials. The table itself
+    is loaded page by page from `raw_materials_data`.
     """
     db = get_db()
 
-    # --- Centralized Database Collection Variables ---
-    raw_materials_collection = db.raw_materials
-    categories_collection = db.raw_material_categories
-    suppliers_collection = db.raw_material_suppliers
-    # -------------------------------------------------
-
-    # --- Fetch all raw materials for the table ---
-    raw_materials_list = list(
-        raw_materials_collection.find({}).sort("last_stocked_on", -1)
-    )
-    # NEW: Convert ObjectId to string for image_id for easier URL generation in template
-    for material in raw_materials_list:
-        if material.get("image_id"):
-            material["image_id"] = str(material["image_id"])
+    # --- First page and stats cards in one query ---
+    initial_page = fetch_materials_page(db, request.args)
 
     # --- Get data for filters ---
 
     # 1. Get all unique categories
-    all_categories = categories_collection.distinct("name")
-    all_categories = sorted([c for c in all_categories if c])
+    all_categories = get_vocabulary(db, "material_categories")
 
     # 2. Get all unique suppliers
-    all_suppliers = suppliers_collection.distinct("name")
-    all_suppliers = sorted([s for s in all_suppliers if s])
+    all_suppliers = get_vocabulary(db, "material_suppliers")
 
     # 3. Get all unique UoMs
-    all_uoms = raw_materials_collection.distinct("uom")
-    all_uoms = sorted([u for u in all_uoms if u])
+    all_uoms = get_vocabulary(db, "material_uoms")
 
     # --- Fetch active reminders ---
     active_reminders = list(
         db.inventory_reminders.find({"status": "pending"}).sort("deadline", 1)
     )
 
-    # --- Compute statistics for dashboard cards ---
-    stats = {
-        "total": len(raw_materials_list),
-        "in_stock": 0,
-        "above_reorder_level": 0,  # New stat
-        "out_of_stock": 0,
-        "below_reorder_level": 0,
-    }
-
-    for material in raw_materials_list:
-        current_quantity = material.get("current_quantity", 0)
-        reorder_level = material.get("reorder_level", 0)
-
-        if current_quantity > 0:
-            stats["in_stock"] += 1
-        else:
-            stats["out_of_stock"] += 1
-
-        if current_quantity <= reorder_level:
-            stats["below_reorder_level"] += 1
-        else:  # current_quantity > reorder_level
-            stats["above_reorder_level"] += 1
-
     return render_template(
         "pages/inventory/manage-raw-materials.html",
-        raw_materials_list=raw_materials_list,
         all_categories=all_categories,
         all_suppliers=all_suppliers,
         all_uoms=all_uoms,
         active_reminders=active_reminders,
-        stats=stats,
+        stats=initial_page["stats"],
+        initial_page_json=json_util.dumps(initial_page),
+    )
+
+
+@blueprint.route("/api/raw-materials", methods=["GET"])
+@login_required
+def raw_materials_data():
+    """
+    JSON data source for the raw materials table: one projected page of
+    materials with stock stats. Supports q, category, supplier, uom,
+    stock_level, sort, order, page and per_page.
+    """
+    db = get_db()
+    try:
+        return Response(
+            json_util.dumps(fetch_materials_page(db, request.args)),
+            200,
+            {"Content-Type": "application/json"},
+        )
+    except Exception as e:
+        print(f"Error fetching raw materials page: {e}")
+        return jsonify({"error": str(e)}), 500
+
+
+MATERIAL_EXPORT_COLUMNS = [
+    ("Material Name", "material_name"),
+    ("SKU", "sku"),
+    ("UoM", "uom"),
+    ("Current Quantity", "current_quantity"),
+    ("Reserved Quantity", "reserved_quantity"),
+    ("Reorder Level", "reorder_level"),
+    ("Categories", "categories"),
+    ("Suppliers", "suppliers"),
+    ("List Price", "list_price"),
+    ("Last Stocked On", "last_stocked_on"),
+    ("Created At", "created_at"),
+]
+
+
+@blueprint.route("/raw-materials/export", methods=["GET"])
+@login_required
+def export_raw_materials():
+    """
+    Streams every raw material matching the raw materials table filters and
+    sort as CSV or XLSX (`format`), from a batched projected cursor.
+    """
+    db = get_db()
+    file_format = request.args.get("format", "csv")
+    if file_format not in EXPORT_FORMATS:
+        return jsonify({"error": "format must be csv or xlsx"}), 400
+
+    sort_field = MATERIAL_SORT_FIELDS.get(request.args.get("sort"), "last_stocked_on")
+    sort_order = 1 if request.args.get("order") == "asc" else -1
+    cursor = export_cursor(
+        db.raw_materials,
+        build_materials_filter(request.args),
+        {field: 1 for _, field in MATERIAL_EXPORT_COLUMNS},
+        [(sort_field, sort_order), ("_id", sort_order)],
+    )
+
+    def rows():
+        for material in cursor:
+            yield [material.get(field) for _, field in MATERIAL_EXPORT_COLUMNS]
+
+    return export_response(
+        file_format,
+        "raw-materials",
+        [header for header, _ in MATERIAL_EXPORT_COLUMNS],
+        rows(),
+    )
+
+
+@blueprint.route("/api/materials/search", methods=["GET"])
+@login_required
+def material_search():
+    """
+    JSON typeahead for the material pickers of the operation and restock
+    forms: up to `limit` materials whose name or SKU words start with the
+    words of `q`.
+    """
+    db = get_db()
+    try:
+        materials = search_materials(
+            db,
+            request.args.get("q", ""),
+            request.args.get("limit", MATERIAL_SEARCH_LIMIT, type=int),
+        )
+        for material in materials:
+            material["_id"] = str(material["_id"])
+        return jsonify(materials)
+    except Exception as e:
+        print(f"Error searching raw materials: {e}")
+        return jsonify({"error": str(e)}), 500
+
+
+MAX_FORECASTS_PER_REQUEST = 500
+
+
+@blueprint.route("/api/forecast", methods=["GET"])
+@login_required
+def stockout_forecast():
+    """
+    JSON: stored stockout forecasts, soonest stockout first. Filters by `risk`
+    (comma separated) or a single `material_id`; `limit` caps the result.
+    Forecasts are computed in batch by the forecast-stockouts command.
+    """
+    db = get_db()
+    try:
+        query = {}
+        material_id = request.args.get("material_id")
+        if material_id:
+            if not ObjectId.is_valid(material_id):
+                return jsonify({"error": "Invalid material ID"}), 400
+            query["_id"] = ObjectId(material_id)
+
+        risks = [r for r in request.args.get("risk", "").split(",") if r]
+        if any(risk not in FORECAST_RISKS for risk in risks):
+            return jsonify({"error": f"risk must be one of {', '.join(FORECAST_RISKS)}"}), 400
+        if risks:
+            query["risk"] = {"$in": risks}
+        elif not material_id:
+            # Materials with a projected stockout only, on the index
+            query["days_to_stockout"] = {"$gte": 0}
+
+        limit = min(
+            max(request.args.get("limit", 100, type=int), 1), MAX_FORECASTS_PER_REQUEST
+        )
+        forecasts = list(
+            db[FORECASTS_COLLECTION]
+            .find(query)
+            .sort([("days_to_stockout", 1), ("_id", 1)])
+            .limit(limit)
+        )
+
+        material_map = resolve_materials(
+            db,
+            [forecast["_id"] for forecast in forecasts],
+            {"material_name": 1, "sku": 1, "uom": 1, "current_quantity": 1},
+        )
+        for forecast in forecasts:
+            material = material_map.get(str(forecast["_id"]), {})
+            forecast["material_name"] = material.get("material_name")
+            forecast["sku"] = material.get("sku")
+            forecast["uom"] = material.get("uom")
+            forecast["current_quantity"] = material.get("current_quantity")
+
+        return Response(
+            json_util.dumps({"forecasts": forecasts}),
+            200,
+            {"Content-Type": "application/json"},
+        )
+    except Exception as e:
+        print(f"Error fetching stockout forecast: {e}")
+        return jsonify({"error": str(e)}), 500
+
+
+USAGE_OPERATIONS_PER_PAGE = 10
+USAGE_TOP_JOBS = 10
+USAGE_MONTHS = 12
+
+
+def fetch_material_usage(db, material_id, page=1, per_page=USAGE_OPERATIONS_PER_PAGE):
+    """
+    Returns one page of the operations that require a material (newest first)
+    and its consumption totals overall, per job and per month, in a single
+    aggregation on the (materials_required.material_id, created_at) index.
+    Machine names of the page are resolved with one extra query.
+    """
+    pipeline = [
+        # Suspended operations wait for stock, they have not consumed any
+        {
+            "$match": {
+                "materials_required.material_id": material_id,
+                "status": {"$ne": "suspended"},
+            }
+        },
+        {"$sort": {"created_at": -1}},
+        {
+            "$addFields": {
+                "quantity_used": {
+                    "$sum": {
+                        "$map": {
+                            "input": {
+                                "$filter": {
+                                    "input": "$materials_required",
+                                    "cond": {"$eq": ["$$this.material_id", material_id]},
+                                }
+                            },
+                            "in": "$$this.quantity",
+                        }
+                    }
+                }
+            }
+        },
+        {
+            "$facet": {
+                "rows": [
+                    {"$skip": (page - 1) * per_page},
+                    {"$limit": per_page},
+                    {
+                        "$lookup": {
+                            "from": "jobs",
+                            "localField": "job_id",
+                            "foreignField": "_id",
+                            "pipeline": [{"$project": {"job_name": 1}}],
+                            "as": "job",
+                        }
+                    },
+                    {
+                        "$project": {
+                            "operation_name": 1,
+                            "job_id": 1,
+                            "job_name": {"$first": "$job.job_name"},
+                            "assigned_machine": 1,
+                            "status": 1,
+                            "quantity_used": 1,
+                            "created_at": 1,
+                        }
+                    },
+                ],
+                "totals": [
+                    {
+                        "$group": {
+                            "_id": None,
+                            "operation_count": {"$sum": 1},
+                            "quantity_used": {"$sum": "$quantity_used"},
+                        }
+                    }
+                ],
+                "by_job": [
+                    {
+                        "$group": {
+                            "_id": "$job_id",
+                            "operation_count": {"$sum": 1},
+                            "quantity_used": {"$sum": "$quantity_used"},
+                        }
+                    },
+                    {"$sort": {"quantity_used": -1}},
+                    {"$limit": USAGE_TOP_JOBS},
+                    {
+                        "$lookup": {
+                            "from": "jobs",
+                            "localField": "_id",
+                            "foreignField": "_id",
+                            "pipeline": [{"$project": {"job_name": 1}}],
+                            "as": "job",
+                        }
+                    },
+                    {
+                        "$project": {
+                            "job_name": {"$first": "$job.job_name"},
+                            "operation_count": 1,
+                            "quantity_used": 1,
+                        }
+                    },
+                ],
+                "by_month": [
+                    {
+                        "$group": {
+                            "_id": {
+                                "$dateToString": {"format": "%Y-%m", "date": "$created_at"}
+                            },
+                            "operation_count": {"$sum": 1},
+                            "quantity_used": {"$sum": "$quantity_used"},
+                        }
+                    },
+                    {"$sort": {"_id": -1}},
+                    {"$limit": USAGE_MONTHS},
+                ],
+            }
+        },
+    ]
+
+    result = next(db.operations.aggregate(pipeline), {})
+    operations = result.get("rows", [])
+
+    # --- Machine names for the page in one batch ---
+    machine_ids = list(
+        {op["assigned_machine"] for op in operations if op.get("assigned_machine")}
     )
+    machine_map = {
+        m["_id"]: m.get("machine_name")
+        for m in db.machines.find({"_id": {"$in": machine_ids}}, {"machine_name": 1})
+    }
+    for op in operations:
+        op["machine_name"] = machine_map.get(op.get("assigned_machine"), "N/A")
+
+    totals = (result.get("totals") or [None])[0] or {
+        "operation_count": 0,
+        "quantity_used": 0,
+    }
+    totals.pop("_id", None)
+    totals["by_job"] = result.get("by_job", [])
+    totals["by_month"] = [
+        {
+            "month": datetime.datetime.strptime(row["_id"], "%Y-%m"),
+            "operation_count": row["operation_count"],
+            "quantity_used": row["quantity_used"],
+        }
+        for row in result.get("by_month", [])
+        if row["_id"]
+    ]
+
+    return {
+        "operations": operations,
+        "totals": totals,
+        "pagination": {
+            "page": page,
+            "per_page": per_page,
+            "total": totals["operation_count"],
+            "total_pages": math.ceil(totals["operation_count"] / per_page),
+        },
+    }
 
 
 @blueprint.route("/raw-material/<material_id>")
@@ -285,35 +776,23 @@ def raw_material_detail(material_id):
             "class": "badge-soft-success",
         }
 
-    # --- Find Operations Using This Material ---
-    # This is a placeholder query. You'll need to adjust it based on your
-    # actual 'operations' collection schema.
-    operations_using_material = list(
-        db.operations.find({"materials_used.material_id": ObjectId(material_id)})
-    )
-    # Enrich operations data with machine names
-    machine_ids = [op.get("machine_id") for op in operations_using_material]
-    machines = db.machines.find({"_id": {"$in": machine_ids}})
-    machine_map = {str(m["_id"]): m["machine_name"] for m in machines}
-
-    for op in operations_using_material:
-        op["machine_name"] = machine_map.get(str(op.get("machine_id")), "N/A")
-        # Extract the quantity for the specific material
-        for mat_used in op.get("materials_used", []):
-            if mat_used.get("material_id") == ObjectId(material_id):
-                op["quantity_used"] = mat_used.get("quantity")
-                break
+    # --- One page of operations using this material, with usage totals ---
+    usage_page = max(request.args.get("usage_page", 1, type=int), 1)
+    usage_history = fetch_material_usage(db, material["_id"], usage_page)
 
     # --- Find Procurement History for This Material ---
+    # Served by the (procurement_items.material_id, bill_date) multikey index.
+    # Older bills stored the material id as a string.
+    material_ids = [material["_id"], str(material["_id"])]
     procurement_history = list(
         db.procurement_records.find(
-            {"procurement_items.material_id": material_id}
+            {"procurement_items.material_id": {"$in": material_ids}}
         ).sort("bill_date", -1)
     )
     # Filter items to only show data for the current material
     for record in procurement_history:
         for item in record["procurement_items"]:
-            if item["material_id"] == material_id:
+            if item["material_id"] in material_ids:
                 record["item_details"] = item
                 break
 
@@ -325,12 +804,118 @@ def raw_material_detail(material_id):
     return render_template(
         "pages/inventory/raw-material-details.html",
         material=material,
-        operations_list=operations_using_material,
+        operations_list=usage_history["operations"],
+        usage_totals=usage_history["totals"],
+        usage_pagination=usage_history["pagination"],
         procurement_history=procurement_history,
         active_reminder=active_reminder,
     )
 
 
+MAX_LEDGER_ENTRIES_PER_PAGE = 200
+
+
+@blueprint.route("/api/raw-material/<material_id>/ledger", methods=["GET"])
+@login_required
+def raw_material_ledger(material_id):
+    """
+    Stock movements of one material, newest first, read as a range on the
+    (material_id, occurred_at) index. Supports `start` / `end` dates
+    (YYYY-MM-DD), `limit`, and `before` (the `next_before` cursor of the
+    previous page) for older entries.
+    """
+    db = get_db()
+    try:
+        if not ObjectId.is_valid(material_id):
+            return jsonify({"error": "Invalid material ID"}), 400
+
+        occurred_at = {}
+        start = request.args.get("start")
+        end = request.args.get("end")
+        before = request.args.get("before")
+        try:
+            if start:
+                occurred_at["$gte"] = datetime.datetime.strptime(start, "%Y-%m-%d")
+            if end:
+                occurred_at["$lt"] = datetime.datetime.strptime(
+                    end, "%Y-%m-%d"
+                ) + datetime.timedelta(days=1)
+            if before:
+                # Cursor is "<occurred_at>|<_id>": movements of one write
+                # share a timestamp, so the _id breaks ties
+                before_at, before_id = before.split("|")
+                before_at = datetime.datetime.fromisoformat(before_at)
+                before_id = ObjectId(before_id)
+        except (ValueError, InvalidId):
+            return jsonify({"error": "Invalid date or cursor"}), 400
+
+        query = {"material_id": ObjectId(material_id)}
+        if occurred_at:
+            query["occurred_at"] = occurred_at
+        if before:
+            query["$or"] = [
+                {"occurred_at": {"$lt": before_at}},
+                {"occurred_at": before_at, "_id": {"$lt": before_id}},
+            ]
+
+        limit = min(
+            max(request.args.get("limit", 50, type=int), 1),
+            MAX_LEDGER_ENTRIES_PER_PAGE,
+        )
+        entries = list(
+            db[INVENTORY_LEDGER_COLLECTION]
+            .find(query, {"material_id": 0})
+            .sort([("occurred_at", -1), ("_id", -1)])
+            .limit(limit)
+        )
+
+        return Response(
+            json_util.dumps(
+                {
+                    "entries": entries,
+                    "next_before": (
+                        f"{entries[-1]['occurred_at'].isoformat()}|{entries[-1]['_id']}"
+                        if len(entries) == limit
+                        else None
+                    ),
+                }
+            ),
+            200,
+            {"Content-Type": "application/json"},
+        )
+    except Exception as e:
+        print(f"Error fetching inventory ledger: {e}")
+        return jsonify({"error": str(e)}), 500
+
+
+@blueprint.route("/api/raw-material/<material_id>/stock-at", methods=["GET"])
+@login_required
+def raw_material_stock_at(material_id):
+    """
+    Stock of one material at `at` (ISO date or datetime), from the nearest
+    earlier snapshot plus the ledger movements after it.
+    """
+    db = get_db()
+    try:
+        if not ObjectId.is_valid(material_id):
+            return jsonify({"error": "Invalid material ID"}), 400
+        try:
+            at = datetime.datetime.fromisoformat(request.args.get("at", ""))
+        except ValueError:
+            return jsonify({"error": "Invalid or missing 'at' date"}), 400
+
+        return jsonify(
+            {
+                "material_id": material_id,
+                "at": at.isoformat(),
+                "quantity": quantity_at(db, ObjectId(material_id), at),
+            }
+        )
+    except Exception as e:
+        print(f"Error computing stock at date: {e}")
+        return jsonify({"error": str(e)}), 500
+
+
 @blueprint.route("/raw-material/<material_id>/set-reminder", methods=["POST"])
 @login_required
 def set_raw_material_reminder(material_id):
@@ -369,6 +954,8 @@ def set_raw_material_reminder(material_id):
             "deadline": deadline,
             "notes": notes,
             "status": "pending",
+            # Set by hand: never completed by generate-reorder-reminders
+            "source": "manual",
             "created_at": datetime.datetime.now(),
             "created_by": session.get("_user_id"),  # Use .get for safety
         }
@@ -441,7 +1028,6 @@ def restock_raw_material():
     """
     db = get_db()
     raw_materials_collection = db.raw_materials
-    suppliers_collection = db.raw_material_suppliers
     procurement_collection = (
         db.procurement_records
     )  # Collection for bills/restock events
@@ -463,12 +1049,22 @@ def restock_raw_material():
             return redirect(url_for("inventory.restock_raw_material"))
 
         try:
-            items = json.loads(items_json)
+            items = normalize_procurement_items(json.loads(items_json))
             bill_date = datetime.datetime.strptime(bill_date_str, "%Y-%m-%d")
         except (json.JSONDecodeError, ValueError):
             flash("Invalid item data or date format.", "error")
             return redirect(url_for("inventory.restock_raw_material"))
 
+        # A supplier's bill can only be logged once
+        if procurement_collection.find_one(
+            {"supplier_name": supplier_name, "bill_number": bill_number}, {"_id": 1}
+        ):
+            flash(
+                f"Bill '{bill_number}' from {supplier_name} has already been logged.",
+                "error",
+            )
+            return redirect(url_for("inventory.restock_raw_material"))
+
         # --- Handle Bill Upload ---
         bill_file_id = None
         if "bill_upload" in request.files:
@@ -487,71 +1083,385 @@ def restock_raw_material():
             "bill_number": bill_number,
             "bill_date": bill_date,
             "bill_file_id": bill_file_id,
-            "procurement_items": items,  # RENAMED: Contains material_id, quantity, unit_price
+            "procurement_items": items,  # material_id (ObjectId), quantity, unit_price
             "notes": notes,
             "created_at": now,
         }
-        procurement_collection.insert_one(procurement_doc)
+        record_id = procurement_collection.insert_one(procurement_doc).inserted_id
 
         # --- Update Stock Levels for each item ---
         for item in items:
             raw_materials_collection.update_one(
-                {"_id": ObjectId(item["material_id"])},
+                {"_id": item["material_id"]},
                 {
                     "$inc": {"current_quantity": float(item["quantity"])},
                     "$set": {"last_stocked_on": now},
                 },
             )
+        record_stock_movements(
+            db,
+            [
+                stock_movement(
+                    item["material_id"],
+                    item["quantity"],
+                    "restock",
+                    "procurement_record",
+                    record_id,
+                )
+                for item in items
+            ],
+            user_id=session.get("user_id"),
+        )
+        # New stock may let suspended operations resume
+        schedule_reevaluation({item["material_id"] for item in items})
 
         flash(f"Successfully logged stock from bill '{bill_number}'.", "success")
         return redirect(url_for("inventory.restock_raw_material"))
 
     # --- Prepare data for GET request ---
-    all_materials = list(
-        raw_materials_collection.find(
-            {}, {"material_name": 1, "sku": 1, "uom": 1, "current_quantity": 1}
-        )
+    # Materials are looked up through /api/materials/search as the user types
+    all_suppliers = get_vocabulary(db, "material_suppliers")
+
+    # Newest bills for the history table; older ones are loaded on demand
+    try:
+        history_page = fetch_procurement_history(db, request.args)
+    except (ValueError, InvalidId):
+        # Malformed `before` cursor: start from the newest bills
+        args = request.args.copy()
+        args.pop("before", None)
+        history_page = fetch_procurement_history(db, args)
+
+    return render_template(
+        "pages/inventory/restock-raw-material.html",
+        all_suppliers=all_suppliers,
+        history_page_json=json_util.dumps(history_page),
     )
-    for mat in all_materials:
-        mat["_id"] = str(mat["_id"])  # Convert ObjectId to string for JS
 
-    all_suppliers = sorted(
-        [doc["name"] for doc in suppliers_collection.find({}, {"name": 1})]
+
+PROCUREMENT_HISTORY_PAGE_SIZE = 10
+
+
+def build_procurement_filter(args):
+    """
+    Builds the MongoDB filter for procurement records from request args
+    (q: bill number / supplier, supplier). "All" or empty means no filter.
+    """
+    query = {}
+    search_query = args.get("q", "").strip()
+    if search_query:
+        pattern = {"$regex": re.escape(search_query), "$options": "i"}
+        query["$or"] = [{"bill_number": pattern}, {"supplier_name": pattern}]
+    supplier = args.get("supplier", "")
+    if supplier and supplier != "All":
+        query["supplier_name"] = supplier
+    return query
+
+
+def fetch_procurement_history(db, args):
+    """
+    Returns one page of procurement records, newest bill first, with item
+    material names and bill totals resolved in a single aggregation.
+
+    Paging is keyset based: `before` is the `next_before` cursor of the
+    previous page ("<bill_date>|<_id>"), so loading older bills never skips
+    over the ones already shown. Also supports `q` (bill number / supplier)
+    and `supplier`.
+    """
+    limit = min(
+        max(args.get("limit", PROCUREMENT_HISTORY_PAGE_SIZE, type=int), 1), 100
     )
 
-    # NEW: Fetch procurement history for the wizard's first tab
-    procurement_history = list(procurement_collection.find({}).sort("bill_date", -1))
-    for record in procurement_history:
-        record["_id"] = str(record["_id"])
-        if record.get("bill_file_id"):
-            record["bill_file_id"] = str(record["bill_file_id"])
-        # Calculate total amount for each bill
-        total_amount = sum(
-            item.get("quantity", 0) * item.get("unit_price", 0)
-            for item in record["procurement_items"]
-        )
-        record["total_amount"] = total_amount
-        # NEW: Fetch material names for display in the history table
-        material_ids = [
-            ObjectId(item["material_id"]) for item in record["procurement_items"]
-        ]
-        materials_in_bill = raw_materials_collection.find(
-            {"_id": {"$in": material_ids}}, {"material_name": 1, "sku": 1}
+    query = build_procurement_filter(args)
+    before = args.get("before")
+    if before:
+        before_date, before_id = before.split("|")
+        before_date = datetime.datetime.fromisoformat(before_date)
+        before_id = ObjectId(before_id)
+        cursor_query = {
+            "$or": [
+                {"bill_date": {"$lt": before_date}},
+                {"bill_date": before_date, "_id": {"$lt": before_id}},
+            ]
+        }
+        query = {"$and": [query, cursor_query]} if query else cursor_query
+
+    pipeline = [
+        {"$match": query},
+        {"$sort": {"bill_date": -1, "_id": -1}},
+        # One extra row tells whether there are older bills
+        {"$limit": limit + 1},
+        {
+            "$lookup": {
+                "from": "raw_materials",
+                # Equality match on _id, so each bill is a few index lookups
+                "localField": "procurement_items.material_id",
+                "foreignField": "_id",
+                "pipeline": [{"$project": {"material_name": 1, "sku": 1}}],
+                "as": "materials",
+            }
+        },
+        {
+            "$project": {
+                "supplier_name": 1,
+                "bill_number": 1,
+                "bill_date": 1,
+                "bill_file_id": 1,
+                "total_amount": {
+                    "$sum": {
+                        "$map": {
+                            "input": "$procurement_items",
+                            "as": "item",
+                            "in": {
+                                "$multiply": [
+                                    {"$ifNull": ["$$item.quantity", 0]},
+                                    {"$ifNull": ["$$item.unit_price", 0]},
+                                ]
+                            },
+                        }
+                    }
+                },
+                "procurement_items": {
+                    "$map": {
+                        "input": "$procurement_items",
+                        "as": "item",
+                        "in": {
+                            "$let": {
+                                "vars": {
+                                    "material": {
+                                        "$arrayElemAt": [
+                                            {
+                                                "$filter": {
+                                                    "input": "$materials",
+                                                    "cond": {
+                                                        "$eq": [
+                                                            "$$this._id",
+                                                            {
+                                                                "$toObjectId": "$$item.material_id"
+                                                            },
+                                                        ]
+                                                    },
+                                                }
+                                            },
+                                            0,
+                                        ]
+                                    }
+                                },
+                                "in": {
+                                    "material_id": "$$item.material_id",
+                                    "quantity": "$$item.quantity",
+                                    "unit_price": "$$item.unit_price",
+                                    "material_name": {
+                                        "$ifNull": ["$$material.material_name", "N/A"]
+                                    },
+                                    "sku": {"$ifNull": ["$$material.sku", "N/A"]},
+                                },
+                            }
+                        },
+                    }
+                },
+            }
+        },
+    ]
+
+    records = list(db.procurement_records.aggregate(pipeline))
+    has_more = len(records) > limit
+    records = records[:limit]
+
+    return {
+        "records": records,
+        "next_before": (
+            f"{records[-1]['bill_date'].isoformat()}|{records[-1]['_id']}"
+            if has_more
+            else None
+        ),
+    }
+
+
+@blueprint.route("/api/procurement-history", methods=["GET"])
+@login_required
+def procurement_history_data():
+    """
+    JSON data source for the procurement history table. Returns the next
+    page of older bills for the `before` cursor; see
+    `fetch_procurement_history` for the supported arguments.
+    """
+    db = get_db()
+    try:
+        try:
+            history_page = fetch_procurement_history(db, request.args)
+        except (ValueError, InvalidId):
+            return jsonify({"error": "Invalid cursor"}), 400
+        return Response(
+            json_util.dumps(history_page), 200, {"Content-Type": "application/json"}
         )
-        material_map = {str(m["_id"]): m for m in materials_in_bill}
-        for item in record["procurement_items"]:
-            material_info = material_map.get(item["material_id"])
-            if material_info:
-                item["material_name"] = material_info.get("material_name", "N/A")
-                item["sku"] = material_info.get("sku", "N/A")
+    except Exception as e:
+        print(f"Error fetching procurement history: {e}")
+        return jsonify({"error": str(e)}), 500
 
-    return render_template(
-        "pages/inventory/restock-raw-material.html",
-        all_materials_json=json.dumps(all_materials),
-        all_suppliers=all_suppliers,
-        procurement_history=procurement_history,
+
+PROCUREMENT_EXPORT_HEADERS = [
+    "Bill Date",
+    "Bill Number",
+    "Supplier",
+    "Material",
+    "SKU",
+    "Quantity",
+    "UoM",
+    "Unit Price",
+    "Line Total",
+]
+
+
+@blueprint.route("/procurement/export", methods=["GET"])
+@login_required
+def export_procurement():
+    """
+    Streams procurement records matching the history filters (q, supplier)
+    as CSV or XLSX (`format`), newest bill first, one row per line item.
+    Material names are resolved once per cursor batch.
+    """
+    db = get_db()
+    file_format = request.args.get("format", "csv")
+    if file_format not in EXPORT_FORMATS:
+        return jsonify({"error": "format must be csv or xlsx"}), 400
+
+    cursor = export_cursor(
+        db.procurement_records,
+        build_procurement_filter(request.args),
+        {"bill_date": 1, "bill_number": 1, "supplier_name": 1, "procurement_items": 1},
+        [("bill_date", -1), ("_id", -1)],
     )
 
+    def item_rows(records):
+        materials = resolve_materials(
+            db,
+            [i["material_id"] for r in records for i in r.get("procurement_items", [])],
+            {"material_name": 1, "sku": 1, "uom": 1},
+        )
+        for record in records:
+            for item in record.get("procurement_items", []):
+                material = materials.get(str(item["material_id"]), {})
+                quantity = item.get("quantity") or 0
+                unit_price = item.get("unit_price") or 0
+                yield [
+                    record.get("bill_date"),
+                    record.get("bill_number"),
+                    record.get("supplier_name"),
+                    material.get("material_name", "N/A"),
+                    material.get("sku", "N/A"),
+                    quantity,
+                    material.get("uom", ""),
+                    unit_price,
+                    round(quantity * unit_price, 2),
+                ]
+
+    def rows():
+        batch = []
+        for record in cursor:
+            batch.append(record)
+            if len(batch) >= EXPORT_BATCH_SIZE:
+                yield from item_rows(batch)
+                batch = []
+        if batch:
+            yield from item_rows(batch)
+
+    return export_response(file_format, "procurement", PROCUREMENT_EXPORT_HEADERS, rows())
+
+
+@blueprint.route("/procurement/import", methods=["POST"])
+@login_required
+def import_procurement_bills():
+    """
+    Imports procurement bills from an uploaded CSV or JSONL file (`bills_file`),
+    streaming it in batches. Bills that already exist for the same supplier
+    and bill number are skipped, so a failed upload can be sent again.
+    """
+    db = get_db()
+    bills_file = request.files.get("bills_file")
+    if not bills_file or not bills_file.filename:
+        return jsonify({"error": "No file uploaded"}), 400
+
+    file_format = request.form.get("format") or bills_file.filename.rsplit(".", 1)[-1]
+    file_format = file_format.lower()
+    if file_format not in ("csv", "jsonl"):
+        return jsonify({"error": "Upload a .csv or .jsonl file"}), 400
+
+    try:
+        stream = io.TextIOWrapper(bills_file.stream, encoding="utf-8-sig", newline="")
+        report = import_bills(db, stream, file_format, user_id=session.get("user_id"))
+        schedule_reevaluation(report.pop("restocked_material_ids"))
+        return jsonify(report)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        print(f"Error importing procurement bills: {e}")
+        return jsonify({"error": str(e)}), 500
+
+
+def normalize_procurement_items(items):
+    """
+    Normalizes the line items posted by the restock / edit forms: material
+    ids become ObjectIds (so they match the multikey index), quantities and
+    prices floats. Raises ValueError for malformed items.
+    """
+    if not isinstance(items, list):
+        raise ValueError("Procurement items must be a list")
+    normalized = []
+    for item in items:
+        if not isinstance(item, dict):
+            raise ValueError(f"Invalid procurement item: {item}")
+        material_id = item.get("material_id")
+        if not material_id or not ObjectId.is_valid(material_id):
+            raise ValueError(f"Invalid material id: {material_id}")
+        try:
+            quantity = float(item.get("quantity") or 0)
+            unit_price = float(item.get("unit_price") or 0)
+        except TypeError:
+            raise ValueError(f"Invalid quantity or unit price for {material_id}")
+        normalized.append(
+            {
+                "material_id": ObjectId(material_id),
+                "quantity": quantity,
+                "unit_price": unit_price,
+            }
+        )
+    return normalized
+
+
+def procurement_stock_deltas(original_items, updated_items):
+    """
+    Net stock change per material when a bill's items change from
+    `original_items` to `updated_items`. Returns {ObjectId: delta} without
+    the materials whose quantity is unchanged.
+    """
+    deltas = defaultdict(float)
+    for item in original_items:
+        deltas[ObjectId(item["material_id"])] -= float(item["quantity"])
+    for item in updated_items:
+        deltas[ObjectId(item["material_id"])] += float(item["quantity"])
+    return {material_id: delta for material_id, delta in deltas.items() if delta}
+
+
+def resolve_materials(db, material_ids, projection=None):
+    """
+    Fetches the raw materials referenced by a list of ids (ObjectIds or their
+    string form, duplicates allowed) with a single `$in` query.
+    Returns {str(material_id): material}; unknown or invalid ids are missing.
+    """
+    object_ids = {
+        ObjectId(material_id)
+        for material_id in material_ids
+        if material_id and ObjectId.is_valid(material_id)
+    }
+    if not object_ids:
+        return {}
+    return {
+        str(material["_id"]): material
+        for material in db.raw_materials.find(
+            {"_id": {"$in": list(object_ids)}}, projection
+        )
+    }
+
 
 @blueprint.route("/procurement-record/<record_id>")
 @login_required
@@ -561,7 +1471,6 @@ def procurement_record_detail(record_id):
     """
     db = get_db()
     procurement_collection = db.procurement_records
-    raw_materials_collection = db.raw_materials
 
     try:
         record = procurement_collection.find_one({"_id": ObjectId(record_id)})
@@ -573,17 +1482,17 @@ def procurement_record_detail(record_id):
         return redirect(url_for("inventory.restock_raw_material"))
 
     # --- Enrich record data for display ---
+    items = record.get("procurement_items", [])
+    material_map = resolve_materials(
+        db, [item["material_id"] for item in items], {"material_name": 1, "sku": 1}
+    )
     subtotal = 0
-    for item in record.get("procurement_items", []):
+    for item in items:
         item_total = item.get("quantity", 0) * item.get("unit_price", 0)
         item["total_price"] = item_total
         subtotal += item_total
 
-        # Fetch material details
-        material_info = raw_materials_collection.find_one(
-            {"_id": ObjectId(item["material_id"])},
-            {"material_name": 1, "sku": 1, "description": 1},
-        )
+        material_info = material_map.get(str(item["material_id"]))
         if material_info:
             item["material_name"] = material_info.get("material_name", "N/A")
             item["sku"] = material_info.get("sku", "N/A")
@@ -608,7 +1517,6 @@ def edit_procurement_record(record_id):
     db = get_db()
     procurement_collection = db.procurement_records
     raw_materials_collection = db.raw_materials
-    suppliers_collection = db.raw_material_suppliers
 
     try:
         record = procurement_collection.find_one({"_id": ObjectId(record_id)})
@@ -620,9 +1528,6 @@ def edit_procurement_record(record_id):
         return redirect(url_for("inventory.restock_raw_material"))
 
     if request.method == "POST":
-        # --- Get Original Items to Revert Stock ---
-        original_items = record.get("procurement_items", [])
-
         # --- Process Form Data ---
         supplier_name = request.form.get("supplier_name")
         bill_number = request.form.get("bill_number")
@@ -640,7 +1545,7 @@ def edit_procurement_record(record_id):
             )
 
         try:
-            updated_items = json.loads(items_json)
+            updated_items = normalize_procurement_items(json.loads(items_json))
             bill_date = datetime.datetime.strptime(bill_date_str, "%Y-%m-%d")
         except (json.JSONDecodeError, ValueError):
             flash("Invalid item data or date format.", "error")
@@ -648,26 +1553,6 @@ def edit_procurement_record(record_id):
                 url_for("inventory.edit_procurement_record", record_id=record_id)
             )
 
-        # --- Revert Old Stock Quantities ---
-        for item in original_items:
-            raw_materials_collection.update_one(
-                {"_id": ObjectId(item["material_id"])},
-                {"$inc": {"current_quantity": -float(item["quantity"])}},
-            )
-
-        # --- Apply New Stock Quantities ---
-        for item in updated_items:
-            raw_materials_collection.update_one(
-                {"_id": ObjectId(item["material_id"])},
-                {
-                    "$inc": {"current_quantity": float(item["quantity"])},
-                    "$set": {
-                        "last_stocked_on": datetime.datetime.now()
-                    },  # Update stock date
-                },
-            )
-
-        # --- Update Procurement Record ---
         # Note: Bill file is not handled here for simplicity. A more complex UI would be needed.
         update_data = {
             "supplier_name": supplier_name,
@@ -677,9 +1562,65 @@ def edit_procurement_record(record_id):
             "procurement_items": updated_items,
             "updated_at": datetime.datetime.now(),
         }
-        procurement_collection.update_one(
-            {"_id": ObjectId(record_id)}, {"$set": update_data}
-        )
+
+        restocked_ids = []
+
+        def apply_edit(tx_session):
+            # Re-read inside the transaction so the deltas are computed from
+            # the committed items, also when the transaction is retried
+            current = procurement_collection.find_one(
+                {"_id": record["_id"]}, {"procurement_items": 1}, session=tx_session
+            )
+            deltas = procurement_stock_deltas(
+                current.get("procurement_items", []), updated_items
+            )
+            restocked_ids[:] = [m for m, delta in deltas.items() if delta > 0]
+
+            # --- Net stock change per material, unchanged materials skipped ---
+            now = datetime.datetime.now()
+            stock_updates = []
+            for material_id, delta in deltas.items():
+                update = {"$inc": {"current_quantity": delta}}
+                if delta > 0:
+                    update["$set"] = {"last_stocked_on": now}
+                stock_updates.append(UpdateOne({"_id": material_id}, update))
+            if stock_updates:
+                raw_materials_collection.bulk_write(
+                    stock_updates, ordered=False, session=tx_session
+                )
+
+            procurement_collection.update_one(
+                {"_id": record["_id"]}, {"$set": update_data}, session=tx_session
+            )
+
+            record_stock_movements(
+                db,
+                [
+                    stock_movement(
+                        material_id,
+                        delta,
+                        "procurement_edit",
+                        "procurement_record",
+                        record["_id"],
+                    )
+                    for material_id, delta in deltas.items()
+                ],
+                user_id=session.get("user_id"),
+                session=tx_session,
+            )
+
+        # --- Stock, record and ledger change together or not at all ---
+        try:
+            with db.client.start_session() as tx_session:
+                tx_session.with_transaction(apply_edit)
+        except Exception as e:
+            print(f"Error updating procurement record: {e}")
+            flash("Could not update the procurement record. Please try again.", "error")
+            return redirect(
+                url_for("inventory.edit_procurement_record", record_id=record_id)
+            )
+        # Added stock may let suspended operations resume
+        schedule_reevaluation(restocked_ids)
 
         flash(
             f"Successfully updated procurement record for bill '{bill_number}'.",
@@ -690,36 +1631,32 @@ def edit_procurement_record(record_id):
         )
 
     # --- Prepare data for GET request ---
-    # For the item selection dropdown
-    all_materials = list(
-        raw_materials_collection.find(
-            {}, {"material_name": 1, "sku": 1, "uom": 1, "current_quantity": 1}
-        )
-    )
-    for mat in all_materials:
-        mat["_id"] = str(mat["_id"])
-
     # For the supplier dropdown
-    all_suppliers = sorted(
-        [doc["name"] for doc in suppliers_collection.find({}, {"name": 1})]
-    )
+    all_suppliers = get_vocabulary(db, "material_suppliers")
 
     # Enrich items with material name for display in the form
-    for item in record.get("procurement_items", []):
-        material_info = raw_materials_collection.find_one(
-            {"_id": ObjectId(item["material_id"])}, {"material_name": 1, "sku": 1}
-        )
+    items = record.get("procurement_items", [])
+    # Only the bill's own materials; others are searched as the user types
+    material_map = resolve_materials(
+        db,
+        [item["material_id"] for item in items],
+        {"material_name": 1, "sku": 1, "uom": 1},
+    )
+    for item in items:
+        material_info = material_map.get(str(item["material_id"]))
         if material_info:
             item["material_name"] = material_info.get("material_name", "N/A")
             item["sku"] = material_info.get("sku", "N/A")
+            item["uom"] = material_info.get("uom", "")
 
     # Convert record data for template consumption
     record["_id"] = str(record["_id"])
+    for item in items:
+        item["material_id"] = str(item["material_id"])
     record["bill_date_str"] = record["bill_date"].strftime("%Y-%m-%d")
 
     return render_template(
         "pages/inventory/edit-procurement-record.html",
         record=record,
-        all_materials_json=json.dumps(all_materials),
         all_suppliers=all_suppliers,
     )
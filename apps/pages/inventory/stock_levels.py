@@ -0,0 +1,25 @@
+# `below_reorder_level` is stored on raw materials so the reorder job reads
+# due materials through a partial index. It is set when a material is
+# created and refreshed after every change to its stock.
+
+# Aggregation form of `below_reorder_level`; materials without a positive
+# reorder level are never below it
+BELOW_REORDER_LEVEL = {
+    "$and": [
+        {"$gt": ["$reorder_level", 0]},
+        {"$lte": ["$current_quantity", "$reorder_level"]},
+    ]
+}
+
+
+def refresh_reorder_flags(db, material_ids=None, session=None):
+    """
+    Recomputes `below_reorder_level` of the given materials (every material
+    if None) with one pipeline update_many.
+    """
+    query = {} if material_ids is None else {"_id": {"$in": list(material_ids)}}
+    db.raw_materials.update_many(
+        query,
+        [{"$set": {"below_reorder_level": BELOW_REORDER_LEVEL}}],
+        session=session,
+    )
@@ -0,0 +1,99 @@
+import datetime
+import re
+from collections import Counter
+
+from pymongo import UpdateOne
+
+# Kind -> (counter collection, raw material field it counts)
+TAXONOMIES = {
+    "categories": ("raw_material_categories", "categories"),
+    "suppliers": ("raw_material_suppliers", "suppliers"),
+}
+AUTOCOMPLETE_LIMIT = 20
+
+
+def ensure_taxonomy_indexes(db):
+    for collection_name, _ in TAXONOMIES.values():
+        collection = db[collection_name]
+        # Counters are upserted and $merge'd by name
+        collection.create_index("name", unique=True)
+        collection.create_index("name_lower")
+        collection.create_index([("count", -1)])
+
+
+def increment_counts(db, kind, names):
+    """
+    Adds one use per occurrence of each name in `names` to the counters of
+    `kind`, creating missing ones, with a single bulk_write.
+    """
+    counts = Counter(name for name in names if name)
+    if not counts:
+        return
+    collection_name, _ = TAXONOMIES[kind]
+    db[collection_name].bulk_write(
+        [
+            UpdateOne(
+                {"name": name},
+                {"$inc": {"count": count}, "$setOnInsert": {"name_lower": name.lower()}},
+                upsert=True,
+            )
+            for name, count in counts.items()
+        ],
+        ordered=False,
+    )
+
+
+def autocomplete(db, kind, prefix, limit=AUTOCOMPLETE_LIMIT):
+    """
+    Names of `kind` starting with `prefix` (case-insensitive), read as a range
+    on the `name_lower` index. Without a prefix, the most used names.
+    """
+    collection_name, _ = TAXONOMIES[kind]
+    prefix = (prefix or "").strip().lower()
+    if prefix:
+        cursor = db[collection_name].find(
+            {"name_lower": {"$regex": "^" + re.escape(prefix)}}, {"name": 1}
+        ).sort("name_lower", 1)
+    else:
+        cursor = db[collection_name].find({}, {"name": 1}).sort("count", -1)
+    return [doc["name"] for doc in cursor.limit(limit)]
+
+
+def recount(db, kind):
+    """
+    Rebuilds the counters of `kind` from the raw materials with one
+    aggregation that $merges the counts into the counter collection. Names no
+    material uses anymore are set to zero. Returns the number of names in use.
+    """
+    collection_name, field = TAXONOMIES[kind]
+    recounted_at = datetime.datetime.now()
+    db.raw_materials.aggregate(
+        [
+            {"$match": {field: {"$exists": True, "$ne": []}}},
+            {"$unwind": f"${field}"},
+            {"$match": {field: {"$nin": [None, ""]}}},
+            {"$group": {"_id": f"${field}", "count": {"$sum": 1}}},
+            {
+                "$project": {
+                    "_id": 0,
+                    "name": "$_id",
+                    "name_lower": {"$toLower": "$_id"},
+                    "count": 1,
+                    "recounted_at": recounted_at,
+                }
+            },
+            {
+                "$merge": {
+                    "into": collection_name,
+                    "on": "name",
+                    "whenMatched": "merge",
+                    "whenNotMatched": "insert",
+                }
+            },
+        ]
+    )
+    db[collection_name].update_many(
+        {"recounted_at": {"$ne": recounted_at}},
+        {"$set": {"count": 0, "recounted_at": recounted_at}},
+    )
+    return db[collection_name].count_documents({"count": {"$gt": 0}})
@@ -0,0 +1,170 @@
+import datetime
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import current_app, g
+
+from apps.pages.database import get_db
+from apps.pages.inventory.reservations import reserve_if_available
+
+MATERIAL_WAITS_COLLECTION = "material_waits"
+
+# Jobs on the priority schedule get stock before general ones
+SCHEDULE_RANKS = {"priority_schedule": 0, "general_schedule": 1}
+
+# One worker: re-evaluations run one after another, never concurrently
+_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="material-waits")
+
+
+def ensure_material_wait_indexes(db):
+    waits = db[MATERIAL_WAITS_COLLECTION]
+    waits.create_index([("operation_id", 1), ("material_id", 1)], unique=True)
+    waits.create_index(
+        [
+            ("material_id", 1),
+            ("schedule_rank", 1),
+            ("schedule_position", 1),
+            ("operation_position", 1),
+        ]
+    )
+    waits.create_index("job_id")
+
+
+def add_material_waits(db, job, operation_id, operation_position, materials_required):
+    """
+    Records that a suspended operation is waiting on its required materials,
+    one entry per material, carrying the job's schedule so waiting operations
+    can be served in priority order.
+    """
+    now = datetime.datetime.now()
+    totals = {}
+    for item in materials_required:
+        totals[item["material_id"]] = totals.get(item["material_id"], 0) + item["quantity"]
+    if not totals:
+        return
+    db[MATERIAL_WAITS_COLLECTION].insert_many(
+        [
+            {
+                "operation_id": operation_id,
+                "job_id": job["_id"],
+                "material_id": material_id,
+                "quantity": quantity,
+                "schedule_rank": SCHEDULE_RANKS.get(job.get("schedule_type"), 2),
+                "schedule_position": job.get("schedule_position") or 0,
+                "operation_position": operation_position,
+                "created_at": now,
+            }
+            for material_id, quantity in totals.items()
+        ],
+        ordered=False,
+    )
+
+
+def remove_material_waits(db, operation_id):
+    db[MATERIAL_WAITS_COLLECTION].delete_many({"operation_id": operation_id})
+
+
+def reevaluate_waiting_operations(db, material_ids=None):
+    """
+    Re-checks the suspended operations waiting on `material_ids` (all waiting
+    operations when None). Operations are served in schedule order (priority
+    jobs, schedule position, operation position); each one whose materials
+    are all in stock is given its reservations. Then the operations go back
+    to pending and the jobs with nothing left waiting leave `at_risk`.
+
+    Stock is taken with guarded updates (`reserve_if_available`), not a
+    transaction, so this also runs on a standalone server and stock is never
+    handed out twice. Returns the ids of the resumed operations.
+    """
+    waits_collection = db[MATERIAL_WAITS_COLLECTION]
+
+    query = {} if material_ids is None else {"material_id": {"$in": material_ids}}
+    operation_ids = waits_collection.distinct("operation_id", query)
+    if not operation_ids:
+        return []
+
+    # Every material those operations wait on, not just the restocked ones
+    waits = list(waits_collection.find({"operation_id": {"$in": operation_ids}}))
+    operations = {}
+    for wait in waits:
+        operations.setdefault(wait["operation_id"], []).append(wait)
+
+    available = {
+        m["_id"]: m.get("current_quantity") or 0
+        for m in db.raw_materials.find(
+            {"_id": {"$in": list({w["material_id"] for w in waits})}},
+            {"current_quantity": 1},
+        )
+    }
+
+    def schedule_key(item):
+        first = item[1][0]
+        return (
+            first["schedule_rank"],
+            first["schedule_position"],
+            first["operation_position"],
+            first["created_at"],
+        )
+
+    resumed = []
+    for operation_id, operation_waits in sorted(operations.items(), key=schedule_key):
+        # Skip operations the stock read above cannot cover without a write
+        if not all(
+            available.get(w["material_id"], 0) >= w["quantity"] for w in operation_waits
+        ):
+            continue
+        job_id = operation_waits[0]["job_id"]
+        if not reserve_if_available(db, job_id, operation_id, operation_waits):
+            continue
+        for w in operation_waits:
+            available[w["material_id"]] -= w["quantity"]
+        waits_collection.delete_many({"operation_id": operation_id})
+        resumed.append((job_id, operation_id))
+
+    if not resumed:
+        return []
+
+    resumed_ids = [operation_id for _, operation_id in resumed]
+    now = datetime.datetime.now()
+    db.operations.update_many(
+        {"_id": {"$in": resumed_ids}, "status": "suspended"},
+        {"$set": {"status": "pending", "updated_at": now}},
+    )
+
+    # Jobs stay at risk while any of their operations still waits
+    job_ids = list({job_id for job_id, _ in resumed})
+    still_waiting = set(
+        waits_collection.distinct("job_id", {"job_id": {"$in": job_ids}})
+    )
+    recovered_jobs = [job_id for job_id in job_ids if job_id not in still_waiting]
+    if recovered_jobs:
+        db.jobs.update_many(
+            {"_id": {"$in": recovered_jobs}, "status": "at_risk"},
+            {"$set": {"status": "pending", "updated_at": now}},
+        )
+    return resumed_ids
+
+
+def _run_reevaluation(app, material_ids):
+    with app.app_context():
+        try:
+            resumed = reevaluate_waiting_operations(get_db(), material_ids)
+            if resumed:
+                print(f"Resumed {len(resumed)} suspended operations after restock")
+        except Exception as e:
+            print(f"Error re-evaluating suspended operations: {e}")
+        finally:
+            if "db_client" in g:
+                g.db_client.close()
+
+
+def schedule_reevaluation(material_ids):
+    """
+    Queues a re-evaluation of the operations waiting on `material_ids` on the
+    background worker, so restocking returns without waiting for it. If the
+    process stops first, the reevaluate-suspended-operations command catches up.
+    """
+    material_ids = list(material_ids)
+    if material_ids:
+        _executor.submit(
+            _run_reevaluation, current_app._get_current_object(), material_ids
+        )
@@ -9,7 +9,16 @@ from flask import Blueprint, Response, current_app, flash, g, jsonify
 from functools import wraps
 from flask import session, redirect, url_for, render_template, request
 from apps.pages.authentication.routes import login_required
+from apps.pages.bulk_import import import_upload
+from apps.pages.choices import SCHEDULE_TYPES
 from apps.pages.database import get_db
+from apps.pages.exports import EXPORT_FORMATS, export_cursor, export_response
+from apps.pages.inventory.reservations import release_reservations, reserve_materials
+from apps.pages.inventory.waitlist import (
+    add_material_waits,
+    remove_material_waits,
+    schedule_reevaluation,
+)
 from bson.objectid import ObjectId
 from werkzeug.utils import secure_filename
 from gridfs import GridFS
@@ -18,17 +27,16 @@ from io import BytesIO
 blueprint = Blueprint("jobs", __name__, url_prefix="/jobs")
 
 
-# View jobs
-@blueprint.route("/view_jobs", methods=["GET"])
-def view_jobs():
-    db = get_db()
-    users_collection = db["users"]
-
+def build_jobs_filter(args):
+    """
+    Builds the MongoDB filter for the jobs list from request args
+    (q, status, team, deadline). Shared by view_jobs and the jobs export.
+    """
     # --- Get filter values from request ---
-    search_query = request.args.get("q", "").strip()
-    status_filter = request.args.get("status", "")
-    team_filter = request.args.get("team", "")
-    deadline_filter = request.args.get("deadline", "")
+    search_query = args.get("q", "").strip()
+    status_filter = args.get("status", "")
+    team_filter = args.get("team", "")
+    deadline_filter = args.get("deadline", "")
 
     # --- Build the match pipeline for filtering ---
     match_pipeline = {}
@@ -65,6 +73,17 @@ def view_jobs():
                 "$lt": end_of_month,
             }
 
+    return match_pipeline
+
+
+# View jobs
+@blueprint.route("/view_jobs", methods=["GET"])
+def view_jobs():
+    db = get_db()
+    users_collection = db["users"]
+
+    match_pipeline = build_jobs_filter(request.args)
+
     # --- Pagination Logic ---
     page = request.args.get("page", 1, type=int)
     per_page = 8  # Number of jobs per page
@@ -170,14 +189,69 @@ def view_jobs():
         all_teams=all_teams,
         all_statuses=all_statuses,
         filters={
-            "q": search_query,
-            "status": status_filter,
-            "team": team_filter,
-            "deadline": deadline_filter,
+            "q": request.args.get("q", "").strip(),
+            "status": request.args.get("status", ""),
+            "team": request.args.get("team", ""),
+            "deadline": request.args.get("deadline", ""),
         },
     )
 
 
+JOB_EXPORT_COLUMNS = [
+    ("Job Name", "job_name"),
+    ("Status", "status"),
+    ("Schedule", "schedule_type"),
+    ("Position", "schedule_position"),
+    ("Divisions", "divisions"),
+    ("Coordinators", "coordinators"),
+    ("Tags", "tags"),
+    ("Start Time", "start_time"),
+    ("Completion Time", "completion_time"),
+    ("Created At", "created_at"),
+]
+
+
+@blueprint.route("/export", methods=["GET"])
+@login_required
+def export_jobs():
+    """
+    Streams the jobs matching the view_jobs filters (q, status, team,
+    deadline) as CSV or XLSX (`format`), newest first, from a batched
+    projected cursor.
+    """
+    db = get_db()
+    file_format = request.args.get("format", "csv")
+    if file_format not in EXPORT_FORMATS:
+        return jsonify({"error": "format must be csv or xlsx"}), 400
+
+    # Both lookups are small reference lists, read once per export
+    division_names = {
+        d["_id"]: d.get("name") for d in db.divisions.find({}, {"name": 1})
+    }
+    user_names = {str(u["_id"]): u.get("name") for u in db.users.find({}, {"name": 1})}
+
+    cursor = export_cursor(
+        db.jobs,
+        build_jobs_filter(request.args),
+        {field: 1 for _, field in JOB_EXPORT_COLUMNS},
+        [("created_at", -1)],
+    )
+
+    def rows():
+        for job in cursor:
+            job["divisions"] = [
+                division_names.get(d, str(d)) for d in job.get("divisions") or []
+            ]
+            job["coordinators"] = [
+                user_names.get(str(u), str(u)) for u in job.get("coordinators") or []
+            ]
+            yield [job.get(field) for _, field in JOB_EXPORT_COLUMNS]
+
+    return export_response(
+        file_format, "jobs", [header for header, _ in JOB_EXPORT_COLUMNS], rows()
+    )
+
+
 # View jobs list
 @blueprint.route("/view_jobs_list", methods=["GET"])
 def view_jobs_list():
@@ -329,7 +403,7 @@ def manage_jobs():
         divisions = list(map(lambda x: ObjectId(x), divisions))
 
         # Incrementing positions of existing jobs if necessary
-        if schedule_type in ["general_schedule", "priority_schedule"]:
+        if schedule_type in SCHEDULE_TYPES:
             jobs_to_update = jobs_collection.find(
                 {
                     "schedule_type": schedule_type,
@@ -381,6 +455,30 @@ def manage_jobs():
     )
 
 
+@blueprint.route("/import", methods=["POST"])
+@login_required
+def import_jobs():
+    """
+    Imports jobs from an uploaded CSV or JSONL file (`records_file`),
+    streaming it in batches. Returns the number inserted and per-row errors.
+    """
+    db = get_db()
+    try:
+        report = import_upload(
+            db,
+            "jobs",
+            request.files.get("records_file"),
+            request.form.get("format"),
+            user_id=session.get("user_id"),
+        )
+        return jsonify(report)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        print(f"Error importing jobs: {e}")
+        return jsonify({"error": str(e)}), 500
+
+
 # Job Details
 @blueprint.route("/job_details/<job_id>", methods=["GET", "POST"])
 def job_details(job_id):
@@ -464,7 +562,6 @@ def delete_operation(operation_id):
     """Safely deletes an operation and reverts inventory changes."""
     db = get_db()
     operations_collection = db.operations
-    raw_materials_collection = db.raw_materials
 
     try:
         op_id = ObjectId(operation_id)
@@ -480,20 +577,11 @@ def delete_operation(operation_id):
 
     job_id = str(operation["job_id"])
 
-    # Revert inventory changes
-    if operation.get("materials_required"):
-        for item in operation["materials_required"]:
-            material_id = item["material_id"]
-            quantity_to_return = item["quantity"]
-
-            # Add the quantity back to current_quantity and remove the in_use_quantity entry
-            raw_materials_collection.update_one(
-                {"_id": material_id},
-                {
-                    "$inc": {"current_quantity": quantity_to_return},
-                    "$pull": {"in_use_quantity": {"operation_id": op_id}},
-                },
-            )
+    # Revert inventory changes: return the reserved stock, or stop waiting for it
+    released = release_reservations(db, op_id, user_id=session.get("user_id"))
+    remove_material_waits(db, op_id)
+    # Returned stock may let suspended operations resume
+    schedule_reevaluation({r["material_id"] for r in released})
 
     # Delete the operation
     operations_collection.delete_one({"_id": op_id})
@@ -625,20 +713,18 @@ def create_operation(job_id):
         result = operations_collection.insert_one(new_operation)
         new_operation_id = result.inserted_id
 
-        # --- Update raw material quantities and track usage ---
-        for item in materials_required:
-            raw_materials_collection.update_one(
-                {"_id": item["material_id"]},
-                {
-                    "$inc": {"current_quantity": -item["quantity"]},
-                    "$push": {
-                        "in_use_quantity": {
-                            "job_id": ObjectId(job_id),
-                            "operation_id": new_operation_id,
-                            "required_quantity": item["quantity"],
-                        }
-                    },
-                },
+        # --- Reserve the required materials, or wait for a restock ---
+        if has_sufficient_stock:
+            reserve_materials(
+                db,
+                ObjectId(job_id),
+                new_operation_id,
+                materials_required,
+                user_id=session.get("user_id"),
+            )
+        else:
+            add_material_waits(
+                db, job, new_operation_id, next_position, materials_required
             )
 
         flash(
@@ -676,26 +762,14 @@ def create_operation(job_id):
             "machine_name", 1
         )
     )
-    all_raw_materials = list(
-        raw_materials_collection.find(
-            {},
-            {"_id": 1, "material_name": 1, "uom": 1, "sku": 1, "current_quantity": 1},
-        ).sort("material_name", 1)
-    )
-
-    # Convert ObjectIds to strings for JSON serialization in the template
-    for material in all_raw_materials:
-        material["_id"] = str(material["_id"])
+    # Raw materials are looked up through /inventory/api/materials/search
+    # as the user types, so the catalogue is not embedded in the page
 
     return render_template(
         "pages/jobs/create-operation.html",
         job=job,
         all_users=all_users,
         all_machines=all_machines,
-        all_raw_materials_json=json.dumps(
-            all_raw_materials
-        ),  # Pass as JSON string for JS
-        all_raw_materials=all_raw_materials,  # Pass as list for initial select options
         busy_machine_ids=busy_machine_ids,
         busy_operator_ids=busy_operator_ids,
     )
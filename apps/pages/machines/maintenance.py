@@ -0,0 +1,126 @@
+import calendar
+import datetime
+import math
+
+
+def add_months(date, months):
+    """
+    Adds calendar months to a date, clamping the day to the end of the target
+    month (31 Jan + 1 month = 28/29 Feb).
+    """
+    month_index = date.month - 1 + months
+    year = date.year + month_index // 12
+    month = month_index % 12 + 1
+    day = min(date.day, calendar.monthrange(year, month)[1])
+    return date.replace(year=year, month=month, day=day)
+
+
+def schedule_date(start, gap, unit, occurrence):
+    """
+    Returns the date of the n-th occurrence (0 = `start`) of a time-based
+    schedule. Each occurrence is computed from `start`, so month-end
+    clamping never drifts (31 Jan, 28 Feb, 31 Mar, ...).
+    """
+    if unit == "days":
+        return start + datetime.timedelta(days=gap * occurrence)
+    if unit == "weeks":
+        return start + datetime.timedelta(weeks=gap * occurrence)
+    if unit == "months":
+        return add_months(start, gap * occurrence)
+    raise ValueError(f"Unknown time gap unit: {unit}")
+
+
+def first_occurrence_from(start, gap, unit, date):
+    """
+    Returns the index of the first occurrence of a time-based schedule on or
+    after `date`, without stepping through the ones before it.
+    """
+    if unit not in ("days", "weeks", "months"):
+        raise ValueError(f"Unknown time gap unit: {unit}")
+    if start >= date:
+        return 0
+    if unit == "months":
+        occurrence = ((date.year - start.year) * 12 + date.month - start.month) // gap
+        while schedule_date(start, gap, unit, occurrence) < date:
+            occurrence += 1
+        return occurrence
+    if unit == "days":
+        step = datetime.timedelta(days=gap)
+    else:
+        step = datetime.timedelta(weeks=gap)
+    return math.ceil((date - start) / step)
+
+
+def next_meter_threshold(current_reading, gap):
+    """Returns the next multiple of `gap` above the current meter reading."""
+    return (math.floor(current_reading / gap) + 1) * gap
+
+
+def compute_maintenance_due(schedule):
+    """
+    Computes the materialized `maintenance_due` sub-document of a machine
+    from its maintenance schedule, or None if the schedule is incomplete.
+
+    Time-based schedules store the due `date`; usage-based schedules store
+    the meter `threshold`, the `remaining` usage until it and `remaining_ratio`
+    (remaining / gap) so fleet-wide due queries are plain index range scans.
+    """
+    schedule = schedule or {}
+    trigger = schedule.get("trigger")
+
+    if trigger == "time_based":
+        next_date = schedule.get("next_maintenance_date")
+        if not next_date:
+            return None
+        return {"trigger": trigger, "date": next_date}
+
+    if trigger == "usage_based":
+        gap = schedule.get("usage_gap")
+        current_reading = schedule.get("current_meter_reading")
+        if not gap or current_reading is None:
+            return None
+        threshold = next_meter_threshold(current_reading, gap)
+        remaining = threshold - current_reading
+        return {
+            "trigger": trigger,
+            "threshold": threshold,
+            "remaining": remaining,
+            "remaining_ratio": remaining / gap,
+        }
+
+    return None
+
+
+def upcoming_maintenance(schedule, count=5):
+    """
+    Returns display strings for the next `count` maintenance occurrences of a
+    schedule, for the machine details page.
+    """
+    schedule = schedule or {}
+    trigger = schedule.get("trigger")
+    upcoming = []
+
+    if trigger == "time_based":
+        next_date = schedule.get("next_maintenance_date")
+        gap = schedule.get("time_gap")
+        unit = schedule.get("time_gap_unit")
+
+        if next_date and gap and unit:
+            for occurrence in range(count):
+                upcoming.append(
+                    schedule_date(next_date, gap, unit, occurrence).strftime(
+                        "%d %b, %Y"
+                    )
+                )
+
+    elif trigger == "usage_based":
+        current_reading = schedule.get("current_meter_reading", 0)
+        gap = schedule.get("usage_gap")
+        unit = schedule.get("meter_unit")
+
+        if current_reading is not None and gap and unit:
+            next_due = next_meter_threshold(current_reading, gap)
+            for i in range(count):
+                upcoming.append(f"At {int(next_due + (i * gap))} {unit}")
+
+    return upcoming
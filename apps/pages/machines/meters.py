@@ -0,0 +1,205 @@
+import datetime
+import math
+from collections import defaultdict
+
+from bson.objectid import ObjectId
+from pymongo import UpdateOne
+from pymongo.errors import CollectionInvalid
+
+from apps.pages.machines.maintenance import compute_maintenance_due
+
+METER_READINGS_COLLECTION = "meter_readings"
+METER_ROLLUPS_COLLECTION = "meter_reading_rollups"
+
+# Rollup granularity -> function truncating a timestamp to its bucket start
+ROLLUP_BUCKETS = {
+    "hour": lambda ts: ts.replace(minute=0, second=0, microsecond=0),
+    "day": lambda ts: ts.replace(hour=0, minute=0, second=0, microsecond=0),
+}
+
+# Set once this process has made sure the collections exist
+_meter_collections_ready = False
+
+
+def ensure_meter_collections(db):
+    """
+    Creates the `meter_readings` time-series collection and the rollup
+    indexes. Safe to call repeatedly.
+    """
+    try:
+        db.create_collection(
+            METER_READINGS_COLLECTION,
+            timeseries={
+                "timeField": "timestamp",
+                "metaField": "machine_id",
+                "granularity": "minutes",
+            },
+        )
+    except CollectionInvalid:
+        pass  # Already exists
+
+    db[METER_ROLLUPS_COLLECTION].create_index(
+        [("machine_id", 1), ("granularity", 1), ("bucket_start", 1)], unique=True
+    )
+    global _meter_collections_ready
+    _meter_collections_ready = True
+
+
+def parse_timestamp(value):
+    """Parses an ISO 8601 timestamp into a naive UTC datetime."""
+    timestamp = datetime.datetime.fromisoformat(str(value).replace("Z", "+00:00"))
+    if timestamp.tzinfo is not None:
+        timestamp = timestamp.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+    return timestamp
+
+
+def validate_meter_readings(readings):
+    """
+    Validates raw (machine_id, timestamp, reading) items from a request.
+    Returns (valid_readings, errors); errors reference the item's index.
+    """
+    valid = []
+    errors = []
+    for index, item in enumerate(readings):
+        try:
+            machine_id = item.get("machine_id")
+            if not machine_id or not ObjectId.is_valid(machine_id):
+                raise ValueError("Invalid machine_id")
+            reading = float(item.get("reading"))
+            if not math.isfinite(reading):
+                raise ValueError("Reading must be a finite number")
+            if reading < 0:
+                raise ValueError("Reading cannot be negative")
+            valid.append(
+                {
+                    "index": index,
+                    "machine_id": ObjectId(machine_id),
+                    "timestamp": parse_timestamp(item.get("timestamp")),
+                    "reading": reading,
+                }
+            )
+        except (AttributeError, TypeError, ValueError) as e:
+            errors.append({"index": index, "error": str(e)})
+    return valid, errors
+
+
+def ingest_meter_readings(db, readings):
+    """
+    Stores a batch of validated meter readings:
+
+    1. one `insert_many` into the time-series collection,
+    2. one `bulk_write` moving each machine's `current_meter_reading` (and its
+       materialized `maintenance_due`) to its newest reading, never backwards,
+    3. one `bulk_write` folding the batch into hourly and daily rollups.
+
+    Readings for unknown or non usage-based machines are rejected.
+    Returns (inserted_count, machines_updated, errors).
+    """
+    machines_collection = db["machines"]
+    errors = []
+
+    machine_ids = list({r["machine_id"] for r in readings})
+    machines = {
+        m["_id"]: m
+        for m in machines_collection.find(
+            {"_id": {"$in": machine_ids}},
+            {"maintenance_schedule": 1},
+        )
+    }
+
+    accepted = []
+    for r in readings:
+        machine = machines.get(r["machine_id"])
+        schedule = (machine or {}).get("maintenance_schedule") or {}
+        if not machine:
+            errors.append({"index": r["index"], "error": "Machine not found"})
+        elif schedule.get("trigger") != "usage_based":
+            errors.append(
+                {"index": r["index"], "error": "Machine is not usage-based"}
+            )
+        else:
+            accepted.append(r)
+
+    if not accepted:
+        return 0, 0, errors
+
+    # --- 1. Raw readings ---
+    # Inserting into a missing collection would create a regular one, not a
+    # time-series collection, if create-indexes has not been run yet
+    if not _meter_collections_ready:
+        ensure_meter_collections(db)
+    db[METER_READINGS_COLLECTION].insert_many(
+        [
+            {
+                "machine_id": r["machine_id"],
+                "timestamp": r["timestamp"],
+                "reading": r["reading"],
+            }
+            for r in accepted
+        ],
+        ordered=False,
+    )
+
+    # --- 2. Latest reading per machine ---
+    latest = {}
+    for r in accepted:
+        current = latest.get(r["machine_id"])
+        if current is None or r["timestamp"] > current["timestamp"]:
+            latest[r["machine_id"]] = r
+
+    now = datetime.datetime.now()
+    machine_updates = []
+    for machine_id, r in latest.items():
+        schedule = dict(machines[machine_id]["maintenance_schedule"])
+        schedule["current_meter_reading"] = r["reading"]
+        machine_updates.append(
+            UpdateOne(
+                {
+                    "_id": machine_id,
+                    # An older reading arriving late must not roll the meter back
+                    "$or": [
+                        {"maintenance_schedule.meter_reading_at": {"$exists": False}},
+                        {"maintenance_schedule.meter_reading_at": {"$lt": r["timestamp"]}},
+                    ],
+                },
+                {
+                    "$set": {
+                        "maintenance_schedule.current_meter_reading": r["reading"],
+                        "maintenance_schedule.meter_reading_at": r["timestamp"],
+                        "maintenance_due": compute_maintenance_due(schedule),
+                        "updated_at": now,
+                    }
+                },
+            )
+        )
+    machines_updated = machines_collection.bulk_write(
+        machine_updates, ordered=False
+    ).modified_count
+
+    # --- 3. Hourly / daily rollups, pre-aggregated per bucket ---
+    buckets = defaultdict(list)
+    for r in accepted:
+        for granularity, truncate in ROLLUP_BUCKETS.items():
+            buckets[(r["machine_id"], granularity, truncate(r["timestamp"]))].append(
+                r["reading"]
+            )
+
+    rollup_updates = [
+        UpdateOne(
+            {
+                "machine_id": machine_id,
+                "granularity": granularity,
+                "bucket_start": bucket_start,
+            },
+            {
+                "$min": {"min_reading": min(values)},
+                "$max": {"max_reading": max(values)},
+                "$inc": {"count": len(values), "sum_reading": sum(values)},
+            },
+            upsert=True,
+        )
+        for (machine_id, granularity, bucket_start), values in buckets.items()
+    ]
+    db[METER_ROLLUPS_COLLECTION].bulk_write(rollup_updates, ordered=False)
+
+    return len(accepted), machines_updated, errors
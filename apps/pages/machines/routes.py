@@ -3,13 +3,41 @@ import click
 import datetime
 import json
 import math
+import re
 from flask_login import current_user
-from pymongo import MongoClient
+from pymongo import MongoClient, ReturnDocument, UpdateOne
 from flask import Blueprint, Response, current_app, flash, g, jsonify
+from flask import stream_with_context
 from functools import wraps
 from flask import session, redirect, url_for, render_template, request
 from apps.pages.authentication.routes import login_required
+from apps.pages.bulk_import import import_upload
+from apps.pages.choices import (
+    MACHINE_CRITICALITY_CHOICES,
+    MACHINE_STATUS_CHOICES,
+    MACHINE_STATUSES,
+    METER_UNIT_CHOICES,
+)
 from apps.pages.database import get_db
+from apps.pages.exports import EXPORT_FORMATS, export_cursor, export_response
+from apps.pages.vocabulary import get_vocabulary, invalidate_vocabulary
+from apps.pages.machines.maintenance import (
+    compute_maintenance_due,
+    first_occurrence_from,
+    schedule_date,
+    upcoming_maintenance,
+)
+from apps.pages.machines.meters import (
+    METER_ROLLUPS_COLLECTION,
+    ingest_meter_readings,
+    parse_timestamp,
+    validate_meter_readings,
+)
+from apps.pages.machines.status_log import (
+    STATUS_EVENTS_COLLECTION,
+    log_status_changes,
+    utilization_report,
+)
 from bson.objectid import ObjectId
 from werkzeug.utils import secure_filename
 from gridfs import GridFS
@@ -20,52 +48,154 @@ from bson import json_util
 
 blueprint = Blueprint("machines", __name__, url_prefix="/machines")
 
-
-@blueprint.route("/manage-machines", methods=["GET"])
-@login_required
-def manage_machines():
+# Upper bound on machines changed by one bulk status request
+MAX_BULK_STATUS_UPDATES = 1000
+
+# Columns the machines table may be sorted on (query value -> document field)
+MACHINE_SORT_FIELDS = {
+    "machine_name": "machine_name",
+    "asset_id": "asset_id",
+    "status": "current_status",
+    "criticality": "criticality",
+    "manufacturer": "manufacturer",
+    "created_at": "created_at",
+}
+
+# Fields sent to the machines table; everything else stays in the database
+MACHINE_TABLE_PROJECTION = {
+    "machine_name": 1,
+    "asset_id": 1,
+    "current_status": 1,
+    "criticality": 1,
+    "manufacturer": 1,
+    "tags": 1,
+    "created_at": 1,
+}
+
+
+def build_machines_filter(args):
     """
-    Renders the page to display and manage all machines in a sortable,
-    filterable table.
+    Builds the MongoDB filter for the machines table from request args
+    (q, status, criticality, manufacturer, tag). "All" or empty means no filter.
     """
-    db = get_db()
-    machines_collection = db["machines"]
-
-    # --- Fetch all machines for the table ---
-    machines_list = list(machines_collection.find({}).sort("created_at", -1))
-
-    # --- Get data for filters ---
-
-    # 1. Get all unique tags from the entire collection
-    all_tags = machines_collection.distinct("tags")
-    all_tags = sorted(
-        [tag for tag in all_tags if tag]
-    )  # Filter out None/empty and sort
-
-    # 2. Define the static status list for the filter
-    status_list = [
-        {"value": "operating", "name": "Operating"},
-        {"value": "idle", "name": "Idle"},
-        {"value": "under_maintenance", "name": "Under Maintenance"},
-        {"value": "out_of_service", "name": "Out of Service"},
+    query = {}
+
+    search_query = args.get("q", "").strip()
+    if search_query:
+        pattern = {"$regex": re.escape(search_query), "$options": "i"}
+        query["$or"] = [
+            {"machine_name": pattern},
+            {"asset_id": pattern},
+            {"manufacturer": pattern},
+            {"model_number": pattern},
+            {"tags": pattern},
+        ]
+
+    for arg_name, field in (
+        ("status", "current_status"),
+        ("criticality", "criticality"),
+        ("manufacturer", "manufacturer"),
+        ("tag", "tags"),
+    ):
+        value = args.get(arg_name, "")
+        if value and value != "All":
+            query[field] = value
+
+    return query
+
+
+def fetch_machines_page(db, args):
+    """
+    Returns one page of machines plus the status/criticality stats and the
+    tag/manufacturer facets for the filtered set, in a single aggregation.
+    """
+    page = max(args.get("page", 1, type=int), 1)
+    per_page = min(max(args.get("per_page", 10, type=int), 1), 100)
+
+    sort_field = MACHINE_SORT_FIELDS.get(args.get("sort"), "created_at")
+    sort_order = 1 if args.get("order") == "asc" else -1
+
+    pipeline = [
+        {"$match": build_machines_filter(args)},
+        # Sorting before $facet lets the sort use an index
+        {"$sort": {sort_field: sort_order, "_id": sort_order}},
+        {
+            "$facet": {
+                "rows": [
+                    {"$skip": (page - 1) * per_page},
+                    {"$limit": per_page},
+                    {"$project": MACHINE_TABLE_PROJECTION},
+                ],
+                "stats": [
+                    {
+                        "$group": {
+                            "_id": None,
+                            "total": {"$sum": 1},
+                            "operating": {
+                                "$sum": {
+                                    "$cond": [
+                                        {"$eq": ["$current_status", "operating"]},
+                                        1,
+                                        0,
+                                    ]
+                                }
+                            },
+                            "idle": {
+                                "$sum": {
+                                    "$cond": [{"$eq": ["$current_status", "idle"]}, 1, 0]
+                                }
+                            },
+                            "maintenance": {
+                                "$sum": {
+                                    "$cond": [
+                                        {
+                                            "$eq": [
+                                                "$current_status",
+                                                "under_maintenance",
+                                            ]
+                                        },
+                                        1,
+                                        0,
+                                    ]
+                                }
+                            },
+                            "out_of_service": {
+                                "$sum": {
+                                    "$cond": [
+                                        {"$eq": ["$current_status", "out_of_service"]},
+                                        1,
+                                        0,
+                                    ]
+                                }
+                            },
+                            "high_criticality": {
+                                "$sum": {
+                                    "$cond": [{"$eq": ["$criticality", "high"]}, 1, 0]
+                                }
+                            },
+                        }
+                    },
+                    {"$project": {"_id": 0}},
+                ],
+                "tags": [
+                    {"$unwind": "$tags"},
+                    {"$match": {"tags": {"$nin": [None, ""]}}},
+                    {"$group": {"_id": "$tags", "count": {"$sum": 1}}},
+                    {"$sort": {"_id": 1}},
+                ],
+                "manufacturers": [
+                    {"$match": {"manufacturer": {"$nin": [None, ""]}}},
+                    {"$group": {"_id": "$manufacturer", "count": {"$sum": 1}}},
+                    {"$sort": {"_id": 1}},
+                ],
+            }
+        },
     ]
 
-    # 3. Get all unique manufacturers
-    all_manufacturers = machines_collection.distinct("manufacturer")
-    all_manufacturers = sorted(
-        [m for m in all_manufacturers if m]
-    )  # Filter out None/empty and sort
-
-    # 4. Define the static criticality list
-    criticality_list = [
-        {"value": "high", "name": "High"},
-        {"value": "medium", "name": "Medium"},
-        {"value": "low", "name": "Low"},
-    ]
+    result = next(db["machines"].aggregate(pipeline), {})
 
-    # --- Compute statistics for dashboard cards ---
-    stats = {
-        "total": len(machines_list),
+    stats = (result.get("stats") or [None])[0] or {
+        "total": 0,
         "operating": 0,
         "idle": 0,
         "maintenance": 0,
@@ -73,30 +203,124 @@ def manage_machines():
         "high_criticality": 0,
     }
 
-    for machine in machines_list:
-        # Count statuses
-        status = machine.get("current_status")
-        if status == "operating":
-            stats["operating"] += 1
-        elif status == "idle":
-            stats["idle"] += 1
-        elif status == "under_maintenance":
-            stats["maintenance"] += 1
-        elif status == "out_of_service":
-            stats["out_of_service"] += 1
-
-        # Count high criticality
-        if machine.get("criticality") == "high":
-            stats["high_criticality"] += 1
+    return {
+        "machines": result.get("rows", []),
+        "stats": stats,
+        "facets": {
+            "tags": [
+                {"value": f["_id"], "count": f["count"]}
+                for f in result.get("tags", [])
+            ],
+            "manufacturers": [
+                {"value": f["_id"], "count": f["count"]}
+                for f in result.get("manufacturers", [])
+            ],
+        },
+        "pagination": {
+            "page": page,
+            "per_page": per_page,
+            "total": stats["total"],
+            "total_pages": math.ceil(stats["total"] / per_page),
+        },
+    }
+
+
+@blueprint.route("/manage-machines", methods=["GET"])
+@login_required
+def manage_machines():
+    """
+    Renders the page to display and manage all machines. The table itself is
+    loaded page by page from `machines_data`.
+    """
+    db = get_db()
+
+    # --- First page and stats cards in one query ---
+    initial_page = fetch_machines_page(db, request.args)
+
+    # 1. Status choices for the filter
+    status_list = MACHINE_STATUS_CHOICES
+
+    # 2. Criticality choices
+    criticality_list = MACHINE_CRITICALITY_CHOICES
 
     return render_template(
         "pages/machines/manage.html",
-        machines_list=machines_list,
-        all_tags=all_tags,
+        all_tags=get_vocabulary(db, "machine_tags"),
         status_list=status_list,
-        all_manufacturers=all_manufacturers,
+        all_manufacturers=get_vocabulary(db, "machine_manufacturers"),
         criticality_list=criticality_list,
-        stats=stats,
+        stats=initial_page["stats"],
+        initial_page_json=json_util.dumps(initial_page),
+    )
+
+
+@blueprint.route("/api/machines", methods=["GET"])
+@login_required
+def machines_data():
+    """
+    JSON data source for the machines table: one projected page of machines
+    with stats and facets. Supports q, status, criticality, manufacturer, tag,
+    sort, order, page and per_page.
+    """
+    db = get_db()
+    try:
+        return Response(
+            json_util.dumps(fetch_machines_page(db, request.args)),
+            200,
+            {"Content-Type": "application/json"},
+        )
+    except Exception as e:
+        print(f"Error fetching machines page: {e}")
+        return jsonify({"error": str(e)}), 500
+
+
+MACHINE_EXPORT_COLUMNS = [
+    ("Machine Name", "machine_name"),
+    ("Asset ID", "asset_id"),
+    ("Status", "current_status"),
+    ("Criticality", "criticality"),
+    ("Manufacturer", "manufacturer"),
+    ("Model Number", "model_number"),
+    ("Tags", "tags"),
+    ("Installation Date", "installation_date"),
+    ("Warranty Expiry", "warranty_expiry_date"),
+    ("Next Maintenance", "maintenance_due.date"),
+    ("Operations", "number_of_operations"),
+    ("Created At", "created_at"),
+]
+
+
+@blueprint.route("/export", methods=["GET"])
+@login_required
+def export_machines():
+    """
+    Streams every machine matching the machines table filters and sort as
+    CSV or XLSX (`format`), from a batched projected cursor.
+    """
+    db = get_db()
+    file_format = request.args.get("format", "csv")
+    if file_format not in EXPORT_FORMATS:
+        return jsonify({"error": "format must be csv or xlsx"}), 400
+
+    sort_field = MACHINE_SORT_FIELDS.get(request.args.get("sort"), "created_at")
+    sort_order = 1 if request.args.get("order") == "asc" else -1
+    cursor = export_cursor(
+        db["machines"],
+        build_machines_filter(request.args),
+        {field: 1 for _, field in MACHINE_EXPORT_COLUMNS},
+        [(sort_field, sort_order), ("_id", sort_order)],
+    )
+
+    def rows():
+        for machine in cursor:
+            due = machine.get("maintenance_due") or {}
+            yield [
+                due.get("date") if field == "maintenance_due.date" else machine.get(field)
+                for _, field in MACHINE_EXPORT_COLUMNS
+            ]
+
+    return export_response(
+        file_format, "machines", [header for header, _ in MACHINE_EXPORT_COLUMNS], rows()
     )
 
 
@@ -227,16 +451,33 @@ def create_machines():
                 "installation_date": installation_date,
                 "warranty_expiry_date": warranty_expiry_date,
                 "maintenance_schedule": maintenance_schedule,
+                "maintenance_due": compute_maintenance_due(maintenance_schedule),
                 "operation_id": None,
                 "number_of_operations": 0,
                 "notes": notes,
                 "file_metadata_ids": uploaded_file_metadata_ids,  # Link to metadata
+                "status_since": datetime.datetime.now(),
                 "created_at": datetime.datetime.now(),
                 "updated_at": datetime.datetime.now(),
             }
 
             machine_result = machines_collection.insert_one(machine_data)
             new_machine_id = machine_result.inserted_id
+            invalidate_vocabulary("machine_tags", "machine_manufacturers")
+
+            log_status_changes(
+                db,
+                [
+                    {
+                        "machine_id": new_machine_id,
+                        "from_status": None,
+                        "to_status": current_status,
+                        "status_since": None,
+                        "changed_at": machine_data["status_since"],
+                        "changed_by": ObjectId(session["user_id"]),
+                    }
+                ],
+            )
 
             # === 7. (Optional but good practice) UPDATE METADATA ===
             # Add the new machine_id to all the metadata documents we just created
@@ -257,11 +498,7 @@ def create_machines():
     # Pass necessary data to the form (like dropdown lists)
 
     # This list is needed for the "Meter Unit" dropdown
-    meter_units_list = [
-        {"value": "hours", "name": "Hours"},
-        {"value": "cycles", "name": "Cycles"},
-        {"value": "units", "name": "Units Produced"},
-    ]
+    meter_units_list = METER_UNIT_CHOICES
 
     machines_list = list(
         machines_collection.find(
@@ -276,6 +513,30 @@ def create_machines():
     )
 
 
+@blueprint.route("/import", methods=["POST"])
+@login_required
+def import_machines():
+    """
+    Imports machines from an uploaded CSV or JSONL file (`records_file`),
+    streaming it in batches. Returns the number inserted and per-row errors.
+    """
+    db = get_db()
+    try:
+        report = import_upload(
+            db,
+            "machines",
+            request.files.get("records_file"),
+            request.form.get("format"),
+            user_id=session.get("user_id"),
+        )
+        return jsonify(report)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        print(f"Error importing machines: {e}")
+        return jsonify({"error": str(e)}), 500
+
+
 @blueprint.route("/edit/<string:machine_id>", methods=["GET", "POST"])
 @login_required
 def edit_machine(machine_id):
@@ -410,14 +671,35 @@ def edit_machine(machine_id):
                 "installation_date": installation_date,
                 "warranty_expiry_date": warranty_expiry_date,
                 "maintenance_schedule": maintenance_schedule,
+                "maintenance_due": compute_maintenance_due(maintenance_schedule),
                 "notes": notes,
                 "file_metadata_ids": all_file_metadata_ids,
                 "updated_at": datetime.datetime.now(),
             }
 
+            status_changed = current_status != machine.get("current_status")
+            if status_changed:
+                update_data["status_since"] = update_data["updated_at"]
+
             machines_collection.update_one(
                 {"_id": ObjectId(machine_id)}, {"$set": update_data}
             )
+            invalidate_vocabulary("machine_tags", "machine_manufacturers")
+
+            if status_changed:
+                log_status_changes(
+                    db,
+                    [
+                        {
+                            "machine_id": ObjectId(machine_id),
+                            "from_status": machine.get("current_status"),
+                            "to_status": current_status,
+                            "status_since": machine.get("status_since"),
+                            "changed_at": update_data["updated_at"],
+                            "changed_by": ObjectId(session["user_id"]),
+                        }
+                    ],
+                )
 
             flash(f"Machine '{machine_name}' updated successfully!", "success")
             return redirect(url_for("machines.machine_details", machine_id=machine_id))
@@ -436,27 +718,14 @@ def edit_machine(machine_id):
             ).sort("upload_timestamp", -1)
         )
 
-    meter_units_list = [
-        {"value": "hours", "name": "Hours"},
-        {"value": "cycles", "name": "Cycles"},
-        {"value": "units", "name": "Units Produced"},
-    ]
-    status_list = [
-        {"value": "operating", "name": "Operating"},
-        {"value": "idle", "name": "Idle"},
-        {"value": "under_maintenance", "name": "Under Maintenance"},
-        {"value": "out_of_service", "name": "Out of Service"},
-    ]
-    criticality_list = [
-        {"value": "high", "name": "High"},
-        {"value": "medium", "name": "Medium"},
-        {"value": "low", "name": "Low"},
-    ]
+    meter_units_list = METER_UNIT_CHOICES
+    status_list = MACHINE_STATUS_CHOICES
+    criticality_list = MACHINE_CRITICALITY_CHOICES
     # Ensure all_tags and all_manufacturers include current machine's values
-    all_tags = machines_collection.distinct("tags")
+    all_tags = get_vocabulary(db, "machine_tags")
     all_tags = sorted(list(set(all_tags + machine.get("tags", []))))
 
-    all_manufacturers = machines_collection.distinct("manufacturer")
+    all_manufacturers = get_vocabulary(db, "machine_manufacturers")
     all_manufacturers = sorted(
         list(set(all_manufacturers + [machine.get("manufacturer")]))
     )
@@ -474,6 +743,116 @@ def edit_machine(machine_id):
     )
 
 
+# Operations shown per page in a machine's operation history
+OPERATIONS_PER_PAGE = 10
+
+
+def fetch_machine_operations(db, machine_id, page=1, per_page=OPERATIONS_PER_PAGE):
+    """
+    Returns one page of a machine's operations (newest first, with job names)
+    and the machine's operation totals, in a single aggregation on the
+    (assigned_machine, created_at) index.
+    """
+    pipeline = [
+        {"$match": {"assigned_machine": machine_id}},
+        {"$sort": {"created_at": -1}},
+        {
+            "$facet": {
+                "rows": [
+                    {"$skip": (page - 1) * per_page},
+                    {"$limit": per_page},
+                    {
+                        "$lookup": {
+                            "from": "jobs",
+                            "localField": "job_id",
+                            "foreignField": "_id",
+                            "pipeline": [{"$project": {"job_name": 1}}],
+                            "as": "job",
+                        }
+                    },
+                    {
+                        "$project": {
+                            "operation_name": 1,
+                            "job_id": 1,
+                            "job_name": {"$first": "$job.job_name"},
+                            "status": 1,
+                            "estimated_time": 1,
+                            "created_at": 1,
+                            "updated_at": 1,
+                        }
+                    },
+                ],
+                "totals": [
+                    {
+                        "$group": {
+                            "_id": None,
+                            "operation_count": {"$sum": 1},
+                            "estimated_hours": {"$sum": "$estimated_time"},
+                        }
+                    }
+                ],
+                "by_status": [
+                    {
+                        "$group": {
+                            "_id": "$status",
+                            "operation_count": {"$sum": 1},
+                            "estimated_hours": {"$sum": "$estimated_time"},
+                        }
+                    },
+                    {"$sort": {"_id": 1}},
+                ],
+            }
+        },
+    ]
+
+    result = next(db["operations"].aggregate(pipeline), {})
+    totals = (result.get("totals") or [None])[0] or {
+        "operation_count": 0,
+        "estimated_hours": 0,
+    }
+    totals.pop("_id", None)
+    totals["hours_by_status"] = {
+        row["_id"] or "unknown": {
+            "operation_count": row["operation_count"],
+            "estimated_hours": row["estimated_hours"],
+        }
+        for row in result.get("by_status", [])
+    }
+
+    return {
+        "operations": result.get("rows", []),
+        "totals": totals,
+        "pagination": {
+            "page": page,
+            "per_page": per_page,
+            "total": totals["operation_count"],
+            "total_pages": math.ceil(totals["operation_count"] / per_page),
+        },
+    }
+
+
+@blueprint.route("/api/<string:machine_id>/operations", methods=["GET"])
+@login_required
+def machine_operations(machine_id):
+    """JSON: one page of a machine's operation history with its totals."""
+    db = get_db()
+    try:
+        page = max(request.args.get("page", 1, type=int), 1)
+        per_page = min(
+            max(request.args.get("per_page", OPERATIONS_PER_PAGE, type=int), 1), 100
+        )
+        return Response(
+            json_util.dumps(
+                fetch_machine_operations(db, ObjectId(machine_id), page, per_page)
+            ),
+            200,
+            {"Content-Type": "application/json"},
+        )
+    except Exception as e:
+        print(f"Error fetching machine operations: {e}")
+        return jsonify({"error": str(e)}), 500
+
+
 @blueprint.route("/details/<string:machine_id>", methods=["GET"])
 @login_required
 def machine_details(machine_id):
@@ -497,59 +876,209 @@ def machine_details(machine_id):
         )
     )
 
-    # --- Fetch operation history (empty for now) ---
-    operations_list = []
+    # --- Fetch one page of operation history with totals ---
+    ops_page = max(request.args.get("ops_page", 1, type=int), 1)
+    operation_history = fetch_machine_operations(db, ObjectId(machine_id), ops_page)
 
     # --- Get status list for the dropdown ---
-    status_list = [
-        {"value": "operating", "name": "Operating"},
-        {"value": "idle", "name": "Idle"},
-        {"value": "under_maintenance", "name": "Under Maintenance"},
-        {"value": "out_of_service", "name": "Out of Service"},
-    ]
+    status_list = MACHINE_STATUS_CHOICES
 
     # --- Calculate upcoming maintenance schedule ---
-    upcoming_maintenance = []
-    schedule = machine.get("maintenance_schedule", {})
-    trigger = schedule.get("trigger")
-
-    if trigger == "time_based":
-        next_date = schedule.get("next_maintenance_date")
-        gap = schedule.get("time_gap")
-        unit = schedule.get("time_gap_unit")
-
-        if next_date and gap and unit:
-            current_date = next_date
-            for _ in range(5):  # Get next 5 dates
-                upcoming_maintenance.append(current_date.strftime("%d %b, %Y"))
-                if unit == "days":
-                    current_date += datetime.timedelta(days=gap)
-                elif unit == "weeks":
-                    current_date += datetime.timedelta(weeks=gap)
-                elif unit == "months":
-                    # Simple month addition (doesn't account for end of month perfectly)
-                    current_date = current_date.replace(day=1) + datetime.timedelta(
-                        days=32 * gap
-                    )
-                    current_date = current_date.replace(day=min(next_date.day, 28))
-
-    elif trigger == "usage_based":
-        current_reading = schedule.get("current_meter_reading", 0)
-        gap = schedule.get("usage_gap")
-        unit = schedule.get("meter_unit")
-
-        if current_reading is not None and gap and unit:
-            next_due = (math.floor(current_reading / gap) + 1) * gap
-            for i in range(5):  # Get next 5 readings
-                upcoming_maintenance.append(f"At {int(next_due + (i * gap))} {unit}")
+    upcoming_maintenance_list = upcoming_maintenance(
+        machine.get("maintenance_schedule", {})
+    )
 
     return render_template(
         "pages/machines/machine-details.html",
         machine=machine,
         files_list=files_list,
-        operations_list=operations_list,
+        operations_list=operation_history["operations"],
+        operation_totals=operation_history["totals"],
+        operations_pagination=operation_history["pagination"],
         status_list=status_list,
-        upcoming_maintenance=upcoming_maintenance,
+        upcoming_maintenance=upcoming_maintenance_list,
+    )
+
+
+def find_machines_due(db, window_end, usage_ratio, projection=None):
+    """
+    Returns machines whose time-based maintenance falls on or before
+    `window_end` (overdue included) or whose usage-based maintenance has at
+    most `usage_ratio` of its usage gap left. Both branches are range scans
+    on the materialized `maintenance_due` indexes.
+    """
+    return db["machines"].find(
+        {
+            "$or": [
+                {"maintenance_due.date": {"$lte": window_end}},
+                {"maintenance_due.remaining_ratio": {"$lte": usage_ratio}},
+            ]
+        },
+        projection,
+    )
+
+
+@blueprint.route("/maintenance/due", methods=["GET"])
+@login_required
+def maintenance_due():
+    """
+    Lists machines due for preventive maintenance within the next `days` days
+    (time-based) or within `usage_ratio` of their usage gap (usage-based).
+    """
+    db = get_db()
+    try:
+        days = request.args.get("days", 14, type=int)
+        usage_ratio = request.args.get("usage_ratio", 0.1, type=float)
+
+        now = datetime.datetime.now()
+        window_end = now + datetime.timedelta(days=days)
+
+        machines_due = list(
+            find_machines_due(
+                db,
+                window_end,
+                usage_ratio,
+                {
+                    "machine_name": 1,
+                    "asset_id": 1,
+                    "current_status": 1,
+                    "criticality": 1,
+                    "maintenance_schedule.meter_unit": 1,
+                    "maintenance_due": 1,
+                },
+            )
+        )
+
+        for machine in machines_due:
+            due = machine["maintenance_due"]
+            due["overdue"] = (
+                due["date"] < now
+                if due["trigger"] == "time_based"
+                else due["remaining"] <= 0
+            )
+
+        # Time-based first by date, then usage-based by how little is left
+        machines_due.sort(
+            key=lambda m: (
+                m["maintenance_due"]["trigger"] != "time_based",
+                m["maintenance_due"].get("date") or now,
+                m["maintenance_due"].get("remaining_ratio", 0),
+            )
+        )
+
+        return Response(
+            json_util.dumps(
+                {
+                    "window_end": window_end,
+                    "usage_ratio": usage_ratio,
+                    "count": len(machines_due),
+                    "machines": machines_due,
+                }
+            ),
+            200,
+            {"Content-Type": "application/json"},
+        )
+    except Exception as e:
+        print(f"Error fetching maintenance due list: {e}")
+        return jsonify({"error": str(e)}), 500
+
+
+def _ical_fold(line):
+    """
+    Folds a content line at 75 octets (RFC 5545 3.1): continuation lines
+    start with a space. Never splits a UTF-8 character.
+    """
+    folded = []
+    chunk = ""
+    octets = 0
+    for char in line:
+        size = len(char.encode("utf-8"))
+        if octets + size > 75:
+            folded.append(chunk)
+            chunk, octets = " ", 1
+        chunk += char
+        octets += size
+    folded.append(chunk)
+    return "\r\n".join(folded) + "\r\n"
+
+
+def _ical_escape(text):
+    return (
+        str(text or "")
+        .replace("\\", "\\\\")
+        .replace(";", "\\;")
+        .replace(",", "\\,")
+        .replace("\n", "\\n")
+    )
+
+
+@blueprint.route("/maintenance/calendar.ics", methods=["GET"])
+@login_required
+def maintenance_calendar():
+    """
+    iCalendar feed of time-based preventive maintenance for the next `days`
+    days (default 90), one all-day event per occurrence from today on.
+    """
+    db = get_db()
+    days = min(request.args.get("days", 90, type=int), 366)
+    now = datetime.datetime.now()
+    window_start = now.replace(hour=0, minute=0, second=0, microsecond=0)
+    window_end = now + datetime.timedelta(days=days)
+
+    machines_due = db["machines"].find(
+        {"maintenance_due.date": {"$lte": window_end}},
+        {"machine_name": 1, "asset_id": 1, "maintenance_schedule": 1},
+    )
+
+    def generate():
+        dtstamp = datetime.datetime.utcnow().strftime("%Y%m%dT%H%M%SZ")
+        yield "BEGIN:VCALENDAR\r\nVERSION:2.0\r\nPRODID:-//MRO System//Maintenance//EN\r\n"
+        yield "X-WR-CALNAME:Preventive Maintenance\r\n"
+
+        for machine in machines_due:
+            schedule = machine["maintenance_schedule"]
+            gap = schedule.get("time_gap")
+            unit = schedule.get("time_gap_unit")
+            start = schedule["next_maintenance_date"]
+            summary = (
+                f"{_ical_escape('PM: ' + (machine.get('machine_name') or 'Machine'))}"
+                f" ({_ical_escape(machine.get('asset_id'))})"
+            )
+            if gap and unit:
+                # Overdue schedules start at their first occurrence from today
+                try:
+                    occurrence = first_occurrence_from(start, gap, unit, window_start)
+                except ValueError as e:
+                    print(f"Skipping machine {machine['_id']} in calendar: {e}")
+                    continue
+                due_date = schedule_date(start, gap, unit, occurrence)
+            elif start < window_start:
+                # Without a gap there is only the one, already past, date
+                continue
+            else:
+                occurrence = 0
+                due_date = start
+            while due_date <= window_end:
+                yield (
+                    "BEGIN:VEVENT\r\n"
+                    f"UID:{machine['_id']}-{due_date:%Y%m%d}@mro-system\r\n"
+                    f"DTSTAMP:{dtstamp}\r\n"
+                    f"DTSTART;VALUE=DATE:{due_date:%Y%m%d}\r\n"
+                    + _ical_fold(f"SUMMARY:{summary}")
+                    + "END:VEVENT\r\n"
+                )
+                # Without a gap there is only the one scheduled date
+                if not gap or not unit:
+                    break
+                occurrence += 1
+                due_date = schedule_date(start, gap, unit, occurrence)
+
+        yield "END:VCALENDAR\r\n"
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype="text/calendar",
+        headers={"Content-Disposition": 'inline; filename="maintenance.ics"'},
     )
 
 
@@ -647,26 +1176,369 @@ def update_machine_status():
             return jsonify({"success": False, "error": "Missing data"}), 400
 
         # Validate status
-        valid_statuses = ["operating", "idle", "under_maintenance", "out_of_service"]
-        if new_status not in valid_statuses:
+        if new_status not in MACHINE_STATUSES:
             return jsonify({"success": False, "error": "Invalid status value"}), 400
 
-        # Perform the update
-        result = machines_collection.update_one(
-            {"_id": ObjectId(machine_id)},
+        # Perform the update, reading the previous status in the same step
+        now = datetime.datetime.now()
+        previous = machines_collection.find_one_and_update(
+            {"_id": ObjectId(machine_id), "current_status": {"$ne": new_status}},
             {
                 "$set": {
                     "current_status": new_status,
-                    "updated_at": datetime.datetime.now(),
+                    "status_since": now,
+                    "updated_at": now,
                 }
             },
+            projection={"current_status": 1, "status_since": 1},
+            return_document=ReturnDocument.BEFORE,
         )
 
-        if result.matched_count == 0:
-            return jsonify({"success": False, "error": "Machine not found"}), 404
+        if previous is None:
+            # Either the machine does not exist or the status is unchanged
+            if not machines_collection.count_documents(
+                {"_id": ObjectId(machine_id)}, limit=1
+            ):
+                return jsonify({"success": False, "error": "Machine not found"}), 404
+            return jsonify({"success": True, "new_status": new_status})
+
+        log_status_changes(
+            db,
+            [
+                {
+                    "machine_id": previous["_id"],
+                    "from_status": previous.get("current_status"),
+                    "to_status": new_status,
+                    "status_since": previous.get("status_since"),
+                    "changed_at": now,
+                    "changed_by": ObjectId(session["user_id"]),
+                }
+            ],
+        )
 
         return jsonify({"success": True, "new_status": new_status})
 
     except Exception as e:
         print(f"Error updating machine status: {e}")
         return jsonify({"success": False, "error": str(e)}), 500
+
+
+@blueprint.route("/bulk-update-status", methods=["POST"])
+@login_required
+def bulk_update_machine_status():
+    """
+    Handles AJAX request to update the status of many machines at once.
+    Expects {"updates": [{"machine_id", "new_status"}, ...]} and returns a
+    result per item: updated, unchanged, not_found, invalid or conflict.
+    """
+    db = get_db()
+    machines_collection = db["machines"]
+
+    try:
+        data = request.get_json(silent=True) or {}
+        updates = data.get("updates")
+
+        if not isinstance(updates, list) or not updates:
+            return jsonify({"success": False, "error": "Missing data"}), 400
+        if len(updates) > MAX_BULK_STATUS_UPDATES:
+            return (
+                jsonify(
+                    {
+                        "success": False,
+                        "error": f"At most {MAX_BULK_STATUS_UPDATES} machines per request",
+                    }
+                ),
+                413,
+            )
+
+        # --- Validate; a machine with any invalid entry is not updated at
+        # all, otherwise the last of its entries wins ---
+        results = {}
+        requested = {}
+        for item in updates:
+            if not isinstance(item, dict):
+                results[str(item)] = {"status": "invalid", "error": "Invalid entry"}
+                continue
+            machine_id = str(item.get("machine_id", ""))
+            new_status = item.get("new_status")
+            if not ObjectId.is_valid(machine_id):
+                results[machine_id] = {"status": "invalid", "error": "Invalid machine ID"}
+                continue
+            machine_id = ObjectId(machine_id)
+            if new_status not in MACHINE_STATUSES:
+                results[str(machine_id)] = {
+                    "status": "invalid",
+                    "error": "Invalid status value",
+                }
+                requested.pop(machine_id, None)
+            elif str(machine_id) not in results:
+                requested[machine_id] = new_status
+
+        # --- Current state of all requested machines in one query ---
+        current = {
+            m["_id"]: m
+            for m in machines_collection.find(
+                {"_id": {"$in": list(requested)}},
+                {"current_status": 1, "status_since": 1},
+            )
+        }
+
+        now = datetime.datetime.now()
+        operations = []
+        pending = {}
+        for machine_id, new_status in requested.items():
+            machine = current.get(machine_id)
+            if not machine:
+                results[str(machine_id)] = {"status": "not_found"}
+            elif machine.get("current_status") == new_status:
+                results[str(machine_id)] = {"status": "unchanged"}
+            else:
+                # Only apply if nobody changed the status since we read it
+                operations.append(
+                    UpdateOne(
+                        {
+                            "_id": machine_id,
+                            "current_status": machine.get("current_status"),
+                        },
+                        {
+                            "$set": {
+                                "current_status": new_status,
+                                "status_since": now,
+                                "updated_at": now,
+                            }
+                        },
+                    )
+                )
+                pending[machine_id] = new_status
+
+        applied = set(pending)
+        if operations:
+            result = machines_collection.bulk_write(operations, ordered=False)
+            if result.modified_count != len(operations):
+                # Some writes lost a race; ours are the ones stamped with `now`
+                applied = {
+                    m["_id"]
+                    for m in machines_collection.find(
+                        {"_id": {"$in": list(pending)}, "status_since": now},
+                        {"_id": 1},
+                    )
+                }
+
+        log_status_changes(
+            db,
+            [
+                {
+                    "machine_id": machine_id,
+                    "from_status": current[machine_id].get("current_status"),
+                    "to_status": pending[machine_id],
+                    "status_since": current[machine_id].get("status_since"),
+                    "changed_at": now,
+                    "changed_by": ObjectId(session["user_id"]),
+                }
+                for machine_id in applied
+            ],
+        )
+
+        for machine_id, new_status in pending.items():
+            results[str(machine_id)] = (
+                {"status": "updated", "new_status": new_status}
+                if machine_id in applied
+                else {"status": "conflict", "error": "Status changed concurrently"}
+            )
+
+        return jsonify(
+            {
+                "success": True,
+                "updated": len(applied),
+                "results": [
+                    {"machine_id": machine_id, **outcome}
+                    for machine_id, outcome in results.items()
+                ],
+            }
+        )
+
+    except Exception as e:
+        print(f"Error bulk updating machine status: {e}")
+        return jsonify({"success": False, "error": str(e)}), 500
+
+
+# Upper bound on readings accepted in one ingestion request
+MAX_METER_READINGS_PER_REQUEST = 5000
+
+
+@blueprint.route("/api/meter-readings", methods=["POST"])
+@login_required
+def ingest_meter_readings_api():
+    """
+    Batch ingestion of meter readings, e.g. from PLC gateways. Expects
+    {"readings": [{"machine_id", "timestamp" (ISO 8601), "reading"}, ...]}
+    and returns how many were stored plus per-item errors.
+    """
+    db = get_db()
+    try:
+        data = request.get_json(silent=True) or {}
+        readings = data.get("readings")
+
+        if not isinstance(readings, list) or not readings:
+            return jsonify({"success": False, "error": "No readings provided"}), 400
+        if len(readings) > MAX_METER_READINGS_PER_REQUEST:
+            return (
+                jsonify(
+                    {
+                        "success": False,
+                        "error": f"At most {MAX_METER_READINGS_PER_REQUEST} readings per request",
+                    }
+                ),
+                413,
+            )
+
+        valid_readings, errors = validate_meter_readings(readings)
+        inserted, machines_updated, ingest_errors = (
+            ingest_meter_readings(db, valid_readings) if valid_readings else (0, 0, [])
+        )
+        errors.extend(ingest_errors)
+
+        return jsonify(
+            {
+                "success": True,
+                "inserted": inserted,
+                "machines_updated": machines_updated,
+                "errors": sorted(errors, key=lambda e: e["index"]),
+            }
+        )
+
+    except Exception as e:
+        print(f"Error ingesting meter readings: {e}")
+        return jsonify({"success": False, "error": str(e)}), 500
+
+
+@blueprint.route("/api/<string:machine_id>/meter-rollups", methods=["GET"])
+@login_required
+def machine_meter_rollups(machine_id):
+    """
+    Returns hourly or daily meter rollups (min/max/count/usage) for a machine
+    between `start` and `end` (ISO 8601, default the last 7 days).
+    """
+    db = get_db()
+    try:
+        granularity = request.args.get("granularity", "hour")
+        if granularity not in ("hour", "day"):
+            return jsonify({"error": "granularity must be 'hour' or 'day'"}), 400
+
+        end = (
+            parse_timestamp(request.args["end"])
+            if request.args.get("end")
+            else datetime.datetime.utcnow()
+        )
+        start = (
+            parse_timestamp(request.args["start"])
+            if request.args.get("start")
+            else end - datetime.timedelta(days=7)
+        )
+
+        rollups = list(
+            db[METER_ROLLUPS_COLLECTION]
+            .find(
+                {
+                    "machine_id": ObjectId(machine_id),
+                    "granularity": granularity,
+                    "bucket_start": {"$gte": start, "$lt": end},
+                },
+                {"_id": 0, "machine_id": 0},
+            )
+            .sort("bucket_start", 1)
+        )
+        for rollup in rollups:
+            rollup["usage"] = rollup["max_reading"] - rollup["min_reading"]
+
+        return Response(
+            json_util.dumps({"granularity": granularity, "rollups": rollups}),
+            200,
+            {"Content-Type": "application/json"},
+        )
+    except Exception as e:
+        print(f"Error fetching meter rollups: {e}")
+        return jsonify({"error": str(e)}), 500
+
+
+@blueprint.route("/api/<string:machine_id>/status-events", methods=["GET"])
+@login_required
+def machine_status_events(machine_id):
+    """Returns a machine's status change history, newest first, paginated."""
+    db = get_db()
+    try:
+        page = max(request.args.get("page", 1, type=int), 1)
+        per_page = min(max(request.args.get("per_page", 20, type=int), 1), 100)
+
+        events = list(
+            db[STATUS_EVENTS_COLLECTION]
+            .find({"machine_id": ObjectId(machine_id)}, {"machine_id": 0})
+            .sort("changed_at", -1)
+            .skip((page - 1) * per_page)
+            .limit(per_page)
+        )
+        return Response(
+            json_util.dumps({"page": page, "per_page": per_page, "events": events}),
+            200,
+            {"Content-Type": "application/json"},
+        )
+    except Exception as e:
+        print(f"Error fetching status events: {e}")
+        return jsonify({"error": str(e)}), 500
+
+
+@blueprint.route("/api/utilization", methods=["GET"])
+@login_required
+def machines_utilization():
+    """
+    Utilization (operating share) and availability (operating + idle share)
+    per machine for the days `start`..`end` (YYYY-MM-DD, end inclusive,
+    default the last 30 days). Optional repeated `machine_id` args narrow
+    the report.
+    """
+    db = get_db()
+    try:
+        today = datetime.datetime.now().replace(
+            hour=0, minute=0, second=0, microsecond=0
+        )
+        end = (
+            datetime.datetime.strptime(request.args["end"], "%Y-%m-%d")
+            if request.args.get("end")
+            else today
+        ) + datetime.timedelta(days=1)
+        start = (
+            datetime.datetime.strptime(request.args["start"], "%Y-%m-%d")
+            if request.args.get("start")
+            else end - datetime.timedelta(days=30)
+        )
+        machine_ids = [
+            ObjectId(mid)
+            for mid in request.args.getlist("machine_id")
+            if ObjectId.is_valid(mid)
+        ]
+
+        report = utilization_report(db, start, end, machine_ids or None)
+
+        # Attach names in one query
+        names = {
+            m["_id"]: m
+            for m in db["machines"].find(
+                {"_id": {"$in": [r["machine_id"] for r in report]}},
+                {"machine_name": 1, "asset_id": 1},
+            )
+        }
+        for row in report:
+            machine = names.get(row["machine_id"], {})
+            row["machine_name"] = machine.get("machine_name")
+            row["asset_id"] = machine.get("asset_id")
+
+        return Response(
+            json_util.dumps({"start": start, "end": end, "machines": report}),
+            200,
+            {"Content-Type": "application/json"},
+        )
+    except ValueError:
+        return jsonify({"error": "Dates must be YYYY-MM-DD"}), 400
+    except Exception as e:
+        print(f"Error computing utilization: {e}")
+        return jsonify({"error": str(e)}), 500
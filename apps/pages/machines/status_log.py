@@ -0,0 +1,141 @@
+import datetime
+from collections import defaultdict
+
+from pymongo import UpdateOne
+
+STATUS_EVENTS_COLLECTION = "machine_status_events"
+UTILIZATION_COLLECTION = "machine_utilization_daily"
+
+
+def ensure_status_log_indexes(db):
+    db[STATUS_EVENTS_COLLECTION].create_index([("machine_id", 1), ("changed_at", -1)])
+    db[STATUS_EVENTS_COLLECTION].create_index([("changed_at", -1)])
+    db[UTILIZATION_COLLECTION].create_index(
+        [("machine_id", 1), ("day", 1)], unique=True
+    )
+    db[UTILIZATION_COLLECTION].create_index([("day", 1)])
+
+
+def split_by_day(start, end):
+    """
+    Splits the interval [start, end) at midnight boundaries.
+    Yields (day_start, seconds) for each calendar day it touches.
+    """
+    cursor = start
+    while cursor < end:
+        day_start = cursor.replace(hour=0, minute=0, second=0, microsecond=0)
+        next_day = day_start + datetime.timedelta(days=1)
+        segment_end = min(next_day, end)
+        yield day_start, (segment_end - cursor).total_seconds()
+        cursor = segment_end
+
+
+def log_status_changes(db, changes):
+    """
+    Appends status change events and folds the time spent in the previous
+    status into the per-machine daily buckets.
+
+    Each change is a dict with machine_id, from_status, to_status,
+    status_since (when from_status began, None if unknown), changed_at and
+    changed_by. Writes one insert_many and at most one bulk_write.
+    """
+    if not changes:
+        return
+
+    db[STATUS_EVENTS_COLLECTION].insert_many(
+        [
+            {
+                "machine_id": c["machine_id"],
+                "from_status": c["from_status"],
+                "to_status": c["to_status"],
+                "changed_at": c["changed_at"],
+                "changed_by": c.get("changed_by"),
+            }
+            for c in changes
+        ],
+        ordered=False,
+    )
+
+    # (machine_id, day) -> {status: seconds}
+    buckets = defaultdict(lambda: defaultdict(float))
+    for c in changes:
+        # Machines created before the log existed have no known start
+        if not c.get("status_since") or not c.get("from_status"):
+            continue
+        for day, seconds in split_by_day(c["status_since"], c["changed_at"]):
+            buckets[(c["machine_id"], day)][c["from_status"]] += seconds
+
+    if buckets:
+        db[UTILIZATION_COLLECTION].bulk_write(
+            [
+                UpdateOne(
+                    {"machine_id": machine_id, "day": day},
+                    {
+                        "$inc": {
+                            f"seconds.{status}": seconds
+                            for status, seconds in per_status.items()
+                        }
+                    },
+                    upsert=True,
+                )
+                for (machine_id, day), per_status in buckets.items()
+            ],
+            ordered=False,
+        )
+
+
+def utilization_report(db, start, end, machine_ids=None):
+    """
+    Time in each status per machine for the days [start, end), read from the
+    daily buckets. The still-open interval of each machine's current status
+    is added on top, so the figures are up to date without replaying events.
+    """
+    match = {"day": {"$gte": start, "$lt": end}}
+    if machine_ids:
+        match["machine_id"] = {"$in": machine_ids}
+
+    totals = defaultdict(lambda: defaultdict(float))
+    pipeline = [
+        {"$match": match},
+        {"$project": {"machine_id": 1, "seconds": {"$objectToArray": "$seconds"}}},
+        {"$unwind": "$seconds"},
+        {
+            "$group": {
+                "_id": {"machine_id": "$machine_id", "status": "$seconds.k"},
+                "seconds": {"$sum": "$seconds.v"},
+            }
+        },
+    ]
+    for row in db[UTILIZATION_COLLECTION].aggregate(pipeline):
+        totals[row["_id"]["machine_id"]][row["_id"]["status"]] += row["seconds"]
+
+    # --- Open intervals: current status since status_since ---
+    now = datetime.datetime.now()
+    open_query = {"status_since": {"$lt": min(end, now)}}
+    if machine_ids:
+        open_query["_id"] = {"$in": machine_ids}
+    for machine in db["machines"].find(
+        open_query, {"current_status": 1, "status_since": 1}
+    ):
+        open_start = max(machine["status_since"], start)
+        open_end = min(end, now)
+        if open_start < open_end and machine.get("current_status"):
+            totals[machine["_id"]][machine["current_status"]] += (
+                open_end - open_start
+            ).total_seconds()
+
+    report = []
+    for machine_id, per_status in totals.items():
+        tracked = sum(per_status.values())
+        operating = per_status.get("operating", 0)
+        available = operating + per_status.get("idle", 0)
+        report.append(
+            {
+                "machine_id": machine_id,
+                "seconds": dict(per_status),
+                "tracked_seconds": tracked,
+                "utilization": operating / tracked if tracked else None,
+                "availability": available / tracked if tracked else None,
+            }
+        )
+    return report
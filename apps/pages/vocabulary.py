@@ -0,0 +1,51 @@
+import threading
+import time
+
+from flask import current_app
+
+# Vocabulary name -> loader returning the raw values from the database
+VOCABULARY_LOADERS = {
+    "machine_tags": lambda db: db["machines"].distinct("tags"),
+    "machine_manufacturers": lambda db: db["machines"].distinct("manufacturer"),
+    "material_categories": lambda db: db.raw_material_categories.distinct("name"),
+    "material_suppliers": lambda db: db.raw_material_suppliers.distinct("name"),
+    "material_uoms": lambda db: db.raw_materials.distinct("uom"),
+}
+
+_cache = {}  # name -> (expires_at, values)
+# name -> number of invalidations; a load that overlapped one is not cached
+_generations = {}
+_lock = threading.Lock()
+
+
+def get_vocabulary(db, name):
+    """
+    Returns the sorted, non-empty values of a facet vocabulary (tags,
+    manufacturers, categories, ...) from an in-process cache, loading it
+    from the database when missing or older than VOCABULARY_CACHE_TTL.
+
+    The cache is per process: write paths call `invalidate_vocabulary`,
+    other workers pick the change up when their entry expires.
+    """
+    now = time.monotonic()
+    entry = _cache.get(name)
+    if entry and entry[0] > now:
+        return list(entry[1])
+
+    with _lock:
+        generation = _generations.get(name, 0)
+    values = sorted({v for v in VOCABULARY_LOADERS[name](db) if v})
+    ttl = current_app.config.get("VOCABULARY_CACHE_TTL", 300)
+    with _lock:
+        # Invalidated while loading: the values may predate the write
+        if _generations.get(name, 0) == generation:
+            _cache[name] = (now + ttl, values)
+    return list(values)
+
+
+def invalidate_vocabulary(*names):
+    """Drops cached vocabularies so the next read reloads them."""
+    with _lock:
+        for name in names:
+            _cache.pop(name, None)
+            _generations[name] = _generations.get(name, 0) + 1